@@ -2,6 +2,8 @@ package com.lrdxr.client
 
 import android.Manifest
 import android.content.pm.PackageManager
+import android.graphics.Bitmap
+import android.graphics.drawable.BitmapDrawable
 import android.os.Bundle
 import android.util.Log
 import android.widget.Toast
@@ -18,6 +20,16 @@ import org.json.JSONObject
 import org.webrtc.*
 import java.net.URI
 import java.nio.ByteBuffer
+import java.util.zip.Inflater
+
+private const val CURSOR_PROTOCOL_VERSION = 1
+private const val CURSOR_MSG_POSITION = 1
+private const val CURSOR_MSG_SHAPE_IMAGE = 2
+private const val CURSOR_MSG_SHAPE_REF = 3
+// Must match SHAPE_CACHE_SIZE on the host so both LRUs evict the same shapes
+private const val CURSOR_CACHE_SIZE = 64
+
+private class CursorShape(val bitmap: Bitmap, val hotX: Int, val hotY: Int)
 
 class MainActivity : AppCompatActivity() {
 
@@ -41,8 +53,19 @@ class MainActivity : AppCompatActivity() {
     // UI State & Logic
     private var streamWidth = 1920
     private var streamHeight = 1080
+    // Decoded frame size; differs from the requested size when the host
+    // streams a single window or region
+    private var videoWidth = 0
+    private var videoHeight = 0
     private var lastNormX = 0.5f
     private var lastNormY = 0.5f
+    private var lastCursorSeq = -1
+    private var cursorShape: CursorShape? = null
+    // Access-ordered, so a REF lookup refreshes the entry just like on the host
+    private val cursorShapes = object : LinkedHashMap<Long, CursorShape>(16, 0.75f, true) {
+        override fun removeEldestEntry(eldest: MutableMap.MutableEntry<Long, CursorShape>?) =
+            size > CURSOR_CACHE_SIZE
+    }
 
     private val hideUiHandler = android.os.Handler(android.os.Looper.getMainLooper())
     private val hideUiRunnable = Runnable {
@@ -161,9 +184,23 @@ class MainActivity : AppCompatActivity() {
     }
 
     private fun initWebRTC() {
+        lastCursorSeq = -1
+        cursorShapes.clear()
         eglBase = EglBase.create()
         
-        surfaceView.init(eglBase?.eglBaseContext, null)
+        videoWidth = 0
+        videoHeight = 0
+        surfaceView.init(eglBase?.eglBaseContext, object : RendererCommon.RendererEvents {
+            override fun onFirstFrameRendered() {}
+            override fun onFrameResolutionChanged(width: Int, height: Int, rotation: Int) {
+                runOnUiThread {
+                    val rotated = rotation % 180 != 0
+                    videoWidth = if (rotated) height else width
+                    videoHeight = if (rotated) width else height
+                    updateCursorPosition()
+                }
+            }
+        })
         surfaceView.setMirror(false)
         
         // CRITICAL FIX: Enable Hardware Scaler to allow smooth resizing on Quest.
@@ -237,11 +274,14 @@ class MainActivity : AppCompatActivity() {
                         if (buffer != null && !buffer.binary) return
                         val data = buffer?.data ?: return
                         if (data.remaining() == 8) {
+                            // Legacy host: two big-endian floats
                             val normX = data.getFloat()
                             val normY = data.getFloat()
                             runOnUiThread {
                                 updateCursorPosition(normX, normY)
                             }
+                        } else {
+                            handleCursorMessage(data)
                         }
                     }
                 })
@@ -251,6 +291,85 @@ class MainActivity : AppCompatActivity() {
         })!!
     }
 
+    // --- Cursor Protocol ---
+
+    // Versioned binary messages from host/cursor.py, big endian:
+    // version:u8, type:u8, then a type specific body
+    private fun handleCursorMessage(data: ByteBuffer) {
+        if (data.remaining() < 2) return
+        val version = data.get().toInt() and 0xFF
+        val type = data.get().toInt() and 0xFF
+        if (version != CURSOR_PROTOCOL_VERSION) return
+
+        when (type) {
+            CURSOR_MSG_POSITION -> {
+                // flags:u8, seq:u16, timestamp_ms:u32, x:u16, y:u16[, track:u8]
+                if (data.remaining() < 11) return
+                data.get() // flags (buttons)
+                val seq = data.getShort().toInt() and 0xFFFF
+                data.getInt() // timestamp
+                val normX = (data.getShort().toInt() and 0xFFFF) / 65535f
+                val normY = (data.getShort().toInt() and 0xFFFF) / 65535f
+                val track = if (data.remaining() >= 1) data.get().toInt() and 0xFF else 0
+                // Data channel is ordered, but drop anything stale after a wrap-safe compare
+                if (lastCursorSeq >= 0 && ((seq - lastCursorSeq) and 0xFFFF) > 0x8000) return
+                lastCursorSeq = seq
+                runOnUiThread {
+                    // Only the first video track is shown; the pointer may be on another monitor
+                    if (track == 0) {
+                        updateCursorPosition(normX, normY)
+                    } else {
+                        cursorView.visibility = View.GONE
+                    }
+                }
+            }
+            CURSOR_MSG_SHAPE_IMAGE -> {
+                // hash:u64, width:u16, height:u16, hot_x:u16, hot_y:u16, zlib(ARGB u32 pixels)
+                if (data.remaining() < 16) return
+                val hash = data.getLong()
+                val width = data.getShort().toInt() and 0xFFFF
+                val height = data.getShort().toInt() and 0xFFFF
+                val hotX = data.getShort().toInt() and 0xFFFF
+                val hotY = data.getShort().toInt() and 0xFFFF
+                val shape = decodeCursorShape(data, width, height, hotX, hotY) ?: return
+                cursorShapes[hash] = shape
+                runOnUiThread { setCursorShape(shape) }
+            }
+            CURSOR_MSG_SHAPE_REF -> {
+                // hash:u64 of an image sent earlier
+                if (data.remaining() < 8) return
+                val shape = cursorShapes[data.getLong()] ?: return
+                runOnUiThread { setCursorShape(shape) }
+            }
+        }
+    }
+
+    private fun decodeCursorShape(data: ByteBuffer, width: Int, height: Int, hotX: Int, hotY: Int): CursorShape? {
+        if (width == 0 || height == 0) return null
+        val compressed = ByteArray(data.remaining())
+        data.get(compressed)
+        val pixels = ByteArray(width * height * 4)
+        val inflater = Inflater()
+        try {
+            inflater.setInput(compressed)
+            if (inflater.inflate(pixels) != pixels.size) return null
+        } catch (e: java.util.zip.DataFormatException) {
+            Log.w(TAG, "Bad cursor image", e)
+            return null
+        } finally {
+            inflater.end()
+        }
+        val argb = IntArray(width * height)
+        ByteBuffer.wrap(pixels).asIntBuffer().get(argb)
+        return CursorShape(Bitmap.createBitmap(argb, width, height, Bitmap.Config.ARGB_8888), hotX, hotY)
+    }
+
+    private fun setCursorShape(shape: CursorShape) {
+        cursorShape = shape
+        cursorView.background = BitmapDrawable(resources, shape.bitmap)
+        updateCursorPosition()
+    }
+
     // --- Cursor Logic (The Fix for Letterboxing) ---
 
     private fun updateCursorPosition(normX: Float = lastNormX, normY: Float = lastNormY) {
@@ -264,7 +383,11 @@ class MainActivity : AppCompatActivity() {
         // Safety check to prevent divide by zero before layout is ready
         if (viewWidth == 0f || viewHeight == 0f || streamWidth == 0 || streamHeight == 0) return
 
-        val videoAspectRatio = streamWidth.toFloat() / streamHeight.toFloat()
+        val videoAspectRatio = if (videoWidth > 0 && videoHeight > 0) {
+            videoWidth.toFloat() / videoHeight.toFloat()
+        } else {
+            streamWidth.toFloat() / streamHeight.toFloat()
+        }
         val viewAspectRatio = viewWidth / viewHeight
         
         var actualWidth = viewWidth
@@ -284,8 +407,24 @@ class MainActivity : AppCompatActivity() {
         }
         
         // Map normalized coordinates (0.0 - 1.0) to the actual video rect
-        cursorView.x = xOffset + (normX * actualWidth)
-        cursorView.y = yOffset + (normY * actualHeight)
+        var hotX = 0f
+        var hotY = 0f
+        cursorShape?.let { shape ->
+            // Host cursor images are in captured pixels; scale them with the video
+            val scale = actualWidth / (if (videoWidth > 0) videoWidth else streamWidth)
+            val width = (shape.bitmap.width * scale).toInt().coerceAtLeast(1)
+            val height = (shape.bitmap.height * scale).toInt().coerceAtLeast(1)
+            val params = cursorView.layoutParams
+            if (params.width != width || params.height != height) {
+                params.width = width
+                params.height = height
+                cursorView.layoutParams = params
+            }
+            hotX = shape.hotX * scale
+            hotY = shape.hotY * scale
+        }
+        cursorView.x = xOffset + (normX * actualWidth) - hotX
+        cursorView.y = yOffset + (normY * actualHeight) - hotY
         
         if (cursorView.visibility != View.VISIBLE) {
             cursorView.visibility = View.VISIBLE
@@ -367,6 +506,17 @@ class MainActivity : AppCompatActivity() {
                     json.getString("candidate")
                 )
                 peerConnection.addIceCandidate(candidate)
+            } else if (type == "ice-candidates") {
+                // Several candidates batched by the signaling server
+                val candidates = json.getJSONArray("candidates")
+                for (i in 0 until candidates.length()) {
+                    val c = candidates.getJSONObject(i)
+                    peerConnection.addIceCandidate(IceCandidate(
+                        c.getString("sdpMid"),
+                        c.getInt("sdpMLineIndex"),
+                        c.getString("candidate")
+                    ))
+                }
             }
         } catch (e: Exception) {
             Log.e(TAG, "Error handling message", e)
@@ -0,0 +1,183 @@
+import logging
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstWebRTC', '1.0')
+from gi.repository import Gst, GstWebRTC, GLib
+
+from rate_control import BitrateController, FecController, LinkStats
+
+logger = logging.getLogger(__name__)
+
+
+def _field(stat, name, default=None):
+    if stat.has_field(name):
+        return stat.get_value(name)
+    return default
+
+
+def parse_stats(reply):
+    """Condense a webrtcbin get-stats reply structure into LinkStats."""
+    stats = LinkStats()
+
+    def visit(field_id, value, user_data):
+        if not isinstance(value, Gst.Structure) or not value.has_field('type'):
+            return True
+        stat_type = value.get_value('type')
+        if stat_type == GstWebRTC.WebRTCStatsType.OUTBOUND_RTP:
+            stats.packets_sent += _field(value, 'packets-sent', 0)
+            stats.nack_count += _field(value, 'nack-count', 0)
+            stats.pli_count += _field(value, 'pli-count', 0)
+            stats.fir_count += _field(value, 'fir-count', 0)
+        elif stat_type == GstWebRTC.WebRTCStatsType.REMOTE_INBOUND_RTP:
+            rtt = _field(value, 'round-trip-time')
+            if rtt is not None:
+                stats.rtt = max(stats.rtt or 0.0, rtt)
+            fraction_lost = _field(value, 'fraction-lost')
+            if fraction_lost is not None:
+                stats.fraction_lost = max(stats.fraction_lost or 0.0, fraction_lost)
+            stats.packets_lost += max(0, _field(value, 'packets-lost', 0))
+        elif stat_type in (GstWebRTC.WebRTCStatsType.TRANSPORT, GstWebRTC.WebRTCStatsType.CANDIDATE_PAIR):
+            available = _field(value, 'available-outgoing-bitrate')
+            if available:
+                stats.available_bitrate = available / 1000
+        return True
+
+    reply.foreach(visit, None)
+    return stats
+
+
+class AdaptiveBitrate:
+    """Polls every attached session's stats and retunes the shared encoder.
+
+    All peers share one encoder, so the stream follows the weakest link.
+    With `adapt_framerate` the capture rate steps down once the bitrate is
+    pinned near the minimum, and back up when the link recovers.
+
+    A simulcast capture keeps its encoders at fixed layer bitrates instead,
+    and each peer is moved to the best layer its own estimate can carry.
+
+    With `adapt_fec` each peer negotiated with FEC gets an overhead that
+    follows its loss (FecController), and the encoder bitrate leaves room
+    for the largest one.
+    """
+
+    FRAMERATES = [30, 20, 15, 10]
+
+    def __init__(self, capture, sessions, min_bitrate=2000, max_bitrate=30000,
+                 interval=1.0, adapt_framerate=False, adapt_fec=False):
+        self.capture = capture
+        self.sessions = sessions # Callable returning the live StreamSessions
+        self.min_bitrate = min_bitrate
+        self.max_bitrate = max_bitrate
+        self.interval = interval
+        self.adapt_framerate = adapt_framerate
+        self.adapt_fec = adapt_fec
+        self.controllers = {}
+        self.fec_controllers = {}
+        self.live = {}
+        self.bitrate = None
+        self.framerate_index = 0
+        self.timeout_id = None
+
+    def start(self):
+        if self.timeout_id is None:
+            self.timeout_id = GLib.timeout_add(int(self.interval * 1000), self.poll)
+
+    def stop(self):
+        if self.timeout_id is not None:
+            GLib.source_remove(self.timeout_id)
+            self.timeout_id = None
+
+    def poll(self):
+        live = {session.session_id: session for session in self.sessions() if session.webrtcbin}
+        self.live = live
+        for session_id in list(self.controllers):
+            if session_id not in live:
+                del self.controllers[session_id]
+                self.fec_controllers.pop(session_id, None)
+        for session_id, session in live.items():
+            promise = Gst.Promise.new_with_change_func(self.on_stats, session_id, None)
+            session.webrtcbin.emit('get-stats', None, promise)
+        return True
+
+    def on_stats(self, promise, session_id, *args):
+        # Called on webrtcbin's streaming thread; the controllers belong to
+        # the main context, where poll() prunes them
+        reply = promise.get_reply()
+        if reply:
+            GLib.idle_add(self.update, session_id, parse_stats(reply))
+
+    def update(self, session_id, stats):
+        if session_id not in self.live:
+            # The session went away while its stats were in flight
+            return False
+        controller = self.controllers.get(session_id)
+        if controller is None:
+            controller = BitrateController(self.min_bitrate, self.max_bitrate, start_bitrate=self.bitrate)
+            self.controllers[session_id] = controller
+        previous = controller.previous
+        controller.update(stats)
+        session = self.live[session_id]
+        if self.adapt_fec and session.fec_percentage is not None:
+            fec = self.fec_controllers.get(session_id)
+            if fec is None:
+                fec = FecController(session.fec_percentage)
+                self.fec_controllers[session_id] = fec
+            session.set_fec_percentage(fec.update(controller.last_loss))
+        # With RTX or FEC most losses never reach the decoder, and the
+        # receiver sends a PLI for the ones that could not be repaired
+        if previous and not session.repairs_loss and self.unrepaired_loss(previous, stats):
+            self.capture.request_keyframe(session.layer)
+        if self.capture.simulcast:
+            session.set_layer(self.pick_layer(controller.bitrate, session.layer))
+            return False
+        self.apply()
+        return False
+
+    @staticmethod
+    def unrepaired_loss(previous, stats):
+        # Packets went missing but the receiver did not ask for a keyframe
+        # (some clients never send PLI); the picture would stay corrupt until
+        # the next periodic keyframe.
+        lost = stats.packets_lost > previous.packets_lost
+        requested = (stats.pli_count + stats.fir_count) > (previous.pli_count + previous.fir_count)
+        return lost and not requested
+
+    def pick_layer(self, target, current, headroom=1.2):
+        """Index of the best layer `target` kbps can carry.
+
+        Moving up needs `headroom` over the layer's bitrate, so a peer does
+        not bounce between two layers on a borderline estimate.
+        """
+        for layer in self.capture.layers:
+            needed = self.capture.layer_bitrate(layer)
+            if layer.index < current:
+                needed *= headroom
+            if needed <= target:
+                return layer.index
+        return len(self.capture.layers) - 1
+
+    def apply(self):
+        if not self.controllers:
+            return
+        target = min(c.bitrate for c in list(self.controllers.values()))
+        # FEC packets go out on top of the encoded stream
+        fec = max([session.fec_percentage or 0 for session in self.live.values()], default=0)
+        target = int(max(self.min_bitrate, target / (1 + fec / 100)))
+        # Avoid poking the encoder for changes it cannot resolve anyway
+        if self.bitrate is None or abs(target - self.bitrate) > self.bitrate * 0.03:
+            logger.info(f"Adaptive bitrate: {self.bitrate} -> {target} kbps")
+            self.bitrate = target
+            self.capture.set_bitrate(target)
+
+        if self.adapt_framerate:
+            index = self.framerate_index
+            if target <= self.min_bitrate * 1.2 and index < len(self.FRAMERATES) - 1:
+                index += 1
+            elif target >= self.min_bitrate * 3 and index > 0:
+                index -= 1
+            if index != self.framerate_index:
+                self.framerate_index = index
+                logger.info(f"Adaptive bitrate: capture framerate -> {self.FRAMERATES[index]} fps")
+                self.capture.set_framerate(self.FRAMERATES[index])
@@ -0,0 +1,221 @@
+"""Offline benchmarks for the host streaming pipeline.
+
+Every mode runs against videotestsrc and in-process loopback peers, so no X
+display, headset or signaling server is needed:
+
+    python benchmark.py reconnect --iterations 10
+    python benchmark.py setup
+    python benchmark.py startup --resolutions 1280x720 1920x1080
+    python benchmark.py lan --signaling-delay-ms 5
+    python benchmark.py loop --idle 10
+    python benchmark.py encoders --resolutions 1920x1080 3840x2160
+    python benchmark.py roi --encoder vaapi --input desktop.mkv
+    python benchmark.py abr --loss 0.01
+    python benchmark.py keyframes
+    python benchmark.py fec --loss 0.03 --burst 3
+    python benchmark.py convert --resolutions 1920x1080 3840x2160
+    python benchmark.py threads --source 3840x2160 --output 1920x1080
+    python benchmark.py cursor --move-rate 1000
+    python benchmark.py viewers --max-viewers 4
+    python benchmark.py simulcast --resolution 1920x1080
+    python benchmark.py importtime --help-budget-ms 500
+    python benchmark.py signaling --rooms 200
+
+The 'damage', 'region' and 'display' modes capture a real X display and need DISPLAY
+set, or --xvfb to run against a private Xvfb on a headless machine:
+
+    python benchmark.py region --region 1000x800+100+100
+    python benchmark.py display --sizes 1280x720 1920x1080
+    python benchmark.py damage --xvfb
+
+Each mode lives in a module of benchmarks/ that is only imported when the
+mode runs; abr, signaling and importtime need no GStreamer.
+"""
+import argparse
+import importlib
+import logging
+import os
+
+from stream_config import ENCODER_NAMES
+from virtual_display import VirtualDisplay
+
+logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+
+
+def mode(module, name):
+    """Run `name` from benchmarks.`module`, imported only once its mode is picked."""
+    def run(args):
+        return getattr(importlib.import_module(f"benchmarks.{module}"), name)(args)
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Host streaming benchmarks")
+    subparsers = parser.add_subparsers(dest='mode', required=True)
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--encoder', default='auto', choices=('auto',) + ENCODER_NAMES)
+
+    xserver = argparse.ArgumentParser(add_help=False)
+    xserver.add_argument('--xvfb', action='store_true', help="Run against a private Xvfb instead of $DISPLAY")
+
+    reconnect = subparsers.add_parser('reconnect', parents=[common], help="Reconnect-to-first-frame latency")
+    reconnect.add_argument('--iterations', type=int, default=10)
+    reconnect.add_argument('--timeout', type=float, default=10.0, help="Seconds to wait for the first frame")
+    reconnect.add_argument('--cold', action='store_true', help="Also measure rebuilding the pipeline per connect")
+    reconnect.set_defaults(func=mode('connect', 'bench_reconnect'))
+
+    setup = subparsers.add_parser('setup', parents=[common], help="Connection setup time and signaling stalls")
+    setup.add_argument('--iterations', type=int, default=5)
+    setup.add_argument('--timeout', type=float, default=10.0)
+    setup.add_argument('--legacy', action='store_true', help="Also run the old blocking sleep sequence")
+    setup.set_defaults(func=mode('connect', 'bench_setup'))
+
+    startup = subparsers.add_parser('startup', parents=[common], help="client_connected to first RTP packet per startup strategy")
+    startup.add_argument('--resolutions', nargs='+', default=['1280x720', '1920x1080'],
+                         help="Resolutions clients alternate between")
+    startup.add_argument('--iterations', type=int, default=6)
+    startup.add_argument('--timeout', type=float, default=10.0)
+    startup.set_defaults(func=mode('connect', 'bench_startup'))
+
+    lan = subparsers.add_parser('lan', parents=[common], help="Connection setup time with trickle ICE vs. the LAN fast path")
+    lan.add_argument('--iterations', type=int, default=10)
+    lan.add_argument('--timeout', type=float, default=10.0)
+    lan.add_argument('--signaling-delay-ms', type=float, default=5.0,
+                     help="One-way delay of each host signaling message, as over a Wi-Fi hop")
+    lan.add_argument('--interfaces', help="Comma separated interfaces or addresses for the LAN fast path")
+    lan.add_argument('--stun', help="Also measure trickle ICE with this STUN server (needs network access)")
+    lan.set_defaults(func=mode('connect', 'bench_lan'))
+
+    loop = subparsers.add_parser('loop', parents=[common], help="Offer/answer round trip and idle wakeups per event loop setup")
+    loop.add_argument('--iterations', type=int, default=10)
+    loop.add_argument('--timeout', type=float, default=10.0)
+    loop.add_argument('--idle', type=float, default=5.0, help="Seconds to count wakeups with no viewer")
+    loop.set_defaults(func=mode('connect', 'bench_loop'))
+
+    roi = subparsers.add_parser('roi', parents=[common], help="Quality per bit of flat vs. region-of-interest encoding")
+    roi.add_argument('--input', help="Recorded desktop video to encode (default: synthetic moving text)")
+    roi.add_argument('--resolution', default='1920x1080', help="Size of the synthetic frames")
+    roi.add_argument('--frames', type=int, help="Frames to encode (default: all of --input, 300 synthetic)")
+    roi.add_argument('--bitrate', type=int, default=4000, help="Encoder bitrate for both runs (kbps)")
+    roi.add_argument('--gop', type=int, default=300)
+    roi.add_argument('--pointer-size', type=int, default=256, help="Side of the square around the pointer")
+    roi.add_argument('--timeout', type=float, default=300.0)
+    roi.set_defaults(func=mode('screen_content', 'bench_roi'))
+
+    encoders = subparsers.add_parser('encoders', help="Per-encoder throughput, latency and CPU")
+    encoders.add_argument('--candidates', nargs='+', choices=ENCODER_NAMES)
+    encoders.add_argument('--resolutions', nargs='+', default=['1920x1080', '2560x1440', '3840x2160'])
+    encoders.add_argument('--frames', type=int, default=300)
+    encoders.set_defaults(func=mode('encoding', 'bench_encoders'))
+
+    damage = subparsers.add_parser('damage', parents=[common, xserver], help="Full-rate vs damage-driven capture cost")
+    damage.add_argument('--duration', type=float, default=10.0, help="Seconds to measure per scene and mode")
+    damage.set_defaults(func=mode('capture', 'bench_damage'))
+
+    region = subparsers.add_parser('region', parents=[common, xserver], help="Full-screen vs region capture cost")
+    region.add_argument('--region', default='1000x800+100+100', help="WIDTHxHEIGHT+X+Y to capture")
+    region.add_argument('--duration', type=float, default=10.0)
+    region.set_defaults(func=mode('capture', 'bench_region'))
+
+    display = subparsers.add_parser('display', parents=[xserver],
+                                    help="Display mode switch time per backend (needs an X server)")
+    display.add_argument('--sizes', nargs='+', default=['1280x720', '1920x1080'], help="Sizes to alternate between")
+    display.add_argument('--iterations', type=int, default=20)
+    display.add_argument('--timeout', type=float, default=5.0)
+    display.set_defaults(func=mode('capture', 'bench_display'))
+
+    abr = subparsers.add_parser('abr', help="Adaptive bitrate against a simulated lossy link")
+    abr.add_argument('--min-bitrate', type=int, default=2000)
+    abr.add_argument('--max-bitrate', type=int, default=30000)
+    abr.add_argument('--loss', type=float, default=0.0, help="Mean random background loss (0-1)")
+    abr.add_argument('--verbose', action='store_true', help="Print the per-second trace")
+    abr.set_defaults(func=mode('abr', 'bench_abr'))
+
+    keyframes = subparsers.add_parser('keyframes', parents=[common], help="Bitrate and loss recovery per keyframe strategy")
+    keyframes.add_argument('--gop', type=int, default=300, help="Periodic keyframe interval for the on-demand strategy")
+    keyframes.add_argument('--losses', type=int, default=5, help="Number of simulated dropouts")
+    keyframes.add_argument('--loss-ms', type=int, default=200, help="Length of each dropout")
+    keyframes.add_argument('--spacing', type=float, default=2.0, help="Seconds of clean link around each dropout")
+    keyframes.add_argument('--pattern', default='smpte', help="videotestsrc pattern; smpte is a static picture")
+    keyframes.add_argument('--timeout', type=float, default=10.0)
+    keyframes.set_defaults(func=mode('loss', 'bench_keyframes'))
+
+    fec = subparsers.add_parser('fec', parents=[common], help="Goodput, overhead and lost frames per loss recovery mode")
+    fec.add_argument('--loss', type=float, default=0.03, help="Fraction of packets lost on the link")
+    fec.add_argument('--burst', type=float, default=3.0, help="Mean length of a loss burst in packets")
+    fec.add_argument('--fec', type=int, default=20, help="FEC percentage of the fixed FEC modes")
+    fec.add_argument('--bitrate', type=int, default=8000, help="Encoder bitrate (kbps)")
+    fec.add_argument('--gop', type=int, default=300, help="Frames between periodic keyframes")
+    fec.add_argument('--duration', type=float, default=10.0)
+    fec.add_argument('--pattern', default='ball', help="videotestsrc pattern")
+    fec.add_argument('--seed', type=int, default=1)
+    fec.add_argument('--timeout', type=float, default=10.0)
+    fec.set_defaults(func=mode('loss', 'bench_fec'))
+
+    convert = subparsers.add_parser('convert', parents=[common], help="CPU per frame with and without videoconvert")
+    convert.add_argument('--resolutions', nargs='+', default=['1920x1080', '3840x2160'])
+    convert.add_argument('--duration', type=float, default=10.0)
+    convert.set_defaults(func=mode('encoding', 'bench_convert'))
+
+    threads = subparsers.add_parser('threads', help="Software scale/convert throughput per thread count")
+    threads.add_argument('--source', default='3840x2160', help="Captured (native) resolution")
+    threads.add_argument('--output', default='1920x1080', help="Streamed resolution")
+    threads.add_argument('--threads', type=int, nargs='+', help="Thread counts to try")
+    threads.add_argument('--frames', type=int, default=300)
+    threads.set_defaults(func=mode('encoding', 'bench_threads'))
+
+    cursor = subparsers.add_parser('cursor', parents=[common], help="Cursor channel packet rate and CPU")
+    cursor.add_argument('--move-rate', type=int, default=1000, help="Synthetic mouse polling rate (Hz)")
+    cursor.add_argument('--rate', type=int, default=30, help="Coalesced sender rate (Hz)")
+    cursor.add_argument('--duration', type=float, default=5.0)
+    cursor.add_argument('--timeout', type=float, default=10.0)
+    cursor.set_defaults(func=mode('viewers', 'bench_cursor'))
+
+    viewers = subparsers.add_parser('viewers', parents=[common], help="Host CPU per added viewer on one shared encode")
+    viewers.add_argument('--max-viewers', type=int, default=4)
+    viewers.add_argument('--resolution', default='1920x1080')
+    viewers.add_argument('--duration', type=float, default=5.0, help="Seconds to measure per viewer count")
+    viewers.add_argument('--timeout', type=float, default=10.0)
+    viewers.set_defaults(func=mode('viewers', 'bench_viewers'))
+
+    simulcast = subparsers.add_parser('simulcast', parents=[common], help="Encode cost per added simulcast layer")
+    simulcast.add_argument('--resolution', default='1920x1080')
+    simulcast.add_argument('--duration', type=float, default=10.0)
+    simulcast.set_defaults(func=mode('encoding', 'bench_simulcast'))
+
+    importtime = subparsers.add_parser('importtime', help="Import and --help time of the host entry points")
+    importtime.add_argument('--modules', nargs='+', default=['options', 'launcher', 'signaling_server', 'streamer'])
+    importtime.add_argument('--runs', type=int, default=5)
+    importtime.add_argument('--top', type=int, default=5, help="Heaviest direct imports to list per module")
+    importtime.add_argument('--help-budget-ms', type=float,
+                            help="Fail when --help of launcher.py, signaling_server.py or streamer.py takes longer")
+    importtime.set_defaults(func=mode('importtime', 'bench_importtime'))
+
+    signaling = subparsers.add_parser('signaling', help="Signaling server message latency under many rooms")
+    signaling.add_argument('--rooms', type=int, default=200, help="Concurrent host/client pairs")
+    signaling.add_argument('--exchanges', type=int, default=5, help="Offer/answer rounds per room")
+    signaling.add_argument('--candidates', type=int, default=8, help="ICE candidates the host sends per offer")
+    signaling.add_argument('--sdp-bytes', type=int, default=3000, help="Size of each offer and answer")
+    signaling.add_argument('--url', help="Load an already running server instead of one in this process")
+    signaling.add_argument('--port', type=int, default=8765)
+    signaling.add_argument('--max-queue', type=int, default=256)
+    signaling.add_argument('--overflow', choices=['close', 'drop'], default='close')
+    signaling.add_argument('--batch-ms', type=float, default=10.0, help="ICE candidate batching window (0 disables)")
+    signaling.add_argument('--timeout', type=float, default=30.0)
+    signaling.set_defaults(func=mode('signaling', 'bench_signaling'))
+
+    args = parser.parse_args()
+    if getattr(args, 'xvfb', False):
+        virtual_display = VirtualDisplay()
+        os.environ['DISPLAY'] = virtual_display.start()
+        try:
+            args.func(args)
+        finally:
+            virtual_display.stop()
+    else:
+        args.func(args)
+
+
+if __name__ == '__main__':
+    main()
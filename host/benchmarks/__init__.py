@@ -0,0 +1 @@
+"""Benchmark modes of benchmark.py, one module per area, imported on demand."""
@@ -0,0 +1,77 @@
+"""Adaptive bitrate against a simulated link; needs no GStreamer."""
+import random
+import statistics
+
+from rate_control import BitrateController, LinkStats
+
+
+class SimulatedLink:
+    """Scripted Wi-Fi link producing the stats webrtcbin would report.
+
+    Sending above capacity fills the access point queue (RTT grows) and
+    overflows it (loss grows); `loss` adds random background loss.
+    """
+
+    def __init__(self, base_rtt=0.004, loss=0.0, queue_ms=60, seed=1):
+        self.base_rtt = base_rtt
+        self.random_loss = loss
+        self.queue_ms = queue_ms
+        self.queue = 0.0 # seconds of queued data
+        self.random = random.Random(seed)
+        self.stats = LinkStats(rtt=base_rtt, fraction_lost=0.0)
+
+    def step(self, sent_kbps, capacity_kbps, dt=1.0, packet_kbits=9.6):
+        # Queue grows with the excess and drains with spare capacity
+        self.queue = max(0.0, self.queue + (sent_kbps - capacity_kbps) / capacity_kbps * dt)
+        overflow = max(0.0, self.queue - self.queue_ms / 1000)
+        self.queue = min(self.queue, self.queue_ms / 1000)
+        overflow_loss = min(1.0, overflow * capacity_kbps / max(sent_kbps * dt, 1))
+        loss = min(1.0, overflow_loss + self.random.uniform(0, 2 * self.random_loss))
+
+        packets = int(sent_kbps * dt / packet_kbits)
+        lost = int(packets * loss)
+        previous = self.stats
+        self.stats = LinkStats(
+            rtt=self.base_rtt + self.queue,
+            fraction_lost=loss,
+            packets_sent=previous.packets_sent + packets,
+            packets_lost=previous.packets_lost + lost,
+            nack_count=previous.nack_count + lost)
+        goodput = sent_kbps * (1 - loss)
+        return self.stats, goodput, loss
+
+
+# (seconds, capacity in kbps): a good link, a neighbour starts a download,
+# the headset walks behind a wall, then everything recovers
+ABR_SCRIPT = [(10, 60000), (10, 12000), (10, 4000), (10, 20000), (10, 60000)]
+
+
+def bench_abr(args):
+    """Closed-loop bitrate control against a scripted lossy link, fixed vs adaptive."""
+    for adaptive in (False, True):
+        link = SimulatedLink(loss=args.loss)
+        controller = BitrateController(args.min_bitrate, args.max_bitrate)
+        bitrate = args.max_bitrate
+        t, rows, lost_time = 0, [], 0
+        for duration, capacity in ABR_SCRIPT:
+            for _ in range(duration):
+                stats, goodput, loss = link.step(bitrate, capacity)
+                if loss > 0.05:
+                    # Visible stalls/corruption at this loss level
+                    lost_time += 1
+                rows.append((t, capacity, bitrate, goodput, loss, stats.rtt))
+                if adaptive:
+                    bitrate = controller.update(stats)
+                t += 1
+
+        label = "adaptive" if adaptive else "fixed"
+        # Throughput during lossy seconds is not watchable video, so only
+        # count goodput delivered at <= 5% loss
+        utilisation = statistics.mean(min(goodput / capacity, 1.0) if loss <= 0.05 else 0.0
+                                      for _, capacity, _, goodput, loss, _ in rows)
+        print(f"{label:8}: usable goodput/capacity={utilisation * 100:.0f}%  "
+              f"mean loss={statistics.mean(r[4] for r in rows) * 100:.1f}%  "
+              f"max rtt={max(r[5] for r in rows) * 1000:.0f}ms  seconds with >5% loss={lost_time}")
+        if args.verbose:
+            for t, capacity, bitrate, goodput, loss, rtt in rows:
+                print(f"  t={t:3}s capacity={capacity:6} sent={bitrate:8.0f} loss={loss * 100:5.1f}% rtt={rtt * 1000:4.0f}ms")
@@ -0,0 +1,163 @@
+"""Capture cost on a real X display: damage, region and display modes."""
+import threading
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from capture_region import parse_geometry
+from display_manager import RandrBackend, XrandrBackend
+from encoders import select_encoder
+from pipeline import CapturePipeline
+
+from benchmarks.common import cpu_seconds, parse_resolution, report
+from benchmarks.loopback import run_glib_loop
+
+
+class ScreenActivity:
+    """Draws moving rectangles on the root window to generate XDamage."""
+
+    def __init__(self, rate=30):
+        self.rate = rate
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join()
+
+    def _run(self):
+        from Xlib import display as xdisplay
+        disp = xdisplay.Display()
+        screen = disp.screen()
+        root = screen.root
+        gc = root.create_gc(foreground=screen.white_pixel, background=screen.black_pixel)
+        x = 0
+        while self.running:
+            # A terminal-sized patch of change, like text scrolling
+            root.fill_rectangle(gc, x % (screen.width_in_pixels - 200), 100, 200, 200)
+            gc.change(foreground=screen.black_pixel if x % 2 else screen.white_pixel)
+            disp.flush()
+            x += 7
+            time.sleep(1 / self.rate)
+        disp.close()
+
+
+def damage_run(args, damage, active):
+    capture = CapturePipeline(damage=damage)
+    capture.build(select_encoder(args.encoder))
+    encoded_bytes = [0]
+
+    def count_bytes(pad, info, user_data):
+        encoded_bytes[0] += info.get_buffer().get_size()
+        return Gst.PadProbeReturn.OK
+
+    capture.payloader.get_static_pad('src').add_probe(Gst.PadProbeType.BUFFER, count_bytes, None)
+    activity = ScreenActivity() if active else None
+
+    capture.start()
+    time.sleep(1) # Let negotiation and the first keyframe settle
+    if activity:
+        activity.start()
+    encoded_bytes[0] = 0
+    cpu_start, wall_start = cpu_seconds(), time.perf_counter()
+    time.sleep(args.duration)
+    wall, cpu = time.perf_counter() - wall_start, cpu_seconds() - cpu_start
+    kbps = encoded_bytes[0] * 8 / wall / 1000
+    if activity:
+        activity.stop()
+    gate = capture.damage_gate
+    capture.close()
+    return cpu / wall * 100, kbps, gate
+
+
+def region_run(args, region):
+    capture = CapturePipeline(region=region)
+    capture.build(select_encoder(args.encoder))
+    encoded_bytes = [0]
+
+    def count_bytes(pad, info, user_data):
+        encoded_bytes[0] += info.get_buffer().get_size()
+        return Gst.PadProbeReturn.OK
+
+    capture.payloader.get_static_pad('src').add_probe(Gst.PadProbeType.BUFFER, count_bytes, None)
+    activity = ScreenActivity()
+    capture.start()
+    time.sleep(1)
+    activity.start()
+    encoded_bytes[0] = 0
+    cpu_start, wall_start = cpu_seconds(), time.perf_counter()
+    time.sleep(args.duration)
+    wall, cpu = time.perf_counter() - wall_start, cpu_seconds() - cpu_start
+    activity.stop()
+    size = capture.capture_size()
+    capture.close()
+    return cpu / wall * 100, encoded_bytes[0] * 8 / wall / 1000, size
+
+
+def bench_region(args):
+    """CPU and bitrate of full-screen capture vs. a single region."""
+    Gst.init(None)
+    glib_loop = run_glib_loop()
+    for label, region in (("full screen", None), ("region", parse_geometry(args.region))):
+        cpu, kbps, size = region_run(args, region)
+        print(f"{label:11} {size[0]}x{size[1]}: cpu={cpu:5.1f}%  bitrate={kbps:8.1f} kbps")
+    glib_loop.quit()
+
+
+def screen_size_seen(disp):
+    geometry = disp.screen().root.get_geometry()
+    return geometry.width, geometry.height
+
+
+def bench_display(args):
+    """Mode switch to new-size-visible time for the xrandr and RandR backends."""
+    from Xlib import display as xdisplay
+    observer = xdisplay.Display()
+    sizes = [parse_resolution(text) for text in args.sizes]
+    for backend_class in (XrandrBackend, RandrBackend):
+        try:
+            backend = backend_class()
+        except Exception as e:
+            print(f"{backend_class.name}: unavailable ({e})")
+            continue
+        samples, failures = [], 0
+        for i in range(args.iterations):
+            width, height = sizes[i % len(sizes)]
+            if screen_size_seen(observer) == (width, height):
+                width, height = sizes[(i + 1) % len(sizes)]
+            t0 = time.perf_counter()
+            switched = backend.create_and_set_mode(width, height)
+            # Done once another client sees the new size, like ximagesrc would
+            while screen_size_seen(observer) != (width, height) and time.perf_counter() - t0 < args.timeout:
+                time.sleep(0.001)
+            if switched and screen_size_seen(observer) == (width, height):
+                samples.append(time.perf_counter() - t0)
+            else:
+                failures += 1
+        backend.restore()
+        report(f"{backend.name}: mode switch", samples)
+        if failures:
+            print(f"{backend.name}: {failures} switch(es) failed or timed out")
+    observer.close()
+
+
+def bench_damage(args):
+    """CPU and bitrate of full-rate vs damage-driven capture, static vs active."""
+    Gst.init(None)
+    glib_loop = run_glib_loop()
+    for active in (False, True):
+        for damage in (False, True):
+            cpu, kbps, gate = damage_run(args, damage, active)
+            scene = "active" if active else "static"
+            mode = "damage" if damage else "full"
+            frames = f"  frames passed={gate.passed} dropped={gate.dropped}" if gate else ""
+            print(f"{scene:6} {mode:6}: cpu={cpu:5.1f}%  bitrate={kbps:8.1f} kbps{frames}")
+    glib_loop.quit()
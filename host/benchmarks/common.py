@@ -0,0 +1,33 @@
+"""Reporting and parsing helpers shared by the benchmark modes."""
+import resource
+import statistics
+
+
+def report(label, samples):
+    samples = [s * 1000 for s in samples]
+    if not samples:
+        print(f"{label}: no samples")
+        return
+    print(f"{label}: n={len(samples)} min={min(samples):.1f}ms "
+          f"median={statistics.median(samples):.1f}ms max={max(samples):.1f}ms")
+
+
+def report_percentiles(label, samples):
+    if not samples:
+        print(f"{label}: no samples")
+        return
+    ordered = sorted(s * 1000 for s in samples)
+    def quantile(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+    print(f"{label}: n={len(ordered)} p50={quantile(0.5):.2f}ms p95={quantile(0.95):.2f}ms "
+          f"p99={quantile(0.99):.2f}ms max={ordered[-1]:.2f}ms")
+
+
+def parse_resolution(text):
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
@@ -0,0 +1,445 @@
+"""Connect latency: reconnect, setup, startup, LAN fast path and event loop modes."""
+import asyncio
+import queue
+import resource
+import statistics
+import threading
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstWebRTC', '1.0')
+from gi.repository import Gst, GstWebRTC
+
+from connection_setup import ConnectionSetup, SignalWaiter
+from encoders import select_encoder
+from glib_loop import loop_thread, use_glib_loop
+from pipeline import CapturePipeline
+from pipeline_cache import PipelineCache
+from session import StreamSession
+
+from benchmarks.common import cpu_seconds, parse_resolution, report
+from benchmarks.loopback import LoopbackPeer, connect_loopback, run_glib_loop
+
+
+def bench_reconnect(args):
+    """Reconnect-to-first-frame: hot tee attach vs. rebuilding the pipeline."""
+    Gst.init(None)
+    loop = run_glib_loop()
+
+    hot, cold, failures = [], [], 0
+
+    capture = CapturePipeline(test_source=True)
+    capture.build(select_encoder(args.encoder))
+    capture.start()
+    for i in range(args.iterations):
+        session, peer, elapsed = connect_loopback(capture, i, args.timeout)
+        if elapsed is None:
+            failures += 1
+        else:
+            hot.append(elapsed)
+        session.detach()
+        peer.stop()
+    capture.stop()
+
+    if args.cold:
+        # What the old disconnect path paid (minus the process re-exec and
+        # Python/GStreamer re-import): a full capture + encoder rebuild.
+        for i in range(args.iterations):
+            t0 = time.perf_counter()
+            capture = CapturePipeline(test_source=True)
+            capture.build(select_encoder(args.encoder))
+            capture.start()
+            build_time = time.perf_counter() - t0
+            session, peer, elapsed = connect_loopback(capture, i, args.timeout)
+            if elapsed is None:
+                failures += 1
+            else:
+                cold.append(build_time + elapsed)
+            session.detach()
+            peer.stop()
+            capture.stop()
+
+    loop.quit()
+    report("hot reconnect (tee attach)", hot)
+    if args.cold:
+        report("cold reconnect (pipeline rebuild)", cold)
+    if failures:
+        print(f"{failures} connection(s) timed out after {args.timeout}s")
+
+
+async def measure_loop_lag(stop, lags, interval=0.005):
+    # Stands in for signaling traffic: every late wake-up is an ICE candidate
+    # or answer that would have waited that long to be handled.
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, loop.time() - expected))
+
+
+async def run_setup(capture, session_id, legacy, timeout):
+    loop = asyncio.get_running_loop()
+    peer = LoopbackPeer(f"setup{session_id}")
+    session = StreamSession(session_id, peer.send, stun_server=None)
+    peer.host = session
+    peer.start()
+
+    def attach():
+        session.attach(capture)
+        session.create_offer()
+
+    async def switch_mode(width, height):
+        # No X display here; report a framebuffer change so the capture restarts
+        return True
+
+    t0 = time.perf_counter()
+    if legacy:
+        # The old client_connected handler, sleeps and all, on the event loop
+        time.sleep(2)
+        capture.stop()
+        time.sleep(0.5)
+        capture.start()
+        time.sleep(1)
+        attach()
+    else:
+        setup = ConnectionSetup(loop, lambda: capture, attach, switch_mode=switch_mode, timeout=timeout)
+        await setup.run(1920, 1080)
+    await loop.run_in_executor(None, peer.first_frame.wait, timeout)
+    elapsed = peer.first_frame_time - t0 if peer.first_frame.is_set() else None
+    session.detach()
+    peer.stop()
+    return elapsed
+
+
+def bench_setup(args):
+    """client_connected -> first frame, and event loop stalls meanwhile."""
+    Gst.init(None)
+    glib_loop = run_glib_loop()
+    capture = CapturePipeline(test_source=True)
+    capture.build(select_encoder(args.encoder))
+    capture.pipeline.get_bus().add_signal_watch()
+    capture.start()
+
+    async def run_mode(legacy):
+        setup_times, lags = [], []
+        for i in range(args.iterations):
+            stop = asyncio.Event()
+            ticker = asyncio.create_task(measure_loop_lag(stop, lags))
+            elapsed = await run_setup(capture, i, legacy, args.timeout)
+            stop.set()
+            await ticker
+            if elapsed is not None:
+                setup_times.append(elapsed)
+        return setup_times, lags
+
+    for legacy in ([True, False] if args.legacy else [False]):
+        label = "legacy sleeps" if legacy else "async state machine"
+        setup_times, lags = asyncio.run(run_mode(legacy))
+        report(f"{label}: setup to first frame", setup_times)
+        report(f"{label}: signaling loop stall", [max(lags)] if lags else [])
+
+    capture.stop()
+    glib_loop.quit()
+
+
+async def startup_connect(session_id, capture, timeout, switch_mode=None, acquire=None):
+    """One client_connected -> first RTP packet through ConnectionSetup."""
+    loop = asyncio.get_running_loop()
+    peer = LoopbackPeer(f"startup{session_id}")
+    session = StreamSession(session_id, peer.send, stun_server=None)
+    peer.host = session
+    peer.start()
+
+    def attach():
+        session.attach(setup.capture)
+        session.create_offer()
+
+    setup = ConnectionSetup(loop, lambda: capture, attach, switch_mode=switch_mode, timeout=timeout,
+                            acquire=acquire)
+    t0 = time.perf_counter()
+    await setup.run(1920, 1080)
+    await loop.run_in_executor(None, peer.first_packet.wait, timeout)
+    elapsed = peer.first_packet_time - t0 if peer.first_packet.is_set() else None
+    session.detach()
+    peer.stop()
+    return elapsed, setup.capture
+
+
+def bench_startup(args):
+    """client_connected -> first RTP packet: cold build, restart in place, prewarmed standby."""
+    Gst.init(None)
+    glib_loop = run_glib_loop()
+    spec = select_encoder(args.encoder)
+    sizes = [parse_resolution(text) for text in args.resolutions]
+
+    def build(size):
+        capture = CapturePipeline(test_source=True, test_resolution=size)
+        capture.build(spec)
+        capture.pipeline.get_bus().add_signal_watch()
+        return capture
+
+    async def switched(width, height):
+        # Stands in for a resolution switch on every connect
+        return True
+
+    async def run_cold():
+        samples = []
+        for i in range(args.iterations):
+            # What connecting cost before standby pipelines: build, then start
+            t0 = time.perf_counter()
+            capture = build(sizes[i % len(sizes)])
+            build_time = time.perf_counter() - t0
+            elapsed, capture = await startup_connect(i, capture, args.timeout)
+            if elapsed is not None:
+                samples.append(build_time + elapsed)
+            capture.stop()
+        return samples
+
+    async def run_restart():
+        samples = []
+        capture = build(sizes[0])
+        capture.start()
+        for i in range(args.iterations):
+            elapsed, capture = await startup_connect(i, capture, args.timeout, switch_mode=switched)
+            if elapsed is not None:
+                samples.append(elapsed)
+        capture.stop()
+        return samples
+
+    async def run_standby():
+        samples = []
+        wanted = [sizes[0]]
+        cache = PipelineCache(lambda: build(wanted[0]), size=len(sizes), timeout=args.timeout)
+        for size in sizes:
+            wanted[0] = size
+            cache.acquire(size)
+        loop = asyncio.get_running_loop()
+        capture = cache.acquire(sizes[0])
+        for i in range(args.iterations):
+            wanted[0] = sizes[i % len(sizes)]
+
+            async def acquire():
+                return await loop.run_in_executor(None, cache.acquire, wanted[0])
+
+            elapsed, capture = await startup_connect(i, capture, args.timeout, switch_mode=switched, acquire=acquire)
+            if elapsed is not None:
+                samples.append(elapsed)
+            # Parked again once the viewer leaves, like the streamer does
+            capture.pause()
+        print(f"standby cache: {cache.hits} hit(s), {cache.misses} prewarm(s)")
+        cache.close()
+        return samples
+
+    report("cold build on connect", asyncio.run(run_cold()))
+    report("restart in place", asyncio.run(run_restart()))
+    report("prewarmed standby", asyncio.run(run_standby()))
+    glib_loop.quit()
+
+
+class DelayedSignaling:
+    """Delivers signaling messages in order after a fixed one-way delay."""
+
+    def __init__(self, deliver, delay):
+        self.deliver = deliver
+        self.delay = delay
+        self.count = 0
+        self.messages = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def send(self, message):
+        self.count += 1
+        self.messages.put((time.perf_counter() + self.delay, message))
+
+    def close(self):
+        self.messages.put((0.0, None))
+
+    def _run(self):
+        while True:
+            due, message = self.messages.get()
+            if message is None:
+                return
+            time.sleep(max(0.0, due - time.perf_counter()))
+            self.deliver(message)
+
+
+def lan_connect(capture, session_id, args, **ice_options):
+    """create-offer -> offer delivered and -> first RTP packet, plus host messages sent."""
+    peer = LoopbackPeer(f"lan{session_id}")
+    offer_times = []
+
+    def deliver(message):
+        if message['type'] == 'offer':
+            offer_times.append(time.perf_counter())
+        peer.send(message)
+
+    link = DelayedSignaling(deliver, args.signaling_delay_ms / 1000)
+    session = StreamSession(session_id, link.send, **ice_options)
+    peer.host = session
+    peer.start()
+
+    t0 = time.perf_counter()
+    session.attach(capture)
+    session.create_offer()
+    peer.first_packet.wait(args.timeout)
+    offer = offer_times[0] - t0 if offer_times else None
+    elapsed = peer.first_packet_time - t0 if peer.first_packet.is_set() else None
+    session.detach()
+    peer.stop()
+    link.close()
+    return offer, elapsed, link.count
+
+
+def bench_lan(args):
+    """Connection setup on loopback: trickled candidates vs. the LAN fast path."""
+    Gst.init(None)
+    glib_loop = run_glib_loop()
+    capture = CapturePipeline(test_source=True)
+    capture.build(select_encoder(args.encoder))
+    capture.start()
+
+    interfaces = args.interfaces.split(',') if args.interfaces else None
+    modes = [("trickle, no STUN", dict(stun_server=None))]
+    if args.stun:
+        # Only with an explicit server: everything else runs offline
+        modes.append((f"trickle, STUN {args.stun}", dict(stun_server=args.stun)))
+    modes.append(("LAN fast path", dict(stun_server=None, trickle=False, interfaces=interfaces)))
+
+    session_id = 0
+    for label, ice_options in modes:
+        offers, setups, messages, failures = [], [], [], 0
+        for _ in range(args.iterations):
+            offer, elapsed, count = lan_connect(capture, session_id, args, **ice_options)
+            session_id += 1
+            messages.append(count)
+            if elapsed is None:
+                failures += 1
+                continue
+            offers.append(offer)
+            setups.append(elapsed)
+        report(f"{label}: offer delivered", offers)
+        report(f"{label}: first packet", setups)
+        print(f"{label}: {statistics.mean(messages):.1f} signaling message(s) from the host per connect")
+        if failures:
+            print(f"{label}: {failures} connection(s) timed out after {args.timeout}s")
+
+    capture.stop()
+    glib_loop.quit()
+
+
+class LoopRelay:
+    """Signaling between a host session and a loopback peer through an asyncio loop.
+
+    Host messages reach the peer the way streamer.send_signaling sends them,
+    and the peer's answer and candidates reach the host as if read from the
+    websocket on `loop`.
+    """
+
+    def __init__(self, loop, peer):
+        self.loop = loop
+        self.peer = peer
+        self.session = None
+
+    async def deliver(self, message):
+        self.peer.send(message)
+
+    def send(self, message):
+        if loop_thread(self.loop):
+            self.loop.create_task(self.deliver(message))
+        else:
+            asyncio.run_coroutine_threadsafe(self.deliver(message), self.loop)
+
+    def handle_answer(self, sdp):
+        self.loop.call_soon_threadsafe(self.session.handle_answer, sdp)
+
+    def handle_ice_candidate(self, *args):
+        self.loop.call_soon_threadsafe(self.session.handle_ice_candidate, *args)
+
+
+def answered(webrtcbin, pspec):
+    return (webrtcbin.get_property('signaling-state') == GstWebRTC.WebRTCSignalingState.STABLE and
+            webrtcbin.get_property('remote-description') is not None)
+
+
+async def offer_round_trips(args, capture, threaded):
+    """create-offer -> answer applied on the host, per connect."""
+    loop = asyncio.get_running_loop()
+    samples = []
+    for i in range(args.iterations):
+        peer = LoopbackPeer(f"loop{i}")
+        relay = LoopRelay(loop, peer)
+        session = StreamSession(i, relay.send, stun_server=None)
+        relay.session = session
+        peer.host = relay
+        peer.start()
+        session.attach(capture)
+        done = SignalWaiter(loop, session.webrtcbin, 'notify::signaling-state', check=answered)
+
+        t0 = time.perf_counter()
+        if threaded:
+            # Offer handled on a GStreamer thread and sent across to the loop
+            session.create_offer()
+        else:
+            await session.negotiate(loop)
+        if await done.wait(args.timeout):
+            samples.append(time.perf_counter() - t0)
+        session.detach()
+        peer.stop()
+        # Lets the GLib idle callbacks of the detach run
+        await asyncio.sleep(0.05)
+    return samples
+
+
+async def idle_wakeups(seconds, polling):
+    """Context switches and CPU seconds while waiting `seconds` for a stop."""
+    stopped = asyncio.Event()
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = cpu_seconds()
+    if polling:
+        # The old run(): check a flag every 100 ms
+        deadline = time.monotonic() + seconds
+        while not stopped.is_set() and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+    else:
+        try:
+            await asyncio.wait_for(stopped.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    switches = (after.ru_nvcsw - before.ru_nvcsw) + (after.ru_nivcsw - before.ru_nivcsw)
+    return switches, cpu_seconds() - cpu
+
+
+def bench_loop(args):
+    """GLib main loop thread + asyncio vs. one GLib-backed asyncio loop."""
+    Gst.init(None)
+    capture = CapturePipeline(test_source=True)
+    capture.build(select_encoder(args.encoder))
+    capture.start()
+
+    async def run(threaded):
+        round_trips = await offer_round_trips(args, capture, threaded)
+        # Parked like the streamer with no viewers
+        capture.pause()
+        wakeups = await idle_wakeups(args.idle, polling=threaded)
+        capture.start()
+        return round_trips, wakeups
+
+    def show(label, results):
+        round_trips, (switches, cpu) = results
+        report(f"{label}: offer/answer round trip", round_trips)
+        print(f"{label}: idle {switches / args.idle:.1f} context switches/s, "
+              f"{cpu / args.idle * 1000:.2f} ms CPU/s")
+
+    glib_loop = run_glib_loop()
+    show("GLib thread + polling", asyncio.run(run(threaded=True)))
+    glib_loop.quit()
+
+    if use_glib_loop():
+        try:
+            show("one GLib-backed loop", asyncio.run(run(threaded=False)))
+        finally:
+            asyncio.set_event_loop_policy(None)
+    else:
+        print("gi.events not available (PyGObject < 3.50): the host falls back to the GLib thread")
+    capture.stop()
@@ -0,0 +1,199 @@
+"""Encode cost: encoders, colour conversion, scaling threads and simulcast modes."""
+import os
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from encoders import ENCODERS, ENCODERS_BY_NAME, select_encoder
+from pipeline import SIMULCAST_SCALES, CapturePipeline, make_element
+
+from benchmarks.common import cpu_seconds, parse_resolution
+from benchmarks.loopback import run_glib_loop
+
+
+def encode_run(spec, width, height, frames, framerate=30):
+    """Encode `frames` test frames as fast as possible.
+
+    Returns (fps, per-frame latency samples in seconds, CPU seconds used) or
+    None if the encoder failed.
+    """
+    pipeline = Gst.Pipeline.new(f"bench-{spec.name}")
+    source = make_element("videotestsrc", None, num_buffers=frames)
+    source.set_property("pattern", "smpte")
+    capsfilter = make_element("capsfilter", None)
+    capsfilter.set_property("caps", Gst.Caps.from_string(
+        f"video/x-raw,width={width},height={height},framerate={framerate}/1"))
+    elements = [source, capsfilter, make_element("videoconvert", None)]
+    elements.extend(make_element(factory, None) for factory in spec.gpu_convert)
+    encoder = spec.make(f"bench-{spec.factory}")
+    spec.set_bitrate(encoder, 30000)
+    elements.extend([encoder, make_element("fakesink", None, sync=False)])
+    for elem in elements:
+        pipeline.add(elem)
+    for upstream, downstream in zip(elements, elements[1:]):
+        upstream.link(downstream)
+
+    # Match buffers across the encoder by PTS to get per-frame latency
+    entered, latencies = {}, []
+
+    def on_input(pad, info, user_data):
+        entered[info.get_buffer().pts] = time.perf_counter()
+        return Gst.PadProbeReturn.OK
+
+    def on_output(pad, info, user_data):
+        start = entered.pop(info.get_buffer().pts, None)
+        if start is not None:
+            latencies.append(time.perf_counter() - start)
+        return Gst.PadProbeReturn.OK
+
+    encoder.get_static_pad('sink').add_probe(Gst.PadProbeType.BUFFER, on_input, None)
+    encoder.get_static_pad('src').add_probe(Gst.PadProbeType.BUFFER, on_output, None)
+
+    cpu_start, wall_start = cpu_seconds(), time.perf_counter()
+    pipeline.set_state(Gst.State.PLAYING)
+    msg = pipeline.get_bus().timed_pop_filtered(
+        Gst.CLOCK_TIME_NONE, Gst.MessageType.EOS | Gst.MessageType.ERROR)
+    wall, cpu = time.perf_counter() - wall_start, cpu_seconds() - cpu_start
+    pipeline.set_state(Gst.State.NULL)
+
+    if msg.type == Gst.MessageType.ERROR:
+        err, debug = msg.parse_error()
+        print(f"  {spec.name}: failed ({err})")
+        return None
+    return frames / wall, latencies, cpu
+
+
+def bench_encoders(args):
+    """Encode FPS, per-frame latency and CPU load for each usable encoder."""
+    Gst.init(None)
+    candidates = [ENCODERS_BY_NAME[name] for name in args.candidates] if args.candidates else ENCODERS
+    resolutions = [parse_resolution(r) for r in args.resolutions]
+
+    for spec in candidates:
+        if not spec.is_installed():
+            print(f"{spec.name}: {spec.factory} not installed, skipped")
+            continue
+        for width, height in resolutions:
+            result = encode_run(spec, width, height, args.frames)
+            if result is None:
+                break
+            fps, latencies, cpu = result
+            latencies = sorted(latencies)
+            p50 = latencies[len(latencies) // 2] * 1000 if latencies else 0
+            p95 = latencies[int(len(latencies) * 0.95)] * 1000 if latencies else 0
+            # CPU as a share of one core while encoding in real time at 30 fps
+            realtime_cpu = cpu / args.frames * 30 * 100
+            print(f"{spec.name:9} {width}x{height}: {fps:7.1f} fps  latency p50={p50:.1f}ms "
+                  f"p95={p95:.1f}ms  cpu@30fps={realtime_cpu:.0f}%")
+
+
+def convert_run(args, resolution, zero_copy):
+    capture = CapturePipeline(test_source=True, test_resolution=resolution, zero_copy=zero_copy)
+    capture.build(select_encoder(args.encoder))
+    has_videoconvert = capture.pipeline.get_by_name("videoconvert0") is not None
+    frames = [0]
+
+    def count_frame(pad, info, user_data):
+        frames[0] += 1
+        return Gst.PadProbeReturn.OK
+
+    capture.encoder.get_static_pad('src').add_probe(Gst.PadProbeType.BUFFER, count_frame, None)
+    capture.start()
+    time.sleep(1) # Skip negotiation and encoder start-up
+    frames[0] = 0
+    cpu_start, wall_start = cpu_seconds(), time.perf_counter()
+    time.sleep(args.duration)
+    cpu, wall = cpu_seconds() - cpu_start, time.perf_counter() - wall_start
+    count = frames[0]
+    capture.close()
+    return count / wall, cpu / max(count, 1), has_videoconvert
+
+
+def bench_convert(args):
+    """CPU time per frame with the old always-videoconvert path vs. the zero-copy one."""
+    Gst.init(None)
+    glib_loop = run_glib_loop()
+    for text in args.resolutions:
+        resolution = parse_resolution(text)
+        for zero_copy in (False, True):
+            fps, cpu_per_frame, has_videoconvert = convert_run(args, resolution, zero_copy)
+            label = "zero-copy" if zero_copy else "videoconvert"
+            note = "" if has_videoconvert == (not zero_copy) else " (videoconvert still required)"
+            print(f"{text:9} {label:12}: {fps:5.1f} fps  cpu={cpu_per_frame * 1000:6.2f} ms/frame{note}")
+    glib_loop.quit()
+
+
+def threads_run(source, output, threads, frames):
+    """Software downscale + convert of `frames` BGRx frames as fast as possible."""
+    pipeline = Gst.Pipeline.new(f"threads-{threads}")
+    src = make_element("videotestsrc", None, num_buffers=frames)
+    srccaps = make_element("capsfilter", None)
+    srccaps.set_property("caps", Gst.Caps.from_string(
+        f"video/x-raw,format=BGRx,width={source[0]},height={source[1]},framerate=30/1"))
+    videoscale = make_element("videoscale", None, n_threads=threads)
+    videoconvert = make_element("videoconvert", None, n_threads=threads)
+    outcaps = make_element("capsfilter", None)
+    outcaps.set_property("caps", Gst.Caps.from_string(
+        f"video/x-raw,format=I420,width={output[0]},height={output[1]}"))
+    elements = [src, srccaps, videoscale, videoconvert, outcaps, make_element("fakesink", None, sync=False)]
+    for elem in elements:
+        pipeline.add(elem)
+    for upstream, downstream in zip(elements, elements[1:]):
+        upstream.link(downstream)
+
+    cpu_start, wall_start = cpu_seconds(), time.perf_counter()
+    pipeline.set_state(Gst.State.PLAYING)
+    pipeline.get_bus().timed_pop_filtered(Gst.CLOCK_TIME_NONE, Gst.MessageType.EOS | Gst.MessageType.ERROR)
+    wall, cpu = time.perf_counter() - wall_start, cpu_seconds() - cpu_start
+    pipeline.set_state(Gst.State.NULL)
+    return frames / wall, cpu / frames
+
+
+def bench_threads(args):
+    """videoscale + videoconvert throughput across n-threads values."""
+    Gst.init(None)
+    source, output = parse_resolution(args.source), parse_resolution(args.output)
+    counts = args.threads or sorted({1, 2, 4, 8, os.cpu_count() or 1})
+    for threads in counts:
+        fps, cpu_per_frame = threads_run(source, output, threads, args.frames)
+        print(f"{args.source} -> {args.output} n-threads={threads:2}: {fps:6.1f} fps  "
+              f"cpu={cpu_per_frame * 1000:6.2f} ms/frame")
+
+
+def simulcast_run(args, layers):
+    capture = CapturePipeline(test_source=True, test_resolution=parse_resolution(args.resolution), layers=layers)
+    capture.build(select_encoder(args.encoder))
+    frames = [0] * len(layers)
+
+    def count_frame(pad, info, index):
+        frames[index] += 1
+        return Gst.PadProbeReturn.OK
+
+    for layer in capture.layers:
+        layer.encoder.get_static_pad('src').add_probe(Gst.PadProbeType.BUFFER, count_frame, layer.index)
+    capture.start()
+    time.sleep(1) # Skip negotiation and encoder start-up
+    frames[:] = [0] * len(layers)
+    cpu_start, wall_start = cpu_seconds(), time.perf_counter()
+    time.sleep(args.duration)
+    cpu, wall = cpu_seconds() - cpu_start, time.perf_counter() - wall_start
+    counts = list(frames)
+    capture.close()
+    return cpu / wall, [count / wall for count in counts]
+
+
+def bench_simulcast(args):
+    """Total capture + encode CPU as simulcast layers are added."""
+    Gst.init(None)
+    glib_loop = run_glib_loop()
+    previous = None
+    for count in range(1, len(SIMULCAST_SCALES) + 1):
+        layers = SIMULCAST_SCALES[:count]
+        cpu, fps = simulcast_run(args, layers)
+        step = "" if previous is None else f"  (+{(cpu - previous) * 100:5.1f}%)"
+        rates = " ".join(f"{scale:g}x={rate:4.1f}fps" for scale, rate in zip(layers, fps))
+        print(f"{count} layer(s): cpu={cpu * 100:6.1f}%{step}  {rates}")
+        previous = cpu
+    glib_loop.quit()
@@ -0,0 +1,85 @@
+"""Import and --help time of the host entry points."""
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.common import report
+
+
+HOST_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+IMPORT_TIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+
+
+def import_times(module):
+    """(name, self us, cumulative us, depth) per module `import module` loads, from -X importtime."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=HOST_DIR, capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    times = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            times.append((name, int(self_us), int(cumulative_us), len(indent) // 2))
+    return times
+
+
+def direct_imports(times, module):
+    # Children are printed before their parent, one indent level deeper
+    children = []
+    for name, self_us, cumulative_us, depth in times:
+        if depth == 0:
+            if name == module:
+                return cumulative_us, children
+            children = []
+        elif depth == 1:
+            children.append((name, cumulative_us))
+    return None, []
+
+
+def help_time(script, runs):
+    samples = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, script, '--help'], cwd=HOST_DIR, stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL, check=True)
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+
+def bench_importtime(args):
+    """Import cost per entry module and `--help` wall time per script.
+
+    Exits non-zero when `--help` of any entry script is slower than the
+    budget or fails, so CI can track startup regressions.
+    """
+    for module in args.modules:
+        times = import_times(module)
+        if times is None:
+            print(f"{module}: import failed")
+            continue
+        total, children = direct_imports(times, module)
+        heaviest = sorted(children, key=lambda c: -c[1])[:args.top]
+        print(f"{module}: {total / 1000:.1f}ms ("
+              + ", ".join(f"{name} {us / 1000:.1f}ms" for name, us in heaviest) + ")")
+
+    over_budget = []
+    for script in ('launcher.py', 'signaling_server.py', 'streamer.py'):
+        try:
+            samples = help_time(script, args.runs)
+        except subprocess.CalledProcessError:
+            print(f"{script} --help: failed")
+            over_budget.append(script)
+            continue
+        report(f"{script} --help", samples)
+        if args.help_budget_ms and statistics.median(samples) * 1000 > args.help_budget_ms:
+            over_budget.append(script)
+    if args.help_budget_ms and over_budget:
+        print(f"FAIL: {', '.join(over_budget)} --help over the {args.help_budget_ms}ms budget")
+        sys.exit(1)
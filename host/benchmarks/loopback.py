@@ -0,0 +1,142 @@
+"""In-process receiving peers that stand in for the headset."""
+import threading
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstWebRTC', '1.0')
+gi.require_version('GstSdp', '1.0')
+from gi.repository import Gst, GstWebRTC, GstSdp, GLib
+
+from pipeline import make_element
+from session import StreamSession, set_loss_recovery
+
+
+class LoopbackPeer:
+    """Receiving webrtcbin in its own pipeline, standing in for the headset.
+
+    Signaling with the host session is done by direct calls instead of a
+    websocket. `first_packet` is set when the first RTP packet comes out of
+    webrtcbin, `first_frame` when the first decodable frame (the first
+    keyframe) leaves the depayloader. `rtx` and `fec` have it accept
+    retransmissions and forward error correction when the host offers them.
+    """
+
+    def __init__(self, name="loopback", rtx=False, fec=False):
+        self.name = name
+        self.host = None
+        self.rtx = rtx
+        self.fec = fec
+        self.first_packet = threading.Event()
+        self.first_packet_time = None
+        self.first_frame = threading.Event()
+        self.first_frame_time = None
+        self.keyframe_times = []
+        self.frames = 0
+        self.frame_bytes = 0
+        self.pipeline = Gst.Pipeline.new(name)
+        self.webrtcbin = make_element("webrtcbin", f"{name}_webrtcbin")
+        self.webrtcbin.set_property("bundle-policy", "max-bundle")
+        self.pipeline.add(self.webrtcbin)
+        self.webrtcbin.connect('on-ice-candidate', self.on_ice_candidate)
+        self.webrtcbin.connect('pad-added', self.on_pad_added)
+        self.webrtcbin.connect('on-new-transceiver', self.on_new_transceiver)
+
+    def start(self):
+        self.pipeline.set_state(Gst.State.PLAYING)
+
+    def stop(self):
+        self.pipeline.set_state(Gst.State.NULL)
+
+    def send(self, message):
+        # Signaling callback handed to the host StreamSession
+        if message['type'] == 'offer':
+            self.handle_offer(message['sdp'])
+        elif message['type'] == 'ice-candidate':
+            try:
+                self.webrtcbin.emit('add-ice-candidate', message['sdpMLineIndex'], message['sdpMid'], message['candidate'])
+            except TypeError:
+                self.webrtcbin.emit('add-ice-candidate', message['sdpMLineIndex'], message['candidate'])
+
+    def handle_offer(self, sdp):
+        res, sdp_msg = GstSdp.SDPMessage.new_from_text(sdp)
+        offer = GstWebRTC.WebRTCSessionDescription.new(GstWebRTC.WebRTCSDPType.OFFER, sdp_msg)
+        promise = Gst.Promise.new_with_change_func(self.on_remote_description_set, None, None)
+        self.webrtcbin.emit('set-remote-description', offer, promise)
+
+    def on_remote_description_set(self, promise, *args):
+        promise = Gst.Promise.new_with_change_func(self.on_answer_created, None, None)
+        self.webrtcbin.emit('create-answer', None, promise)
+
+    def on_answer_created(self, promise, *args):
+        answer = promise.get_reply().get_value('answer')
+        self.webrtcbin.emit('set-local-description', answer, None)
+        self.host.handle_answer(answer.sdp.as_text())
+
+    def on_ice_candidate(self, _, mline_index, candidate):
+        self.host.handle_ice_candidate(candidate, "video0", mline_index)
+
+    def on_new_transceiver(self, webrtcbin, transceiver):
+        # Before the answer is created, so it accepts what the offer has
+        set_loss_recovery(transceiver, self.rtx, 0 if self.fec else None)
+
+    def on_pad_added(self, webrtcbin, pad):
+        if pad.get_direction() != Gst.PadDirection.SRC:
+            return
+        caps = pad.get_current_caps()
+        encoding = caps.get_structure(0).get_string('encoding-name') if caps else 'H264'
+        depay = make_element("rtpvp8depay" if encoding == 'VP8' else "rtph264depay", None)
+        if depay.find_property("wait-for-keyframe"):
+            depay.set_property("wait-for-keyframe", True)
+        if depay.find_property("request-keyframe"):
+            # Turns detected loss into a PLI back to the host
+            depay.set_property("request-keyframe", True)
+        sink = make_element("fakesink", None, sync=False)
+        self.pipeline.add(depay)
+        self.pipeline.add(sink)
+        depay.link(sink)
+        pad.link(depay.get_static_pad('sink'))
+        depay.sync_state_with_parent()
+        sink.sync_state_with_parent()
+        pad.add_probe(Gst.PadProbeType.BUFFER, self.on_packet, None)
+        sink.get_static_pad('sink').add_probe(Gst.PadProbeType.BUFFER, self.on_frame, None)
+
+    def on_packet(self, pad, info, user_data):
+        self.first_packet_time = time.perf_counter()
+        self.first_packet.set()
+        return Gst.PadProbeReturn.REMOVE
+
+    def on_frame(self, pad, info, user_data):
+        now = time.perf_counter()
+        self.frames += 1
+        self.frame_bytes += info.get_buffer().get_size()
+        if not info.get_buffer().has_flags(Gst.BufferFlags.DELTA_UNIT):
+            self.keyframe_times.append(now)
+        if not self.first_frame.is_set():
+            self.first_frame_time = now
+            self.first_frame.set()
+        return Gst.PadProbeReturn.OK
+
+
+def run_glib_loop():
+    loop = GLib.MainLoop()
+    threading.Thread(target=loop.run, daemon=True).start()
+    return loop
+
+
+def connect_loopback(capture, session_id, timeout, stun_server=None):
+    """Attach a host session plus loopback peer and wait for the first frame.
+
+    Returns (session, peer, seconds to first frame or None on timeout).
+    """
+    peer = LoopbackPeer(f"peer{session_id}")
+    session = StreamSession(session_id, peer.send, stun_server=stun_server)
+    peer.host = session
+    peer.start()
+
+    t0 = time.perf_counter()
+    session.attach(capture)
+    session.create_offer()
+    if not peer.first_frame.wait(timeout):
+        return session, peer, None
+    return session, peer, peer.first_frame_time - t0
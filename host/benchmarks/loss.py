@@ -0,0 +1,202 @@
+"""Loss recovery on a lossy loopback link: keyframes and fec modes."""
+import random
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from adaptive_bitrate import AdaptiveBitrate
+from encoders import select_encoder
+from pipeline import CapturePipeline
+from rate_control import FecController
+from session import StreamSession
+
+from benchmarks.common import report
+from benchmarks.loopback import LoopbackPeer, connect_loopback, run_glib_loop
+
+
+class LossInjector:
+    """Drops every RTP packet on a pad while active, like a Wi-Fi dropout."""
+
+    def __init__(self, pad):
+        self.active = False
+        pad.add_probe(Gst.PadProbeType.BUFFER | Gst.PadProbeType.BUFFER_LIST, self.probe, None)
+
+    def probe(self, pad, info, user_data):
+        return Gst.PadProbeReturn.DROP if self.active else Gst.PadProbeReturn.OK
+
+
+class LossyWire:
+    """Gilbert-Elliott packet loss on the datagrams a webrtcbin receives.
+
+    The link flips into a bad state, where every packet is lost, with mean
+    length `burst` packets, often enough for `loss` of all packets to go
+    missing: the bursty loss of Wi-Fi rather than independent drops. It
+    sits after the sender's FEC and retransmissions, and only drops while
+    `active`, so the DTLS handshake gets through. Counts every datagram
+    sent, lost or not.
+    """
+
+    def __init__(self, webrtcbin, loss=0.02, burst=3.0, seed=1):
+        self.active = False
+        self.random = random.Random(seed)
+        self.leave_bad = 1 / burst
+        self.enter_bad = loss * self.leave_bad / (1 - loss)
+        self.bad = False
+        self.packets = 0
+        self.bytes = 0
+        self.dropped = 0
+        sources = [element for element in webrtcbin.iterate_recurse()
+                   if element.get_factory() and element.get_factory().get_name() == 'nicesrc']
+        for source in sources:
+            source.get_static_pad('src').add_probe(Gst.PadProbeType.BUFFER, self.probe, None)
+
+    def probe(self, pad, info, user_data):
+        if not self.active:
+            return Gst.PadProbeReturn.OK
+        self.packets += 1
+        self.bytes += info.get_buffer().get_size()
+        self.bad = self.random.random() >= self.leave_bad if self.bad else self.random.random() < self.enter_bad
+        if self.bad:
+            self.dropped += 1
+            return Gst.PadProbeReturn.DROP
+        return Gst.PadProbeReturn.OK
+
+
+def fec_run(args, rtx, fec):
+    """Goodput, wire overhead and lost frames for one recovery mode."""
+    capture = CapturePipeline(test_source=True, keyframe_interval=args.gop, bitrate=args.bitrate,
+                              test_pattern=args.pattern)
+    capture.build(select_encoder(args.encoder))
+    encoded = {'frames': 0, 'bytes': 0}
+
+    def count_encoded(pad, info, user_data):
+        encoded['frames'] += 1
+        encoded['bytes'] += info.get_buffer().get_size()
+        return Gst.PadProbeReturn.OK
+
+    capture.encoder.get_static_pad('src').add_probe(Gst.PadProbeType.BUFFER, count_encoded, None)
+    capture.start()
+
+    peer = LoopbackPeer("fec", rtx=rtx, fec=fec is not None)
+    start_fec = FecController.START_PERCENTAGE if fec == 'adaptive' else fec
+    session = StreamSession(0, peer.send, stun_server=None, rtx=rtx, fec=start_fec)
+    peer.host = session
+    peer.start()
+    session.attach(capture)
+    session.create_offer()
+    if not peer.first_frame.wait(args.timeout):
+        print("  loopback peer never received a frame")
+        session.detach()
+        peer.stop()
+        capture.close()
+        return None
+
+    adaptive = None
+    if fec == 'adaptive':
+        # Bitrate pinned so only the FEC overhead follows the loss
+        adaptive = AdaptiveBitrate(capture, lambda: [session], min_bitrate=args.bitrate,
+                                   max_bitrate=args.bitrate, adapt_fec=True)
+        adaptive.start()
+
+    wire = LossyWire(peer.webrtcbin, loss=args.loss, burst=args.burst, seed=args.seed)
+    time.sleep(1)
+    requested = capture.keyframes_requested
+    # Receiver-side counts lag the encoder by the jitterbuffer latency
+    lag = 0.3
+    wire.active = True
+    frames, media = encoded['frames'], encoded['bytes']
+    time.sleep(lag)
+    received, goodput = peer.frames, peer.frame_bytes
+    wire.packets = wire.bytes = wire.dropped = 0
+    time.sleep(args.duration - lag)
+    frames, media = encoded['frames'] - frames, encoded['bytes'] - media
+    time.sleep(lag)
+    received, goodput = peer.frames - received, peer.frame_bytes - goodput
+    wire.active = False
+
+    if adaptive:
+        adaptive.stop()
+    session.detach()
+    peer.stop()
+    capture.close()
+    return dict(goodput=goodput * 8 / args.duration / 1000, overhead=wire.bytes / max(1, media) - 1,
+                lost=max(0, frames - received), frames=frames, dropped=wire.dropped, packets=wire.packets,
+                keyframes=capture.keyframes_requested - requested, fec=session.fec_percentage)
+
+
+def bench_fec(args):
+    """Packet loss repair on a bursty link: keyframes only vs. RTX vs. FEC."""
+    Gst.init(None)
+    glib_loop = run_glib_loop()
+    modes = [("keyframes only", False, None), ("RTX", True, None),
+             (f"FEC {args.fec}%", False, args.fec), (f"RTX + FEC {args.fec}%", True, args.fec),
+             ("RTX + adaptive FEC", True, 'adaptive')]
+    print(f"link: {args.loss:.1%} loss in bursts of {args.burst:g} packets, "
+          f"{args.bitrate} kbps for {args.duration:g}s per mode")
+    for label, rtx, fec in modes:
+        result = fec_run(args, rtx, fec)
+        if result is None:
+            continue
+        fec_now = f"  FEC now {result['fec']}%" if fec == 'adaptive' else ""
+        print(f"{label}: goodput={result['goodput']:.0f} kbps  overhead={result['overhead']:.1%}  "
+              f"frames lost={result['lost']}/{result['frames']}  keyframe requests={result['keyframes']}  "
+              f"packets dropped={result['dropped']}/{result['packets']}{fec_now}")
+    glib_loop.quit()
+
+
+def keyframe_run(args, keyframe_interval):
+    capture = CapturePipeline(test_source=True, keyframe_interval=keyframe_interval,
+                              test_pattern=args.pattern)
+    capture.build(select_encoder(args.encoder))
+    encoded_bytes = [0]
+
+    def count_bytes(pad, info, user_data):
+        encoded_bytes[0] += info.get_buffer().get_size()
+        return Gst.PadProbeReturn.OK
+
+    capture.payloader.get_static_pad('src').add_probe(Gst.PadProbeType.BUFFER, count_bytes, None)
+    capture.start()
+    session, peer, elapsed = connect_loopback(capture, 0, args.timeout)
+    if elapsed is None:
+        print("  loopback peer never received a frame")
+        return None
+
+    injector = LossInjector(session.branches[0].queue.get_static_pad('src'))
+    time.sleep(1)
+    encoded_bytes[0] = 0
+    start = time.perf_counter()
+    recoveries = []
+    for _ in range(args.losses):
+        time.sleep(args.spacing)
+        injector.active = True
+        time.sleep(args.loss_ms / 1000)
+        injector.active = False
+        loss_end = time.perf_counter()
+        time.sleep(args.spacing)
+        after = [t for t in peer.keyframe_times if t >= loss_end]
+        recoveries.append(after[0] - loss_end if after else None)
+    kbps = encoded_bytes[0] * 8 / (time.perf_counter() - start) / 1000
+
+    session.detach()
+    peer.stop()
+    capture.close()
+    return kbps, recoveries, capture.keyframes_requested, capture.keyframes_forced
+
+
+def bench_keyframes(args):
+    """Average bitrate and post-loss recovery: fixed short GOP vs on-demand keyframes."""
+    Gst.init(None)
+    glib_loop = run_glib_loop()
+    strategies = [("periodic (every 10 frames)", 10), (f"on-demand (GOP {args.gop})", args.gop)]
+    for label, interval in strategies:
+        result = keyframe_run(args, interval)
+        if result is None:
+            continue
+        kbps, recoveries, requested, forced = result
+        recovered = [r for r in recoveries if r is not None]
+        print(f"{label}: bitrate={kbps:.0f} kbps  keyframe requests={requested} forced={forced}  "
+              f"unrecovered={len(recoveries) - len(recovered)}/{len(recoveries)}")
+        report("  recovery after loss", recovered)
+    glib_loop.quit()
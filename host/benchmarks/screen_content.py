@@ -0,0 +1,210 @@
+"""Quality per bit of flat vs. region-of-interest encoding (the 'roi' mode)."""
+import collections
+import math
+import statistics
+import sys
+import threading
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstVideo', '1.0')
+from gi.repository import Gst, GstVideo
+
+from encoders import select_encoder
+from pipeline import link_many, make_element, request_pad
+from roi import RoiTagger
+
+from benchmarks.common import parse_resolution
+
+
+SAMPLE_TEXT = "\\n".join(
+    f"{i:3d}  def update(self, stats): loss = self.loss(stats); congested = stats.rtt > self.min_rtt * 2"
+    for i in range(40))
+
+
+def roi_source(args):
+    """Raw I420 desktop frames: a recording when given, else moving text."""
+    if args.input:
+        description = f'filesrc location="{args.input}" ! decodebin ! videoconvert'
+        if args.frames:
+            description += f" ! identity eos-after={args.frames}"
+    else:
+        width, height = parse_resolution(args.resolution)
+        description = (f"videotestsrc num-buffers={args.frames or 300} pattern=smpte horizontal-speed=2 ! "
+                       f"video/x-raw,width={width},height={height},framerate=30/1")
+        if Gst.ElementFactory.find("textoverlay"):
+            description += f' ! textoverlay text="{SAMPLE_TEXT}" font-desc="Monospace 11" valignment=top halignment=left'
+    return Gst.parse_bin_from_description(description + " ! videoconvert ! video/x-raw,format=I420", True)
+
+
+def luma(sample):
+    import numpy
+    info = GstVideo.VideoInfo.new_from_caps(sample.get_caps())
+    buffer = sample.get_buffer()
+    ok, mapped = buffer.map(Gst.MapFlags.READ)
+    try:
+        stride = info.stride[0]
+        plane = numpy.frombuffer(mapped.data, numpy.uint8, count=stride * info.height, offset=info.offset[0])
+        return plane.reshape(info.height, stride)[:, :info.width].astype(numpy.float64)
+    finally:
+        buffer.unmap(mapped)
+
+
+def psnr(reference, decoded):
+    import numpy
+    mse = numpy.mean((reference - decoded) ** 2)
+    return 99.0 if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+
+def ssim(reference, decoded, block=8):
+    """Mean SSIM over non-overlapping `block` x `block` windows."""
+    import numpy
+    height, width = (reference.shape[0] // block) * block, (reference.shape[1] // block) * block
+    if not height or not width:
+        return 1.0
+
+    def blocks(plane):
+        plane = plane[:height, :width].reshape(height // block, block, width // block, block)
+        return plane.transpose(0, 2, 1, 3).reshape(-1, block * block)
+
+    a, b = blocks(reference), blocks(decoded)
+    mean_a, mean_b = a.mean(axis=1), b.mean(axis=1)
+    var_a, var_b = a.var(axis=1), b.var(axis=1)
+    cov = ((a - mean_a[:, None]) * (b - mean_b[:, None])).mean(axis=1)
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    return float(numpy.mean(((2 * mean_a * mean_b + c1) * (2 * cov + c2)) /
+                            ((mean_a ** 2 + mean_b ** 2 + c1) * (var_a + var_b + c2))))
+
+
+def pointer_path(index, width, height):
+    # The pointer circles the middle of the screen, once every 10 s at 30 fps
+    angle = 2 * math.pi * index / 300
+    return int(width / 2 + width / 4 * math.cos(angle)), int(height / 2 + height / 4 * math.sin(angle))
+
+
+def roi_run(args, spec, use_roi):
+    """Encode, decode and compare the source; returns kbps and quality per region."""
+    pipeline = Gst.Pipeline.new("roi")
+    source = roi_source(args)
+    tee = make_element("tee", None)
+    reference_queue = make_element("queue", None, max_size_buffers=30)
+    reference_sink = make_element("appsink", None, sync=False, emit_signals=True)
+    encode_queue = make_element("queue", None, max_size_buffers=30)
+    encoder = spec.make()
+    spec.set_bitrate(encoder, args.bitrate)
+    spec.set_keyframe_interval(encoder, args.gop)
+    decode = make_element("decodebin", None)
+    convert = make_element("videoconvert", None)
+    decoded_caps = make_element("capsfilter", None, caps=Gst.Caps.from_string("video/x-raw,format=I420"))
+    decoded_sink = make_element("appsink", None, sync=False, emit_signals=True)
+    for elem in (source, tee, reference_queue, reference_sink, encode_queue, encoder, decode, convert,
+                 decoded_caps, decoded_sink):
+        pipeline.add(elem)
+    link_many(source, tee, reference_queue, reference_sink)
+    link_many(encode_queue, encoder, decode)
+    link_many(convert, decoded_caps, decoded_sink)
+    request_pad(tee, 'src_%u').link(encode_queue.get_static_pad('sink'))
+    decode.connect('pad-added', lambda element, pad: pad.link(convert.get_static_pad('sink')))
+
+    lock = threading.Lock()
+    references = {} # pts -> (frame index, luma)
+    frame_size = [None]
+    state = {'tagged': 0, 'bytes': 0, 'pts': []}
+    scores = collections.defaultdict(list)
+
+    def on_reference(sink):
+        sample = sink.emit('pull-sample')
+        plane = luma(sample)
+        with lock:
+            references[sample.get_buffer().pts] = (len(state['pts']), plane)
+            state['pts'].append(sample.get_buffer().pts)
+        return Gst.FlowReturn.OK
+
+    def on_decoded(sink):
+        sample = sink.emit('pull-sample')
+        with lock:
+            index, reference = references.pop(sample.get_buffer().pts, (None, None))
+        if reference is None:
+            return Gst.FlowReturn.OK
+        decoded = luma(sample)
+        height, width = reference.shape
+        x, y = pointer_path(index, width, height)
+        half = args.pointer_size // 2
+        regions = {'frame': (0, 0, width, height), 'focus': (width // 4, height // 4, width // 2, height // 2),
+                   'pointer': (max(0, x - half), max(0, y - half), args.pointer_size, args.pointer_size)}
+        for name, (left, top, w, h) in regions.items():
+            ref, dec = reference[top:top + h, left:left + w], decoded[top:top + h, left:left + w]
+            scores[f"{name} psnr"].append(psnr(ref, dec))
+            scores[f"{name} ssim"].append(ssim(ref, dec))
+        return Gst.FlowReturn.OK
+
+    def note_size(pad, info, user_data):
+        # Before the tagger's probe on the same frame, which scales by it
+        structure = pad.get_current_caps().get_structure(0)
+        frame_size[0] = structure.get_int('width')[1], structure.get_int('height')[1]
+        return Gst.PadProbeReturn.OK
+
+    def count_bytes(pad, info, user_data):
+        state['bytes'] += info.get_buffer().get_size()
+        return Gst.PadProbeReturn.OK
+
+    reference_sink.connect('new-sample', on_reference)
+    decoded_sink.connect('new-sample', on_decoded)
+    encoder.get_static_pad('src').add_probe(Gst.PadProbeType.BUFFER, count_bytes, None)
+    encode_queue.get_static_pad('sink').add_probe(Gst.PadProbeType.BUFFER, note_size, None)
+
+    tagger = None
+    if use_roi:
+        def pointer():
+            # Called once per frame, in order, from the encoder's streaming thread
+            index = state['tagged']
+            state['tagged'] += 1
+            width, height = frame_size[0] or (1, 1)
+            return pointer_path(index, width, height)
+
+        def focus():
+            width, height = frame_size[0] or (1, 1)
+            return width // 4, height // 4, width // 2, height // 2
+
+        tagger = RoiTagger(spec, lambda: [(0, 0) + (frame_size[0] or (1, 1))], pointer=pointer, focus=focus,
+                           pointer_size=args.pointer_size)
+        tagger.tag(encoder)
+
+    pipeline.set_state(Gst.State.PLAYING)
+    msg = pipeline.get_bus().timed_pop_filtered(args.timeout * Gst.SECOND,
+                                               Gst.MessageType.EOS | Gst.MessageType.ERROR)
+    pipeline.set_state(Gst.State.NULL)
+    if msg is None or msg.type == Gst.MessageType.ERROR:
+        print(f"  {spec.name}: {msg.parse_error()[0] if msg else 'timed out'}")
+        return None
+    pts = state['pts']
+    frames = len(pts)
+    duration = (pts[-1] - pts[0]) / Gst.SECOND * frames / max(1, frames - 1) if frames > 1 else 1.0
+    result = {name: statistics.mean(values) for name, values in scores.items()}
+    result['kbps'] = state['bytes'] * 8 / duration / 1000
+    result['frames'] = frames
+    result['tagged'] = tagger.frames if tagger else 0
+    return result
+
+
+def bench_roi(args):
+    """Quality per bit around the pointer and focused window: flat vs. ROI encoding."""
+    try:
+        import numpy # noqa: F401
+    except ImportError:
+        print("The roi benchmark needs numpy for PSNR/SSIM")
+        sys.exit(1)
+    Gst.init(None)
+    spec = select_encoder(args.encoder)
+    if not RoiTagger.supported(spec):
+        print(f"{spec.name} ignores ROI metadata; both runs will encode flat")
+    source = f"'{args.input}'" if args.input else f"synthetic text, {args.resolution}"
+    print(f"{spec.name} at {args.bitrate} kbps on {source}")
+    for label, use_roi in (("flat", False), ("ROI", True)):
+        result = roi_run(args, spec, use_roi)
+        if result is None:
+            continue
+        print(f"{label}: {result['kbps']:.0f} kbps over {result['frames']} frames"
+              + (f" ({result['tagged']} tagged)" if use_roi else ""))
+        for region in ('frame', 'focus', 'pointer'):
+            print(f"  {region:8s} PSNR {result[f'{region} psnr']:.2f} dB  SSIM {result[f'{region} ssim']:.4f}")
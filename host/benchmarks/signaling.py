@@ -0,0 +1,112 @@
+"""Signaling server latency under many rooms; needs aiohttp but no GStreamer."""
+import asyncio
+import json
+import logging
+import statistics
+import time
+
+from benchmarks.common import report_percentiles
+
+
+async def signaling_room(http, url, room, args, latencies):
+    """One host and one client exchanging offers, answers and ICE candidates.
+
+    Every message carries its send time, so latency is measured end to end
+    through the server on one clock.
+    """
+    host = await http.ws_connect(url)
+    client = await http.ws_connect(url)
+    try:
+        await host.send_json({'type': 'register', 'role': 'host', 'room': room})
+        await client.send_json({'type': 'register', 'role': 'client', 'room': room})
+        session_id = None
+        async for msg in host:
+            data = json.loads(msg.data)
+            if data['type'] == 'client_connected':
+                session_id = data['session']
+                break
+        padding = 'x' * args.sdp_bytes
+        wanted_candidates = args.exchanges * args.candidates
+
+        async def client_side():
+            offers = candidates = 0
+            async for msg in client:
+                data = json.loads(msg.data)
+                now = time.perf_counter()
+                if data['type'] == 'offer':
+                    latencies['offer'].append(now - float(data['sdp'].split()[0]))
+                    offers += 1
+                    await client.send_json({'type': 'answer', 'sdp': f"{time.perf_counter()} {padding}"})
+                elif data['type'] == 'ice-candidate':
+                    latencies['candidate'].append(now - float(data['candidate']))
+                    candidates += 1
+                elif data['type'] == 'ice-candidates':
+                    for candidate in data['candidates']:
+                        latencies['candidate'].append(now - float(candidate['candidate']))
+                    candidates += len(data['candidates'])
+                    latencies['batch'].append(len(data['candidates']))
+                if offers == args.exchanges and candidates == wanted_candidates:
+                    return
+
+        async def host_side():
+            answers = 0
+            async for msg in host:
+                data = json.loads(msg.data)
+                if data['type'] == 'answer':
+                    latencies['answer'].append(time.perf_counter() - float(data['sdp'].split()[0]))
+                    answers += 1
+                    if answers == args.exchanges:
+                        return
+
+        readers = asyncio.gather(client_side(), host_side())
+        for _ in range(args.exchanges):
+            await host.send_json({'type': 'offer', 'session': session_id, 'sdp': f"{time.perf_counter()} {padding}"})
+            for _ in range(args.candidates):
+                await host.send_json({'type': 'ice-candidate', 'session': session_id, 'candidate': f"{time.perf_counter()}",
+                                      'sdpMid': 'video0', 'sdpMLineIndex': 0})
+        await readers
+    finally:
+        await host.close()
+        await client.close()
+
+
+def bench_signaling(args):
+    """Message latency through the signaling server with many concurrent rooms."""
+    import aiohttp
+    from signaling_server import start_server
+    # Per-message INFO logs would dominate the measurement
+    logging.getLogger('signaling_server').setLevel(logging.WARNING)
+    logging.getLogger('aiohttp.access').setLevel(logging.WARNING)
+    latencies = {'offer': [], 'answer': [], 'candidate': [], 'batch': []}
+
+    async def run():
+        runner = None
+        url = args.url
+        if not url:
+            # Shares this process and loop with the load; use --url for a separate server
+            runner = await start_server(args.port, host='127.0.0.1', max_queue=args.max_queue,
+                                        overflow=args.overflow, batch_window=args.batch_ms / 1000)
+            url = f'http://127.0.0.1:{args.port}/ws'
+        try:
+            async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as http:
+                t0 = time.perf_counter()
+                results = await asyncio.gather(
+                    *(asyncio.wait_for(signaling_room(http, url, f"room{i}", args, latencies), args.timeout)
+                      for i in range(args.rooms)),
+                    return_exceptions=True)
+                wall = time.perf_counter() - t0
+        finally:
+            if runner:
+                await runner.cleanup()
+        return wall, sum(isinstance(r, BaseException) for r in results)
+
+    wall, failures = asyncio.run(run())
+    messages = len(latencies['offer']) + len(latencies['answer']) + len(latencies['candidate'])
+    print(f"{args.rooms} rooms: {messages} messages in {wall:.2f}s ({messages / wall:.0f}/s)")
+    report_percentiles("offer", latencies['offer'])
+    report_percentiles("answer", latencies['answer'])
+    report_percentiles("ice candidate", latencies['candidate'])
+    if latencies['batch']:
+        print(f"candidates per batch: mean={statistics.mean(latencies['batch']):.1f}")
+    if failures:
+        print(f"{failures} room(s) failed or timed out after {args.timeout}s")
@@ -0,0 +1,128 @@
+"""Per-viewer cost: cursor channel and shared-encode viewer modes."""
+import math
+import struct
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from cursor import CursorSender
+from encoders import select_encoder
+from pipeline import CapturePipeline
+
+from benchmarks.common import cpu_seconds, parse_resolution
+from benchmarks.loopback import connect_loopback, run_glib_loop
+
+
+def synthetic_motion(on_move, rate, duration, width=1920, height=1080):
+    """Calls on_move like a high polling rate mouse drawing circles."""
+    interval = 1 / rate
+    end = time.perf_counter() + duration
+    next_move = time.perf_counter()
+    i = 0
+    while time.perf_counter() < end:
+        angle = i / rate * 2 * math.pi
+        on_move(width / 2 + math.cos(angle) * 400, height / 2 + math.sin(angle) * 400)
+        i += 1
+        next_move += interval
+        delay = next_move - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    return i
+
+
+def bench_cursor(args):
+    """Cursor packets/s and CPU: send-per-motion-event vs. coalesced sender."""
+    Gst.init(None)
+    glib_loop = run_glib_loop()
+    capture = CapturePipeline(test_source=True)
+    capture.build(select_encoder(args.encoder))
+    capture.start()
+    session, peer, elapsed = connect_loopback(capture, 0, args.timeout)
+    deadline = time.perf_counter() + args.timeout
+    while not session.data_channel_open() and time.perf_counter() < deadline:
+        time.sleep(0.05)
+    if not session.data_channel_open():
+        print("cursor data channel never opened")
+        return
+
+    # Baseline CPU of the running stream, subtracted from both modes
+    cpu_start = cpu_seconds()
+    time.sleep(args.duration)
+    idle_cpu = (cpu_seconds() - cpu_start) / args.duration
+
+    sent = [0]
+
+    def legacy_move(x, y):
+        # The old on_mouse_move: pack two floats and send from the listener thread
+        data = struct.pack('>ff', float(x / 1920), float(y / 1080))
+        if session.send_data(data):
+            sent[0] += 1
+
+    sender = CursorSender(lambda: [session], lambda: [(0, 0, 1920, 1080)], rate=args.rate)
+    for label, on_move in (("per-event", legacy_move), (f"coalesced@{args.rate}Hz", sender.on_move)):
+        if on_move == sender.on_move:
+            sender.start()
+        sent[0] = 0
+        cpu_start, wall_start = cpu_seconds(), time.perf_counter()
+        moves = synthetic_motion(on_move, args.move_rate, args.duration)
+        wall, cpu = time.perf_counter() - wall_start, cpu_seconds() - cpu_start
+        packets = sender.packets if on_move == sender.on_move else sent[0]
+        sender.stop()
+        print(f"{label:16}: {moves / wall:6.0f} moves/s -> {packets / wall:6.0f} packets/s  "
+              f"extra cpu={(cpu / wall - idle_cpu) * 100:5.1f}%")
+
+    session.detach()
+    peer.stop()
+    capture.close()
+    glib_loop.quit()
+
+
+def bench_viewers(args):
+    """Process CPU and encoded frame rate as loopback viewers are added one by one.
+
+    The encoder output rate must stay flat (one encode for everyone); the CPU
+    step per viewer is the tee branch, webrtcbin/SRTP and the in-process
+    loopback receiver, which only depayloads.
+    """
+    Gst.init(None)
+    glib_loop = run_glib_loop()
+    capture = CapturePipeline(test_source=True, test_resolution=parse_resolution(args.resolution))
+    capture.build(select_encoder(args.encoder))
+    encoded = [0]
+
+    def count_frame(pad, info, user_data):
+        encoded[0] += 1
+        return Gst.PadProbeReturn.OK
+
+    capture.encoder.get_static_pad('src').add_probe(Gst.PadProbeType.BUFFER, count_frame, None)
+    capture.start()
+
+    viewers = []
+    previous_cpu = None
+    for count in range(args.max_viewers + 1):
+        if count:
+            session, peer, elapsed = connect_loopback(capture, count, args.timeout)
+            viewers.append((session, peer))
+            if elapsed is None:
+                print(f"viewer {count} timed out after {args.timeout}s")
+                break
+        time.sleep(1) # Let the new branch settle
+        received = [peer.frames for _, peer in viewers]
+        encoded[0] = 0
+        cpu_start, wall_start = cpu_seconds(), time.perf_counter()
+        time.sleep(args.duration)
+        wall = time.perf_counter() - wall_start
+        cpu = (cpu_seconds() - cpu_start) / wall * 100
+        fps = [(peer.frames - before) / wall for (_, peer), before in zip(viewers, received)]
+        step = "" if previous_cpu is None else f"  (+{cpu - previous_cpu:5.1f}%)"
+        lowest = f"  slowest viewer={min(fps):5.1f} fps" if fps else ""
+        print(f"{count} viewer(s): cpu={cpu:6.1f}%{step}  encoded={encoded[0] / wall:5.1f} fps{lowest}")
+        previous_cpu = cpu
+
+    for session, peer in viewers:
+        session.detach()
+        peer.stop()
+    capture.close()
+    glib_loop.quit()
@@ -0,0 +1,236 @@
+import logging
+import re
+import select
+import threading
+
+logger = logging.getLogger(__name__)
+
+try:
+    from Xlib import X, display as xdisplay
+    from Xlib.error import XError
+except ImportError:
+    xdisplay = None
+
+
+def parse_geometry(text):
+    """Parse an X geometry string 'WIDTHxHEIGHT+X+Y' into (x, y, width, height)."""
+    match = re.fullmatch(r"(\d+)x(\d+)\+(\d+)\+(\d+)", text.strip())
+    if not match:
+        raise ValueError(f"Expected WIDTHxHEIGHT+X+Y, got '{text}'")
+    width, height, x, y = (int(v) for v in match.groups())
+    return x, y, width, height
+
+
+def parse_xid(text):
+    # xwininfo prints window ids in hex
+    return int(text, 0)
+
+
+def even_region(x, y, width, height):
+    # 4:2:0 encoders need even frame sizes
+    return x, y, max(2, width // 2 * 2), max(2, height // 2 * 2)
+
+
+def window_geometry(display, window):
+    """(x, y, width, height) of `window` in root coordinates."""
+    geometry = window.get_geometry()
+    root = display.screen().root
+    origin = window.translate_coords(root, 0, 0)
+    # translate_coords gives the root origin in window coordinates
+    return -origin.x, -origin.y, geometry.width, geometry.height
+
+
+def x_window_geometry(xid, display_name=None):
+    try:
+        disp = xdisplay.Display(display_name)
+        geometry = window_geometry(disp, disp.create_resource_object('window', xid))
+        disp.close()
+    except Exception:
+        return None
+    return geometry
+
+
+class WindowTracker:
+    """Follows one X window's position and size on its own thread.
+
+    Uses a private X connection like damage.DamageTracker. `geometry()`
+    returns the window's (x, y, width, height) in root coordinates;
+    `on_resize(width, height)` is called from the tracker thread when the
+    size changes (moves only update the geometry) and `on_destroy()` when
+    the window goes away.
+    """
+
+    def __init__(self, xid, on_resize=None, on_destroy=None, display_name=None):
+        self.xid = xid
+        self.on_resize = on_resize
+        self.on_destroy = on_destroy
+        self.display_name = display_name
+        self.display = None
+        self.window = None
+        self.lock = threading.Lock()
+        self.current = None
+        self.thread = None
+        self.running = False
+
+    @staticmethod
+    def available():
+        return xdisplay is not None
+
+    def start(self):
+        if xdisplay is None:
+            raise RuntimeError("python-xlib is required to capture a window")
+        self.display = xdisplay.Display(self.display_name)
+        self.window = self.display.create_resource_object('window', self.xid)
+        try:
+            self.window.change_attributes(event_mask=X.StructureNotifyMask)
+            self.current = window_geometry(self.display, self.window)
+        except XError as e:
+            self.display.close()
+            raise RuntimeError(f"Window {self.xid:#x} not found: {e}")
+        logger.info(f"Capturing window {self.xid:#x} at {self.current}")
+
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=1)
+            self.thread = None
+        if self.display:
+            self.display.close()
+            self.display = None
+
+    def _run(self):
+        fd = self.display.fileno()
+        while self.running:
+            if not self.display.pending_events():
+                select.select([fd], [], [], 0.2)
+            changed = False
+            while self.display.pending_events():
+                event = self.display.next_event()
+                if event.type == X.DestroyNotify:
+                    logger.warning(f"Captured window {self.xid:#x} was destroyed")
+                    self.running = False
+                    if self.on_destroy:
+                        self.on_destroy()
+                    return
+                if event.type in (X.ConfigureNotify, X.ReparentNotify, X.MapNotify):
+                    changed = True
+            # A drag produces a burst of ConfigureNotify; one update is enough
+            if changed:
+                self.update()
+
+    def update(self):
+        try:
+            geometry = window_geometry(self.display, self.window)
+        except XError:
+            return
+        with self.lock:
+            previous, self.current = self.current, geometry
+        if previous[2:] != geometry[2:] and self.on_resize:
+            logger.info(f"Captured window resized to {geometry[2]}x{geometry[3]}")
+            self.on_resize(geometry[2], geometry[3])
+
+    def geometry(self):
+        with self.lock:
+            return self.current
+
+
+class FocusTracker:
+    """Follows the focused window and its geometry on its own thread.
+
+    Watches the window manager's _NET_ACTIVE_WINDOW on the root window and
+    then the focused window itself, with a private X connection like
+    WindowTracker. `geometry()` returns the focused window's (x, y, width,
+    height) in root coordinates, or None while nothing has focus or the
+    window manager does not publish it.
+    """
+
+    def __init__(self, display_name=None):
+        self.display_name = display_name
+        self.display = None
+        self.root = None
+        self.active_atom = None
+        self.window = None
+        self.lock = threading.Lock()
+        self.current = None
+        self.thread = None
+        self.running = False
+
+    @staticmethod
+    def available():
+        return xdisplay is not None
+
+    def start(self):
+        if xdisplay is None:
+            raise RuntimeError("python-xlib is required to follow the focused window")
+        self.display = xdisplay.Display(self.display_name)
+        self.root = self.display.screen().root
+        self.active_atom = self.display.intern_atom('_NET_ACTIVE_WINDOW')
+        self.root.change_attributes(event_mask=X.PropertyChangeMask)
+        self.follow()
+
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=1)
+            self.thread = None
+        if self.display:
+            self.display.close()
+            self.display = None
+
+    def _run(self):
+        fd = self.display.fileno()
+        while self.running:
+            if not self.display.pending_events():
+                select.select([fd], [], [], 0.2)
+            refocused = changed = False
+            while self.display.pending_events():
+                event = self.display.next_event()
+                if event.type == X.PropertyNotify and event.atom == self.active_atom:
+                    refocused = True
+                elif event.type in (X.ConfigureNotify, X.DestroyNotify, X.UnmapNotify):
+                    changed = True
+            if refocused:
+                self.follow()
+            elif changed:
+                self.update()
+
+    def follow(self):
+        """Switch to the window _NET_ACTIVE_WINDOW names now."""
+        prop = self.root.get_full_property(self.active_atom, X.AnyPropertyType)
+        xid = prop.value[0] if prop and len(prop.value) else 0
+        if self.window is not None and self.window.id != xid:
+            try:
+                self.window.change_attributes(event_mask=X.NoEventMask)
+            except XError:
+                pass
+        self.window = None
+        if xid:
+            window = self.display.create_resource_object('window', xid)
+            try:
+                window.change_attributes(event_mask=X.StructureNotifyMask)
+                self.window = window
+            except XError:
+                pass
+        self.update()
+
+    def update(self):
+        geometry = None
+        if self.window is not None:
+            try:
+                geometry = window_geometry(self.display, self.window)
+            except XError:
+                pass
+        with self.lock:
+            self.current = geometry
+
+    def geometry(self):
+        with self.lock:
+            return self.current
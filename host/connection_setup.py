@@ -0,0 +1,182 @@
+import asyncio
+import enum
+import logging
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from glib_loop import call_soon
+
+logger = logging.getLogger(__name__)
+
+
+class SignalWaiter:
+    """Awaitable for a GObject signal, emitted on the loop thread or another one.
+
+    Connect before triggering the change you are waiting for, so an emission
+    that happens before `wait()` is called is not lost.
+    """
+
+    def __init__(self, loop, obj, signal, check=None):
+        self.loop = loop
+        self.obj = obj
+        self.check = check
+        self.future = loop.create_future()
+        self.handler_id = obj.connect(signal, self._on_signal)
+
+    def _on_signal(self, *args):
+        if self.check is None or self.check(*args):
+            call_soon(self.loop, self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(True)
+
+    async def wait(self, timeout):
+        try:
+            return await asyncio.wait_for(asyncio.shield(self.future), timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.cancel()
+
+    def cancel(self):
+        if self.handler_id is not None:
+            self.obj.disconnect(self.handler_id)
+            self.handler_id = None
+
+
+async def promise_reply(loop, emit):
+    """Call `emit(promise)` with a new Gst.Promise and return its reply.
+
+    The reply is handed to `loop` instead of being waited for on the
+    GStreamer thread that answers the promise.
+    """
+    future = loop.create_future()
+
+    def on_reply(promise, *args):
+        call_soon(loop, _set_result, future, promise.get_reply())
+
+    emit(Gst.Promise.new_with_change_func(on_reply, None, None))
+    return await future
+
+
+def _set_result(future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+def state_changed_to(pipeline, state):
+    def check(bus, msg):
+        if msg.src != pipeline:
+            return False
+        old, new, pending = msg.parse_state_changed()
+        return new == state
+    return check
+
+
+class SetupState(enum.Enum):
+    IDLE = 'idle'
+    WAITING_FOR_SWITCH = 'waiting-for-switch'
+    SWITCHING_MODE = 'switching-mode'
+    RESTARTING_CAPTURE = 'restarting-capture'
+    STARTING_CAPTURE = 'starting-capture'
+    WAITING_FOR_CAPS = 'waiting-for-caps'
+    OFFERING = 'offering'
+    READY = 'ready'
+    FAILED = 'failed'
+
+
+class ConnectionSetup:
+    """Takes a connecting client from resolution switch to a sent offer.
+
+    Every step waits on the event that proves it finished (screen size change,
+    PLAYING state on the bus, negotiated payloader caps) instead of sleeping,
+    and it runs as its own task so signaling keeps flowing meanwhile.
+
+    `switch_mode(width, height)` is a coroutine returning True when the
+    capture framebuffer changed size; `attach()` creates the peer and its
+    offer, and may return an awaitable that completes once the offer is sent.
+    `acquire()`, if given, is a coroutine returning the capture to use for
+    the new size (a prewarmed one from a PipelineCache) instead of
+    restarting the current one in place. A paused capture is started
+    either way.
+
+    `capture()` returns the current capture; it is only called once any
+    mode switch is over, so a capture acquired meanwhile is the one used. `capture_ready` is a future shared by the setups
+    of viewers connecting together: the one with `switch_mode` resolves
+    it once it has settled on a capture, the others wait for that first.
+    """
+
+    def __init__(self, loop, capture, attach, switch_mode=None, timeout=5.0, acquire=None, capture_ready=None):
+        self.loop = loop
+        self.current_capture = capture
+        self.capture = None
+        self.attach = attach
+        self.switch_mode = switch_mode
+        self.acquire = acquire
+        self.capture_ready = capture_ready
+        self.timeout = timeout
+        self.state = SetupState.IDLE
+
+    def set_state(self, state):
+        logger.info(f"Connection setup: {self.state.value} -> {state.value}")
+        self.state = state
+
+    async def run(self, width, height):
+        try:
+            acquired = None
+            if self.switch_mode:
+                try:
+                    acquired = await self.switch(width, height)
+                finally:
+                    # Also on failure or cancellation, so nobody waits forever
+                    if self.capture_ready and not self.capture_ready.done():
+                        self.capture_ready.set_result(None)
+            elif self.capture_ready and not self.capture_ready.done():
+                self.set_state(SetupState.WAITING_FOR_SWITCH)
+                await asyncio.shield(self.capture_ready)
+            self.capture = acquired or self.current_capture()
+
+            if not self.capture.is_playing():
+                self.set_state(SetupState.STARTING_CAPTURE)
+                pipeline = self.capture.pipeline
+                playing = SignalWaiter(self.loop, pipeline.get_bus(), 'message::state-changed',
+                                       check=state_changed_to(pipeline, Gst.State.PLAYING))
+                self.capture.start()
+                if not await playing.wait(self.timeout):
+                    logger.warning("Capture did not reach PLAYING in time, continuing")
+
+            self.set_state(SetupState.WAITING_FOR_CAPS)
+            if self.capture.payload_caps() is None:
+                pad = self.capture.payloader.get_static_pad('src')
+                negotiated = SignalWaiter(self.loop, pad, 'notify::caps')
+                # Caps may have landed between the check and the connect
+                if self.capture.payload_caps() is None and not await negotiated.wait(self.timeout):
+                    logger.warning("Payloader caps not negotiated in time, offering anyway")
+                negotiated.cancel()
+
+            self.set_state(SetupState.OFFERING)
+            offered = self.attach()
+            if offered is not None:
+                await offered
+            self.set_state(SetupState.READY)
+        except asyncio.CancelledError:
+            logger.info(f"Connection setup cancelled while {self.state.value}")
+            raise
+        except Exception as e:
+            logger.error(f"Connection setup failed while {self.state.value}: {e}")
+            self.set_state(SetupState.FAILED)
+
+    async def switch(self, width, height):
+        """Switch the mode; returns the capture acquire() picked, if it ran."""
+        self.set_state(SetupState.SWITCHING_MODE)
+        if await self.switch_mode(width, height):
+            # ximagesrc fixes its caps when it starts, so a new framebuffer
+            # size needs another capture or this one restarted.
+            self.set_state(SetupState.RESTARTING_CAPTURE)
+            if self.acquire:
+                return await self.acquire()
+            await self.loop.run_in_executor(None, self.current_capture().stop)
+        return None
@@ -0,0 +1,223 @@
+import logging
+import select
+import struct
+import threading
+import time
+
+from gi.repository import GLib
+
+from cursor_protocol import (FLAG_LEFT, FLAG_MIDDLE, FLAG_RIGHT, TRACK_NONE, CursorShape, ShapeCache,
+                             pack_position)
+
+logger = logging.getLogger(__name__)
+
+try:
+    from Xlib import display as xdisplay
+    from Xlib.ext import xfixes
+except ImportError:
+    xdisplay = None
+    xfixes = None
+
+
+def locate(regions, x, y):
+    """Index of the region containing (x, y), else of the nearest one."""
+    def distance(region):
+        left, top, width, height = region
+        dx = max(left - x, 0, x - (left + width - 1))
+        dy = max(top - y, 0, y - (top + height - 1))
+        return dx * dx + dy * dy
+    return min(range(len(regions)), key=lambda i: distance(regions[i]))
+
+
+class CursorShapeTracker:
+    """Follows the X cursor image with XFixes cursor-change notifications.
+
+    Runs on its own thread and X connection, like damage.DamageTracker.
+    `current()` returns the latest CursorShape (or None before the first).
+    """
+
+    def __init__(self, display_name=None):
+        self.display_name = display_name
+        self.display = None
+        self.lock = threading.Lock()
+        self.shape = None
+        self.thread = None
+        self.running = False
+
+    @staticmethod
+    def available():
+        return xfixes is not None
+
+    def start(self):
+        if xfixes is None:
+            raise RuntimeError("python-xlib is required for cursor shapes")
+        self.display = xdisplay.Display(self.display_name)
+        if not self.display.has_extension('XFIXES'):
+            self.display.close()
+            raise RuntimeError("X server has no XFIXES extension")
+        self.display.xfixes_query_version()
+        root = self.display.screen().root
+        self.display.xfixes_select_cursor_input(root, xfixes.XFixesDisplayCursorNotifyMask)
+        self.update()
+
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=1)
+            self.thread = None
+        if self.display:
+            self.display.close()
+            self.display = None
+
+    def _run(self):
+        fd = self.display.fileno()
+        notify = self.display.extension_event.DisplayCursorNotify
+        while self.running:
+            try:
+                if not self.display.pending_events():
+                    select.select([fd], [], [], 0.2)
+                changed = False
+                while self.display.pending_events():
+                    event = self.display.next_event()
+                    if (event.type, getattr(event, 'sub_code', None)) == notify:
+                        changed = True
+                # A burst of changes only needs the final image
+                if changed:
+                    self.update()
+            except Exception:
+                if not self.running:
+                    break
+                # Keep following the cursor: the client would otherwise be
+                # stuck on a stale shape with none drawn into the video
+                logger.exception("Cursor shape tracking failed")
+                time.sleep(0.2)
+
+    def update(self):
+        root = self.display.screen().root
+        image = self.display.xfixes_get_cursor_image(root)
+        pixels = struct.pack(f'>{len(image.cursor_image)}I', *image.cursor_image)
+        shape = CursorShape(image.width, image.height, image.xhot, image.yhot, pixels)
+        with self.lock:
+            self.shape = shape
+
+    def current(self):
+        with self.lock:
+            return self.shape
+
+
+class CursorSender:
+    """Coalesces pointer motion and sends it at a fixed rate from the GLib loop.
+
+    `on_move`/`on_click` are called from the pynput listener thread and only
+    record the latest state; a GLib timeout sends at most one packet per tick
+    (by default one per video frame) and nothing while the pointer is still.
+    `sessions` returns the StreamSessions to send to and `regions` returns
+    the captured (x, y, width, height) in screen coordinates, one per capture
+    layer with a monitor each, else just one. Positions are normalized
+    against the region the pointer is on.
+
+    With a CursorShapeTracker, each shape change goes out on the same tick:
+    the full image the first time a session sees it, a hash reference after.
+    """
+
+    def __init__(self, sessions, regions, rate=30, shapes=None):
+        self.sessions = sessions
+        self.regions = regions
+        self.rate = rate
+        self.shapes = shapes
+        # session_id -> (ShapeCache, hash of the shape the client shows)
+        self.shape_state = {}
+        self.lock = threading.Lock()
+        self.position = None
+        self.buttons = 0
+        self.dirty = False
+        self.seq = 0
+        self.epoch = time.monotonic()
+        self.timeout_id = None
+        self.moves = 0
+        self.packets = 0
+
+    def start(self):
+        if self.timeout_id is None:
+            self.timeout_id = GLib.timeout_add(max(1, int(1000 / self.rate)), self.flush)
+
+    def stop(self):
+        if self.timeout_id is not None:
+            GLib.source_remove(self.timeout_id)
+            self.timeout_id = None
+
+    def on_move(self, x, y):
+        with self.lock:
+            self.position = (x, y)
+            self.dirty = True
+            self.moves += 1
+
+    def pointer(self):
+        """Latest pointer position in screen coordinates, None before the first move."""
+        with self.lock:
+            return self.position
+
+    def on_click(self, x, y, button, pressed):
+        flag = {'left': FLAG_LEFT, 'right': FLAG_RIGHT, 'middle': FLAG_MIDDLE}.get(getattr(button, 'name', None), 0)
+        with self.lock:
+            self.position = (x, y)
+            self.buttons = self.buttons | flag if pressed else self.buttons & ~flag
+            self.dirty = True
+
+    def flush(self):
+        if self.shapes:
+            self.send_shape()
+
+        with self.lock:
+            if not self.dirty:
+                return True
+            x, y = self.position
+            flags = self.buttons
+            self.dirty = False
+
+        regions = self.regions()
+        output = locate(regions, x, y)
+        left, top, width, height = regions[output]
+        timestamp = int((time.monotonic() - self.epoch) * 1000)
+        norm_x, norm_y = (x - left) / width, (y - top) / height
+        packets = {}
+        sent = False
+        for session in self.sessions():
+            if len(regions) == 1:
+                track = 0
+            else:
+                layers = session.layers
+                track = layers.index(output) if output in layers else TRACK_NONE
+            if track not in packets:
+                packets[track] = pack_position(self.seq, timestamp, norm_x, norm_y, flags, track)
+            sent = session.send_data(packets[track]) or sent
+        if sent:
+            self.seq += 1
+            self.packets += 1
+        return True
+
+    def send_shape(self):
+        shape = self.shapes.current()
+        if shape is None:
+            return
+        live = set()
+        for session in self.sessions():
+            live.add(session.session_id)
+            cache, shown = self.shape_state.get(session.session_id, (None, None))
+            if cache is None:
+                cache = ShapeCache()
+            if shown == shape.hash or not session.data_channel_open():
+                continue
+            cached = cache.use(shape.hash)
+            message = shape.ref_message() if cached else shape.image_message()
+            if session.send_data(message):
+                if not cached:
+                    cache.add(shape.hash)
+                self.shape_state[session.session_id] = (cache, shape.hash)
+        for session_id in list(self.shape_state):
+            if session_id not in live:
+                del self.shape_state[session_id]
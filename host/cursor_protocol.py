@@ -0,0 +1,85 @@
+"""Wire format of the 'cursor' data channel, free of GStreamer and Xlib."""
+import collections
+import hashlib
+import struct
+import zlib
+
+# All big endian. Every message starts with (version: u8, type: u8); the
+# client still accepts the legacy 8-byte '>ff' packets for older hosts.
+PROTOCOL_VERSION = 1
+MSG_POSITION = 1
+MSG_SHAPE_IMAGE = 2
+MSG_SHAPE_REF = 3
+
+# version, type, flags, sequence (u16, wraps), timestamp in ms (u32, wraps),
+# x and y quantized to 0..65535 across the captured area, and the index of
+# the session's video track the pointer is on (older clients stop reading
+# before it)
+POSITION = struct.Struct('>BBBHIHHB')
+TRACK_NONE = 0xFF # The pointer is on a monitor this session does not receive
+
+# version, type, 8-byte shape hash, width, height, hotspot x, hotspot y,
+# followed by the zlib-compressed ARGB8888 pixels (u32 big endian each)
+SHAPE_IMAGE = struct.Struct('>BB8sHHHH')
+# version, type, 8-byte shape hash of an image sent earlier
+SHAPE_REF = struct.Struct('>BB8s')
+
+# Shapes each side remembers; both LRUs see the same sequence of uses, so
+# they evict the same entries and a reference is always resolvable.
+SHAPE_CACHE_SIZE = 64
+
+FLAG_LEFT = 0x01
+FLAG_RIGHT = 0x02
+FLAG_MIDDLE = 0x04
+
+QUANT_MAX = 0xFFFF
+
+
+def quantize(norm):
+    return max(0, min(QUANT_MAX, int(round(norm * QUANT_MAX))))
+
+
+def pack_position(seq, timestamp_ms, norm_x, norm_y, flags=0, track=0):
+    return POSITION.pack(PROTOCOL_VERSION, MSG_POSITION, flags, seq & 0xFFFF,
+                         timestamp_ms & 0xFFFFFFFF, quantize(norm_x), quantize(norm_y), track)
+
+
+class CursorShape:
+    def __init__(self, width, height, xhot, yhot, pixels):
+        self.width = width
+        self.height = height
+        self.xhot = xhot
+        self.yhot = yhot
+        self.pixels = pixels # ARGB8888, u32 big endian per pixel
+        header = struct.pack('>HHHH', width, height, xhot, yhot)
+        # Content address: the same arrow is the same hash across sessions
+        self.hash = hashlib.blake2b(header + pixels, digest_size=8).digest()
+
+    def image_message(self):
+        return SHAPE_IMAGE.pack(PROTOCOL_VERSION, MSG_SHAPE_IMAGE, self.hash, self.width, self.height,
+                                self.xhot, self.yhot) + zlib.compress(self.pixels)
+
+    def ref_message(self):
+        return SHAPE_REF.pack(PROTOCOL_VERSION, MSG_SHAPE_REF, self.hash)
+
+
+class ShapeCache:
+    """LRU of shape hashes a client is known to hold."""
+
+    def __init__(self, size=SHAPE_CACHE_SIZE):
+        self.size = size
+        self.entries = collections.OrderedDict()
+
+    def use(self, key):
+        """Mark `key` as most recently used; returns whether it was cached."""
+        known = key in self.entries
+        if known:
+            self.entries.move_to_end(key)
+        return known
+
+    def add(self, key):
+        """Record `key` once the client has been sent its image."""
+        self.entries[key] = True
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
@@ -0,0 +1,131 @@
+import logging
+import select
+import threading
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+logger = logging.getLogger(__name__)
+
+try:
+    from Xlib import display as xdisplay
+    from Xlib.ext import damage as xdamage
+except ImportError:
+    xdisplay = None
+    xdamage = None
+
+
+class DamageTracker:
+    """Collects XDamage bounding boxes for the root window on its own thread.
+
+    Uses a private X connection, since python-xlib displays are not thread
+    safe. `take()` returns the union of everything damaged since the last
+    call, or None if the screen did not change.
+    """
+
+    def __init__(self, display_name=None):
+        self.display_name = display_name
+        self.display = None
+        self.damage = None
+        self.lock = threading.Lock()
+        self.pending = None
+        self.events = 0
+        self.thread = None
+        self.running = False
+
+    @staticmethod
+    def available():
+        return xdamage is not None
+
+    def start(self):
+        if xdamage is None:
+            raise RuntimeError("python-xlib is required for damage tracking")
+        self.display = xdisplay.Display(self.display_name)
+        if not self.display.has_extension('DAMAGE'):
+            self.display.close()
+            raise RuntimeError("X server has no DAMAGE extension")
+        self.display.damage_query_version()
+        root = self.display.screen().root
+        self.damage = root.damage_create(xdamage.DamageReportBoundingBox)
+        self.display.flush()
+
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join(timeout=1)
+            self.thread = None
+        if self.display:
+            self.display.close()
+            self.display = None
+
+    def _run(self):
+        fd = self.display.fileno()
+        while self.running:
+            # Wake up regularly so stop() does not hang on a quiet screen
+            if not self.display.pending_events():
+                select.select([fd], [], [], 0.2)
+            while self.display.pending_events():
+                event = self.display.next_event()
+                if event.type == self.display.extension_event.DamageNotify:
+                    self._add(event.area)
+            # Re-arm so the next change produces a new notification
+            self.display.damage_subtract(self.damage, 0, 0)
+            self.display.flush()
+
+    def _add(self, area):
+        x1, y1 = area.x, area.y
+        x2, y2 = x1 + area.width, y1 + area.height
+        with self.lock:
+            self.events += 1
+            if self.pending:
+                px1, py1, px2, py2 = self.pending
+                x1, y1, x2, y2 = min(x1, px1), min(y1, py1), max(x2, px2), max(y2, py2)
+            self.pending = (x1, y1, x2, y2)
+
+    def take(self):
+        with self.lock:
+            rect, self.pending = self.pending, None
+            return rect
+
+
+class DamageGate:
+    """Buffer probe that only lets frames through while the screen changes.
+
+    After any damage, frames pass at the full capture rate for `hold`
+    seconds (so the final state of an animation is captured too); while the
+    screen is idle one keepalive frame is sent every `keepalive` seconds.
+    """
+
+    def __init__(self, tracker, keepalive=1.0, hold=0.2):
+        self.tracker = tracker
+        self.keepalive = keepalive
+        self.hold = hold
+        self.active_until = 0.0
+        self.last_passed = 0.0
+        self.passed = 0
+        self.dropped = 0
+        self.last_damage = None
+
+    def wake(self):
+        # Let the next frames through, e.g. when a new peer attaches
+        self.active_until = time.monotonic() + self.hold
+
+    def probe(self, pad, info, user_data):
+        now = time.monotonic()
+        rect = self.tracker.take()
+        if rect is not None:
+            self.last_damage = rect
+            self.active_until = now + self.hold
+
+        if now < self.active_until or now - self.last_passed >= self.keepalive:
+            self.last_passed = now
+            self.passed += 1
+            return Gst.PadProbeReturn.OK
+        self.dropped += 1
+        return Gst.PadProbeReturn.DROP
@@ -1,10 +1,71 @@
 import subprocess
 import re
 import logging
+import select
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
-class DisplayManager:
+try:
+    from Xlib import display as xdisplay
+    from Xlib.ext import randr
+except ImportError:
+    xdisplay = None
+    randr = None
+
+
+class Output:
+    """A connected RandR output and where it sits on the X screen."""
+
+    def __init__(self, name, x, y, width, height, primary=False):
+        self.name = name
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.primary = primary
+
+    @property
+    def geometry(self):
+        return self.x, self.y, self.width, self.height
+
+    def __repr__(self):
+        return f"Output({self.name} {self.width}x{self.height}+{self.x}+{self.y}{' primary' if self.primary else ''})"
+
+
+def list_outputs(display_name=None):
+    """Connected outputs that are showing part of the screen, primary first.
+
+    Asks the X server through the RandR extension instead of parsing xrandr.
+    """
+    if randr is None:
+        raise RuntimeError("python-xlib is required to enumerate outputs")
+    disp = xdisplay.Display(display_name)
+    try:
+        if not disp.has_extension('RANDR'):
+            raise RuntimeError("X server has no RANDR extension")
+        root = disp.screen().root
+        resources = root.xrandr_get_screen_resources()
+        primary = root.xrandr_get_output_primary().output
+        outputs = []
+        for output in resources.outputs:
+            info = disp.xrandr_get_output_info(output, resources.config_timestamp)
+            if info.connection != randr.Connected or not info.crtc:
+                continue
+            crtc = disp.xrandr_get_crtc_info(info.crtc, resources.config_timestamp)
+            outputs.append(Output(info.name, crtc.x, crtc.y, crtc.width, crtc.height, primary=output == primary))
+    finally:
+        disp.close()
+    outputs.sort(key=lambda o: (not o.primary, o.x, o.y))
+    return outputs
+
+
+class XrandrBackend:
+    """Drives the display by running the xrandr tool."""
+
+    name = 'xrandr'
+
     def __init__(self):
         self.original_mode = None
         self.output_name = None
@@ -69,3 +130,262 @@ class DisplayManager:
                      
             except Exception as e:
                 logger.error(f"Failed to restore resolution: {e}")
+
+
+def fixed(value):
+    # RandR transforms are 16.16 fixed point
+    return int(round(value * 65536)) & 0xFFFFFFFF
+
+
+def scale_transform(sx, sy):
+    return {'matrix11': fixed(sx), 'matrix12': 0, 'matrix13': 0,
+            'matrix21': 0, 'matrix22': fixed(sy), 'matrix23': 0,
+            'matrix31': 0, 'matrix32': 0, 'matrix33': fixed(1)}
+
+
+class RandrBackend:
+    """Drives the display through the RandR extension on a private X connection.
+
+    Does what `xrandr --scale-from` / `--scale 1x1 --mode` do without forking,
+    and waits for RRScreenChangeNotify so a successful
+    `create_and_set_mode()` means the new framebuffer size is in effect.
+    """
+
+    name = 'randr'
+
+    def __init__(self, display_name=None, timeout=2.0):
+        if randr is None:
+            raise RuntimeError("python-xlib is required for the RandR backend")
+        self.display = xdisplay.Display(display_name)
+        if not self.display.has_extension('RANDR'):
+            self.display.close()
+            raise RuntimeError("X server has no RANDR extension")
+        self.root = self.display.screen().root
+        self.root.xrandr_select_input(randr.RRScreenChangeNotifyMask)
+        self.display.flush()
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.output_name = None
+        self.original = None # (crtc, x, y, mode, rotation, outputs, screen size, mm size)
+        self.error = None # The last RandR request that failed, for DisplayManager to fall back
+
+    def resources(self):
+        return self.root.xrandr_get_screen_resources()
+
+    def find_output(self, resources):
+        """(name, output info) of the primary output, else the first connected one."""
+        primary = self.root.xrandr_get_output_primary().output
+        candidates = []
+        for output in resources.outputs:
+            info = self.display.xrandr_get_output_info(output, resources.config_timestamp)
+            if info.connection == randr.Connected and info.crtc:
+                candidates.append((output != primary, info.name, info))
+        if not candidates:
+            return None, None
+        candidates.sort(key=lambda c: c[0])
+        return candidates[0][1], candidates[0][2]
+
+    def bounding_size(self, resources, crtc, width, height):
+        """Screen size that holds every active CRTC once `crtc` shows width x height.
+
+        Like xrandr, which sizes the framebuffer to fit all heads rather
+        than just the one being changed.
+        """
+        right, bottom = 0, 0
+        for other in resources.crtcs:
+            info = self.display.xrandr_get_crtc_info(other, resources.config_timestamp)
+            if other == crtc:
+                right, bottom = max(right, info.x + width), max(bottom, info.y + height)
+            elif info.mode:
+                right, bottom = max(right, info.x + info.width), max(bottom, info.y + info.height)
+        return right, bottom
+
+    def get_connected_output(self):
+        with self.lock:
+            resources = self.resources()
+            name, info = self.find_output(resources)
+            if info is None:
+                return None, None
+            crtc = self.display.xrandr_get_crtc_info(info.crtc, resources.config_timestamp)
+            return name, f"{crtc.width}x{crtc.height}"
+
+    def set_transform(self, crtc, sx, sy):
+        # python-xlib's set_crtc_transform wrapper never sends the matrix
+        randr.SetCrtcTransform(display=self.display.display,
+                               opcode=self.display.display.get_extension_major(randr.extname),
+                               crtc=crtc, transform=scale_transform(sx, sy),
+                               filter_name="bilinear" if (sx, sy) != (1, 1) else "nearest",
+                               filter_params=[])
+
+    def millimeters(self, width, height):
+        # Keep the DPI the X server started with
+        screen = self.display.screen()
+        return (max(1, round(screen.width_in_mms * width / screen.width_in_pixels)),
+                max(1, round(screen.height_in_mms * height / screen.height_in_pixels)))
+
+    def apply(self, crtc, x, y, mode, rotation, outputs, width, height, mm_width, mm_height):
+        resources = self.resources()
+        # Off first, so the CRTC never has to fit both the old and new screen
+        self.display.xrandr_set_crtc_config(crtc, resources.config_timestamp, 0, 0, 0,
+                                            randr.Rotate_0, [])
+        self.root.xrandr_set_screen_size(width, height, mm_width, mm_height)
+        resources = self.resources()
+        self.display.xrandr_set_crtc_config(crtc, resources.config_timestamp, x, y, mode, rotation, outputs)
+
+    def wait_for_size(self, width, height):
+        """Block until RRScreenChangeNotify reports width x height."""
+        fd = self.display.fileno()
+        deadline = time.monotonic() + self.timeout
+        # python-xlib only registers the event for RandR 1.5 servers
+        notify = getattr(self.display.extension_event, 'ScreenChangeNotify', None)
+        while True:
+            if notify is None:
+                geometry = self.root.get_geometry()
+                if (geometry.width, geometry.height) == (width, height):
+                    return True
+            while self.display.pending_events():
+                event = self.display.next_event()
+                if (event.type == notify and
+                        (event.width_in_pixels, event.height_in_pixels) == (width, height)):
+                    return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            select.select([fd], [], [], min(remaining, 0.05) if notify is None else remaining)
+
+    def create_and_set_mode(self, width, height, refresh_rate=60):
+        with self.lock:
+            try:
+                resources = self.resources()
+                name, info = self.find_output(resources)
+                if info is None:
+                    logger.error("No connected output found")
+                    return False
+                self.error = None
+                crtc = self.display.xrandr_get_crtc_info(info.crtc, resources.config_timestamp)
+                mode = next(m for m in resources.modes if m.id == crtc.mode)
+                # display.screen() is from connection setup; ask for the current size
+                current = self.root.get_geometry()
+                if self.original is None:
+                    self.output_name = name
+                    self.original = (info.crtc, crtc.x, crtc.y, crtc.mode, crtc.rotation, list(crtc.outputs),
+                                     current.width, current.height,
+                                     *self.millimeters(current.width, current.height))
+                    logger.info(f"Saved original mode: {mode.width}x{mode.height} for {name}")
+                if (crtc.width, crtc.height) == (width, height):
+                    return False
+
+                # Same as xrandr --scale-from: the monitor keeps its mode and
+                # place, shows width x height of the framebuffer scaled onto
+                # it, and the framebuffer grows or shrinks to fit every head
+                screen_width, screen_height = self.bounding_size(resources, info.crtc, width, height)
+                logger.info(f"Setting virtual resolution {width}x{height} on {name} through RandR")
+                self.set_transform(info.crtc, width / mode.width, height / mode.height)
+                self.apply(info.crtc, crtc.x, crtc.y, crtc.mode, crtc.rotation, list(crtc.outputs),
+                           screen_width, screen_height, *self.millimeters(screen_width, screen_height))
+                self.display.sync()
+            except Exception as e:
+                logger.error(f"Failed to set resolution: {e}")
+                self.error = e
+                return False
+            if not self.wait_for_size(screen_width, screen_height):
+                logger.warning("No RRScreenChangeNotify for the new size")
+            return True
+
+    def set_screen_size(self, width, height):
+        """Resize the framebuffer itself, without scaling.
+
+        For virtual displays (Xvfb, xf86-video-dummy) that have no monitor
+        to keep at its native mode. CRTCs that would no longer fit are turned
+        off first. Returns True once the new size is in effect.
+        """
+        with self.lock:
+            self.error = None
+            try:
+                current = self.root.get_geometry()
+                if (current.width, current.height) == (width, height):
+                    return False
+                limits = self.root.xrandr_get_screen_size_range()
+                if not (limits.min_width <= width <= limits.max_width and
+                        limits.min_height <= height <= limits.max_height):
+                    logger.error(f"{width}x{height} is outside the screen limits "
+                                 f"{limits.min_width}x{limits.min_height}-{limits.max_width}x{limits.max_height}")
+                    return False
+                resources = self.resources()
+                for crtc in resources.crtcs:
+                    info = self.display.xrandr_get_crtc_info(crtc, resources.config_timestamp)
+                    if info.mode and (info.x + info.width > width or info.y + info.height > height):
+                        self.display.xrandr_set_crtc_config(crtc, resources.config_timestamp, 0, 0, 0,
+                                                            randr.Rotate_0, [])
+                logger.info(f"Resizing screen to {width}x{height} through RandR")
+                self.root.xrandr_set_screen_size(width, height, *self.millimeters(width, height))
+                self.display.sync()
+            except Exception as e:
+                logger.error(f"Failed to resize screen: {e}")
+                self.error = e
+                return False
+            if not self.wait_for_size(width, height):
+                logger.warning("No RRScreenChangeNotify for the new size")
+            return True
+
+    def restore(self):
+        with self.lock:
+            if self.original is None:
+                return
+            crtc, x, y, mode, rotation, outputs, width, height, mm_width, mm_height = self.original
+            try:
+                logger.info(f"Restoring display on {self.output_name}")
+                self.set_transform(crtc, 1, 1)
+                self.apply(crtc, x, y, mode, rotation, outputs, width, height, mm_width, mm_height)
+                self.display.sync()
+                self.wait_for_size(width, height)
+            except Exception as e:
+                logger.error(f"Failed to restore resolution: {e}")
+            self.original = None
+
+    def close(self):
+        self.display.close()
+
+
+BACKENDS = ('auto', 'randr', 'xrandr')
+
+
+class DisplayManager:
+    """Resizes the X framebuffer to the client's resolution and back.
+
+    Uses the native RandR backend when python-xlib and the RANDR extension
+    are available ('auto'), else the xrandr subprocess one. With 'auto', a
+    RandR request the server rejects also switches to xrandr for good.
+    """
+
+    def __init__(self, backend='auto'):
+        self.fallback = backend == 'auto'
+        self.backend = None
+        if backend in ('auto', 'randr'):
+            try:
+                self.backend = RandrBackend()
+            except Exception as e:
+                if backend == 'randr':
+                    raise
+                logger.info(f"RandR backend unavailable ({e}), using xrandr")
+        if self.backend is None:
+            self.backend = XrandrBackend()
+        logger.info(f"Display backend: {self.backend.name}")
+
+    def get_connected_output(self):
+        return self.backend.get_connected_output()
+
+    def create_and_set_mode(self, width, height, refresh_rate=60):
+        switched = self.backend.create_and_set_mode(width, height, refresh_rate)
+        error = getattr(self.backend, 'error', None)
+        if not switched and error is not None and self.fallback:
+            logger.warning(f"RandR backend failed ({error}), using xrandr from now on")
+            # Put back what the failed request may have half applied
+            self.backend.restore()
+            self.backend.close()
+            self.backend = XrandrBackend()
+            switched = self.backend.create_and_set_mode(width, height, refresh_rate)
+        return switched
+
+    def restore(self):
+        self.backend.restore()
@@ -0,0 +1,145 @@
+import logging
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from pipeline import PipelineBuildError, make_element
+from stream_config import ENCODER_NAMES
+
+logger = logging.getLogger(__name__)
+
+
+class EncoderSpec:
+    """How to build and drive one GStreamer video encoder.
+
+    Bitrates are given in kbps throughout the host; `bitrate_scale` converts
+    to the unit the element's own property expects.
+    """
+
+    def __init__(self, name, factory, codec, payloader, properties=None,
+                 bitrate_property='bitrate', bitrate_scale=1, keyframe_property=None,
+                 gpu_convert=(), gpu_scale=False, hardware=False, roi=None):
+        self.name = name
+        self.factory = factory
+        self.codec = codec
+        self.payloader = payloader
+        self.properties = properties or {}
+        self.bitrate_property = bitrate_property
+        self.bitrate_scale = bitrate_scale
+        self.keyframe_property = keyframe_property
+        # Elements that upload/convert raw frames on the GPU ahead of the encoder
+        self.gpu_convert = tuple(gpu_convert)
+        self.gpu_scale = gpu_scale # gpu_convert can also scale to downstream caps
+        self.hardware = hardware
+        # (parameter structure, field) carrying the QP delta of a
+        # GstVideoRegionOfInterestMeta; None if the encoder ignores ROI
+        self.roi = roi
+
+    def __repr__(self):
+        return f"EncoderSpec({self.name})"
+
+    def is_installed(self):
+        return Gst.ElementFactory.find(self.factory) is not None
+
+    def make(self, name=None):
+        encoder = make_element(self.factory, name or f"{self.factory}0")
+        for key, value in self.properties.items():
+            encoder.set_property(key, value)
+        return encoder
+
+    def set_bitrate(self, encoder, kbps):
+        encoder.set_property(self.bitrate_property, int(kbps * self.bitrate_scale))
+
+    def set_keyframe_interval(self, encoder, frames):
+        if self.keyframe_property:
+            encoder.set_property(self.keyframe_property, frames)
+
+    def make_payloader(self, name=None):
+        payloader = make_element(self.payloader, name or f"{self.payloader}0")
+        if self.codec == 'h264':
+            payloader.set_property("config-interval", -1) # Send SPS/PPS with every keyframe
+        return payloader
+
+    def rtp_caps(self):
+        """Caps make_payloader() produces, for offering before any buffer flowed."""
+        caps = f"application/x-rtp,media=video,encoding-name={self.codec.upper()},clock-rate=90000,payload=96"
+        if self.codec == 'h264':
+            caps += ",packetization-mode=(string)1"
+        return Gst.Caps.from_string(caps)
+
+
+# Fastest first: hardware encoders, then software tuned for latency
+ENCODERS = [
+    EncoderSpec('vaapi', 'vaapih264enc', 'h264', 'rtph264pay',
+                properties={'rate-control': 'cbr'}, # The default, cqp, ignores bitrate
+                keyframe_property='keyframe-period', gpu_convert=('vaapipostproc',), gpu_scale=True, hardware=True,
+                roi=('roi/vaapi', 'delta-qp')),
+    EncoderSpec('nvenc', 'nvh264enc', 'h264', 'rtph264pay',
+                properties={'preset': 'low-latency-hq', 'zerolatency': True},
+                keyframe_property='gop-size', gpu_convert=('cudaupload', 'cudaconvert'), hardware=True),
+    EncoderSpec('x264', 'x264enc', 'h264', 'rtph264pay',
+                properties={'tune': 'zerolatency', 'speed-preset': 'ultrafast'},
+                keyframe_property='key-int-max'),
+    EncoderSpec('openh264', 'openh264enc', 'h264', 'rtph264pay',
+                bitrate_scale=1000, keyframe_property='gop-size'),
+    EncoderSpec('vp8', 'vp8enc', 'vp8', 'rtpvp8pay',
+                properties={'deadline': 1, 'cpu-used': 8, 'end-usage': 'cbr'},
+                bitrate_property='target-bitrate', bitrate_scale=1000,
+                keyframe_property='keyframe-max-dist'),
+]
+
+ENCODERS_BY_NAME = {spec.name: spec for spec in ENCODERS}
+if tuple(ENCODERS_BY_NAME) != ENCODER_NAMES:
+    raise RuntimeError("stream_config.ENCODER_NAMES does not list the encoders in ENCODERS")
+
+
+def encoder_works(spec, timeout=5):
+    """Encode a couple of test frames to prove the encoder actually runs.
+
+    An installed VA-API or NVENC plugin still fails at runtime without a
+    usable GPU/driver, so existence of the factory is not enough.
+    """
+    if not spec.is_installed():
+        return False
+    pipeline = Gst.Pipeline.new(f"probe-{spec.name}")
+    try:
+        elements = [make_element("videotestsrc", None, num_buffers=2),
+                    make_element("videoconvert", None),
+                    spec.make(f"probe-{spec.factory}"),
+                    make_element("fakesink", None)]
+        for elem in elements:
+            pipeline.add(elem)
+        for upstream, downstream in zip(elements, elements[1:]):
+            if not upstream.link(downstream):
+                return False
+    except PipelineBuildError:
+        return False
+
+    try:
+        pipeline.set_state(Gst.State.PLAYING)
+        msg = pipeline.get_bus().timed_pop_filtered(
+            timeout * Gst.SECOND, Gst.MessageType.EOS | Gst.MessageType.ERROR)
+        if msg is None or msg.type == Gst.MessageType.ERROR:
+            if msg:
+                err, debug = msg.parse_error()
+                logger.info(f"Encoder {spec.name} unusable: {err}")
+            return False
+        return True
+    finally:
+        pipeline.set_state(Gst.State.NULL)
+
+
+def select_encoder(name='auto'):
+    """Return the EncoderSpec to use, probing candidates in order for 'auto'."""
+    if name != 'auto':
+        if name not in ENCODERS_BY_NAME:
+            raise PipelineBuildError(f"Unknown encoder '{name}', choose from: {', '.join(ENCODERS_BY_NAME)}")
+        return ENCODERS_BY_NAME[name]
+
+    for spec in ENCODERS:
+        if encoder_works(spec):
+            logger.info(f"Selected encoder: {spec.name} ({spec.factory})")
+            return spec
+        logger.info(f"Encoder {spec.name} ({spec.factory}) not usable, trying next")
+    raise PipelineBuildError("No working video encoder found")
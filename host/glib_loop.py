@@ -0,0 +1,66 @@
+"""GLib and asyncio on one event loop.
+
+PyGObject 3.50 and later ship an asyncio event loop that runs the GLib
+main context (gi.events). With it, bus watches, GLib timeouts and idle
+callbacks, Gdk events and the signaling websocket are all dispatched on
+one thread, so none of them has to hop threads to reach the others and an
+idle host sleeps in a single poll. Older PyGObject falls back to a GLib
+main loop in a thread of its own.
+"""
+import asyncio
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+def use_glib_loop():
+    """Have asyncio.run() create GLib-backed loops; False if PyGObject is too old."""
+    try:
+        from gi.events import GLibEventLoopPolicy
+    except ImportError:
+        return False
+    asyncio.set_event_loop_policy(GLibEventLoopPolicy())
+    return True
+
+
+def integrated(loop):
+    """True if `loop` also dispatches the GLib main context."""
+    try:
+        from gi.events import GLibEventLoop
+    except ImportError:
+        return False
+    return isinstance(loop, GLibEventLoop)
+
+
+def call_soon(loop, callback, *args):
+    """Run `callback` on `loop`: right away from the loop thread, else through call_soon_threadsafe."""
+    if loop_thread(loop):
+        callback(*args)
+    else:
+        loop.call_soon_threadsafe(callback, *args)
+
+
+def loop_thread(loop):
+    """True when called from the thread running `loop`."""
+    try:
+        return asyncio.get_running_loop() is loop
+    except RuntimeError:
+        return False
+
+
+class GLibThread:
+    """The GLib main loop in a daemon thread, for loops that do not run it."""
+
+    def __init__(self):
+        from gi.repository import GLib
+        self.main_loop = GLib.MainLoop()
+        self.thread = None
+
+    def start(self):
+        logger.info("asyncio loop does not run GLib, starting a GLib main loop thread")
+        self.thread = threading.Thread(target=self.main_loop.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.main_loop.quit()
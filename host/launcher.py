@@ -0,0 +1,57 @@
+"""Runs the signaling server and the streamer in one process and event loop.
+
+    python launcher.py [--port 8080] [streamer options]
+
+Only the argument parser is loaded up front. The signaling server starts
+first, so a headset can register while GStreamer and the capture stack are
+still being imported, and the streamer then connects to it over loopback.
+Running the two as separate processes (signaling_server.py, streamer.py)
+still works.
+"""
+import argparse
+import asyncio
+import importlib
+import sys
+
+from glib_loop import use_glib_loop
+from options import add_signaling_arguments, add_streamer_arguments, signaling_options, streamer_options
+
+
+async def serve(args, options):
+    import signaling_server
+    runner = await signaling_server.start_server(args.port, **signaling_options(args))
+    try:
+        if args.signaling_only:
+            await asyncio.Event().wait()
+            return 0
+
+        # Loading GStreamer takes a while; the server keeps answering meanwhile
+        streamer = await asyncio.get_running_loop().run_in_executor(None, importlib.import_module, 'streamer')
+        host = streamer.WebRTCStreamer(f'http://127.0.0.1:{args.port}/ws', **options)
+        try:
+            return await host.run()
+        finally:
+            await host.shutdown()
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="WebRTC host: signaling server and streamer in one process")
+    parser.add_argument('--port', type=int, default=8080, help="Signaling port to listen on")
+    parser.add_argument('--signaling-only', action='store_true', help="Only run the signaling server")
+    add_signaling_arguments(parser)
+    add_streamer_arguments(parser, signaling=False)
+    args = parser.parse_args()
+    options = streamer_options(parser, args)
+
+    if not args.signaling_only:
+        # Signaling, GStreamer and Gdk then share one thread and loop
+        use_glib_loop()
+    try:
+        sys.exit(asyncio.run(serve(args, options)))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
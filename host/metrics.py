@@ -0,0 +1,225 @@
+import asyncio
+import collections
+import json
+import logging
+import threading
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class LatencySummary:
+    """Sliding-window latency quantiles plus running sum/count.
+
+    Exported as a Prometheus summary, so the quantiles describe the last
+    `window` samples while _sum/_count cover the whole run.
+    """
+
+    def __init__(self, window=1000):
+        self.samples = collections.deque(maxlen=window)
+        self.total = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self.lock:
+            self.samples.append(seconds)
+            self.total += seconds
+            self.count += 1
+
+    def snapshot(self):
+        with self.lock:
+            ordered = sorted(self.samples)
+            total, count = self.total, self.count
+        quantiles = {}
+        for q in QUANTILES:
+            quantiles[q] = ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else None
+        return quantiles, total, count
+
+
+class LatencyTracer:
+    """Stamps each frame as it passes the capture, convert, encode and payload stages.
+
+    Buffers are matched across stages by PTS, which every element on the path
+    preserves. `capture` is how old the frame already was when it left the
+    source (running time now minus its capture timestamp).
+    """
+
+    STAGES = (
+        ('capture', "Frame age when leaving the capture source"),
+        ('convert', "Capture source to end of colour conversion"),
+        ('encode', "End of conversion to encoded frame"),
+        ('payload', "Encoded frame to first RTP packet"),
+        ('total', "Capture source to first RTP packet"),
+    )
+
+    def __init__(self, max_pending=120):
+        self.summaries = {name: LatencySummary() for name, _ in self.STAGES}
+        self.pending = collections.OrderedDict()
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        self.frames = 0
+        self.rtp_bytes = 0
+        self.pipeline = None
+
+    def attach(self, capture):
+        self.use(capture)
+        self._probe(capture.source, self.on_captured)
+        self._probe(capture.converted, self.on_converted)
+        self._probe(capture.encoder, self.on_encoded)
+        # With simulcast peers payload for themselves, so this is the encoded frame
+        self._probe(capture.output, self.on_payloaded)
+
+    def use(self, capture):
+        # Capture timestamps are against the running pipeline's clock; with
+        # standby pipelines that is whichever one is streaming
+        self.pipeline = capture.pipeline
+
+    def _probe(self, element, callback):
+        pad = element.get_static_pad('src')
+        pad.add_probe(Gst.PadProbeType.BUFFER | Gst.PadProbeType.BUFFER_LIST, self._wrap(callback), None)
+
+    @staticmethod
+    def _wrap(callback):
+        def probe(pad, info, user_data):
+            buffer = info.get_buffer()
+            if buffer is None:
+                buffer_list = info.get_buffer_list()
+                if buffer_list is None or buffer_list.length() == 0:
+                    return Gst.PadProbeReturn.OK
+                size = sum(buffer_list.get(i).get_size() for i in range(buffer_list.length()))
+                buffer = buffer_list.get(0)
+            else:
+                size = buffer.get_size()
+            callback(buffer, size, time.perf_counter())
+            return Gst.PadProbeReturn.OK
+        return probe
+
+    def on_captured(self, buffer, size, now):
+        pts = buffer.pts
+        if pts == Gst.CLOCK_TIME_NONE:
+            return
+        clock = self.pipeline.get_clock()
+        if clock is not None:
+            running_time = clock.get_time() - self.pipeline.get_base_time()
+            if running_time >= pts:
+                self.summaries['capture'].observe((running_time - pts) / Gst.SECOND)
+        with self.lock:
+            self.pending[pts] = [now, None, None]
+            while len(self.pending) > self.max_pending:
+                self.pending.popitem(last=False)
+
+    def _stamp(self, pts, index, now):
+        with self.lock:
+            stamps = self.pending.get(pts)
+            if stamps is None or stamps[index] is not None:
+                return None
+            stamps[index] = now
+            return stamps
+
+    def on_converted(self, buffer, size, now):
+        stamps = self._stamp(buffer.pts, 1, now)
+        if stamps:
+            self.summaries['convert'].observe(now - stamps[0])
+
+    def on_encoded(self, buffer, size, now):
+        stamps = self._stamp(buffer.pts, 2, now)
+        if stamps and stamps[1] is not None:
+            self.summaries['encode'].observe(now - stamps[1])
+
+    def on_payloaded(self, buffer, size, now):
+        with self.lock:
+            self.rtp_bytes += size
+            # Only the first packet of each frame counts
+            stamps = self.pending.pop(buffer.pts, None)
+        if stamps is None:
+            return
+        self.frames += 1
+        if stamps[2] is not None:
+            self.summaries['payload'].observe(now - stamps[2])
+        self.summaries['total'].observe(now - stamps[0])
+
+    def snapshot(self):
+        stages = {}
+        for name, _ in self.STAGES:
+            quantiles, total, count = self.summaries[name].snapshot()
+            stages[name] = {
+                'p50_ms': _ms(quantiles[0.5]),
+                'p95_ms': _ms(quantiles[0.95]),
+                'p99_ms': _ms(quantiles[0.99]),
+                'count': count,
+            }
+        return {'frames': self.frames, 'rtp_bytes': self.rtp_bytes, 'stages': stages}
+
+    def prometheus(self):
+        lines = []
+        for name, help_text in self.STAGES:
+            metric = f"lrdxr_{name}_latency_seconds"
+            quantiles, total, count = self.summaries[name].snapshot()
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} summary")
+            for q, value in quantiles.items():
+                lines.append(f'{metric}{{quantile="{q}"}} {"NaN" if value is None else f"{value:.6f}"}')
+            lines.append(f"{metric}_sum {total:.6f}")
+            lines.append(f"{metric}_count {count}")
+        lines.append("# HELP lrdxr_frames_total Frames that reached the RTP payloader")
+        lines.append("# TYPE lrdxr_frames_total counter")
+        lines.append(f"lrdxr_frames_total {self.frames}")
+        lines.append("# HELP lrdxr_rtp_bytes_total RTP bytes produced by the payloader")
+        lines.append("# TYPE lrdxr_rtp_bytes_total counter")
+        lines.append(f"lrdxr_rtp_bytes_total {self.rtp_bytes}")
+        return "\n".join(lines) + "\n"
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+class MetricsExporter:
+    """Serves /metrics (Prometheus text format) and writes a JSON-lines log."""
+
+    def __init__(self, tracer, port=None, host='127.0.0.1', log_path=None, log_interval=5.0):
+        self.tracer = tracer
+        self.port = port
+        self.host = host
+        self.log_path = log_path
+        self.log_interval = log_interval
+        self.runner = None
+        self.log_task = None
+
+    async def handle_metrics(self, request):
+        return web.Response(text=self.tracer.prometheus(), content_type='text/plain', charset='utf-8')
+
+    async def start(self):
+        if self.port:
+            app = web.Application()
+            app.router.add_get('/metrics', self.handle_metrics)
+            self.runner = web.AppRunner(app)
+            await self.runner.setup()
+            site = web.TCPSite(self.runner, self.host, self.port)
+            await site.start()
+            logger.info(f"Metrics available at http://{self.host}:{self.port}/metrics")
+        if self.log_path:
+            self.log_task = asyncio.create_task(self.write_log())
+
+    async def write_log(self):
+        with open(self.log_path, 'a') as log:
+            while True:
+                await asyncio.sleep(self.log_interval)
+                record = {'time': time.time(), **self.tracer.snapshot()}
+                log.write(json.dumps(record) + "\n")
+                log.flush()
+
+    async def stop(self):
+        if self.log_task:
+            self.log_task.cancel()
+        if self.runner:
+            await self.runner.cleanup()
@@ -0,0 +1,130 @@
+"""Command line options of the host processes.
+
+Kept free of GStreamer, GTK, pynput and aiohttp so `--help` and argument
+errors come back at once; the entry points only import those stacks after
+parsing.
+"""
+from capture_region import parse_geometry, parse_xid
+from display_manager import BACKENDS
+from stream_config import ENCODER_NAMES, SIMULCAST_SCALES
+from virtual_display import parse_size
+
+
+def parse_fec(text):
+    """'off', 'adaptive' or a FEC percentage."""
+    if text in ('off', 'adaptive'):
+        return None if text == 'off' else text
+    percentage = int(text)
+    if not 0 <= percentage <= 100:
+        raise ValueError(f"FEC percentage out of range: {percentage}")
+    return percentage
+
+
+def add_signaling_arguments(parser):
+    """Signaling server options, for signaling_server.py and the launcher."""
+    parser.add_argument('--max-queue', type=int, default=256, help="Messages buffered per connection")
+    parser.add_argument('--overflow', choices=['close', 'drop'], default='close',
+                        help="What to do with a connection whose send queue is full")
+    parser.add_argument('--heartbeat', type=float, default=10.0,
+                        help="Seconds between websocket pings; connections that stop answering are closed")
+    parser.add_argument('--batch-ms', type=float, default=10.0,
+                        help="Gather ICE candidates for this long and forward them as one message (0 disables)")
+
+
+def signaling_options(args):
+    """signaling_server.start_server keyword arguments for parsed `args`."""
+    return dict(max_queue=args.max_queue, overflow=args.overflow, heartbeat=args.heartbeat,
+                batch_window=args.batch_ms / 1000)
+
+
+def add_streamer_arguments(parser, signaling=True):
+    """Streamer options; without `signaling` the server URL is left to the caller."""
+    if signaling:
+        parser.add_argument('--signaling', default='http://127.0.0.1:8080/ws', help="Signaling server URL")
+    parser.add_argument('--room', default='default', help="Signaling room to host; clients join it by name")
+    parser.add_argument('--encoder', default='auto', choices=('auto',) + ENCODER_NAMES,
+                        help="Video encoder; 'auto' picks the first one that works on this machine")
+    parser.add_argument('--damage', action='store_true',
+                        help="Only capture and encode while the screen changes (XDamage), with 1 fps keepalives when idle")
+    parser.add_argument('--min-bitrate', type=int, default=2000, help="Lower bound for adaptive bitrate (kbps)")
+    parser.add_argument('--max-bitrate', type=int, default=30000, help="Upper bound and starting bitrate (kbps)")
+    parser.add_argument('--fixed-bitrate', action='store_true', help="Disable adaptation and always encode at --max-bitrate")
+    parser.add_argument('--adapt-framerate', action='store_true', help="Also lower the capture framerate on a poor link")
+    parser.add_argument('--keyframe-interval', type=int, default=300,
+                        help="Frames between periodic keyframes; others are only sent when a peer asks (PLI/FIR)")
+    parser.add_argument('--metrics-port', type=int, help="Serve Prometheus /metrics on 127.0.0.1 at this port")
+    parser.add_argument('--metrics-log', help="Append per-stage latency percentiles as JSON lines to this file")
+    parser.add_argument('--always-convert', action='store_true',
+                        help="Keep the CPU videoconvert even when the encoder accepts captured frames directly")
+    parser.add_argument('--scale-mode', choices=['xrandr', 'pipeline'], default='xrandr',
+                        help="Match the client resolution by resizing the X framebuffer (xrandr) "
+                             "or by capturing natively and downscaling in the pipeline")
+    parser.add_argument('--convert-threads', type=int,
+                        help="Cap the threads used by software color conversion and scaling (default: all cores)")
+    parser.add_argument('--cursor-rate', type=int, default=30,
+                        help="Maximum cursor updates per second (moves in between are coalesced)")
+    parser.add_argument('--video-cursor', action='store_true',
+                        help="Draw the pointer into the video instead of streaming its shape to the client")
+    parser.add_argument('--simulcast', type=int, choices=range(1, len(SIMULCAST_SCALES) + 1), default=1,
+                        help="Encode this many layers (full, half, quarter resolution and bitrate) "
+                             "and give each viewer the best one its link carries")
+    parser.add_argument('--window', type=parse_xid,
+                        help="Capture only this X window id (as printed by xwininfo), following its moves and resizes")
+    parser.add_argument('--region', type=parse_geometry,
+                        help="Capture only this WIDTHxHEIGHT+X+Y rectangle of the screen (or of --window)")
+    parser.add_argument('--outputs',
+                        help="Encode each of these monitors as its own track: 'all' or comma separated "
+                             "RandR output names; clients pick among them (default: the whole screen as one)")
+    parser.add_argument('--display-backend', choices=BACKENDS, default='auto',
+                        help="Resize the display through RandR directly or by running xrandr")
+    parser.add_argument('--virtual-display', nargs='?', const='new', metavar='DISPLAY',
+                        help="Stream a private virtual X display sized to each client instead of rescaling "
+                             "the physical monitor: start an Xvfb, or attach to a running server such as "
+                             "Xorg with xf86-video-dummy (':N')")
+    parser.add_argument('--virtual-max-size', type=parse_size, default=(3840, 2160),
+                        help="Largest client resolution a spawned Xvfb can be resized to (WIDTHxHEIGHT)")
+    parser.add_argument('--standby-pipelines', type=int, default=2,
+                        help="Prewarmed pipelines kept paused besides the streaming one, one per recently "
+                             "streamed resolution (at least 1)")
+    parser.add_argument('--lan', action='store_true',
+                        help="LAN fast path: no STUN, and every ICE candidate sent in the offer instead of trickled")
+    parser.add_argument('--ice-interfaces',
+                        help="Only offer ICE candidates on these comma separated interfaces or addresses")
+    parser.add_argument('--screen-content', action='store_true',
+                        help="Spend more of the bitrate around the pointer and in the focused window, "
+                             "so text stays sharp where the user looks (encoders with ROI support: vaapi)")
+    parser.add_argument('--no-rtx', action='store_true',
+                        help="Do not retransmit lost packets on NACK; only recover from loss with keyframes")
+    parser.add_argument('--fec', type=parse_fec, default=None, metavar='{off,adaptive,PERCENT}',
+                        help="Send ULPFEC/RED forward error correction: a fixed overhead in percent, "
+                             "or 'adaptive' to follow the measured loss (default: off)")
+
+
+def streamer_options(parser, args):
+    """WebRTCStreamer keyword arguments for parsed `args`; errors out through `parser`."""
+    if args.outputs and (args.window or args.region):
+        parser.error("--outputs cannot be combined with --window or --region")
+    if args.outputs and args.simulcast > 1:
+        parser.error("--outputs cannot be combined with --simulcast")
+    if args.virtual_display and args.outputs:
+        parser.error("--virtual-display cannot be combined with --outputs")
+    if args.standby_pipelines < 1:
+        parser.error("--standby-pipelines must be at least 1")
+    if args.fec == 'adaptive' and args.fixed_bitrate:
+        parser.error("--fec adaptive needs the link statistics of adaptive bitrate, drop --fixed-bitrate")
+    outputs = args.outputs if args.outputs in (None, 'all') else args.outputs.split(',')
+
+    return dict(encoder=args.encoder, damage=args.damage,
+                min_bitrate=args.min_bitrate, max_bitrate=args.max_bitrate,
+                adaptive=not args.fixed_bitrate, adapt_framerate=args.adapt_framerate,
+                keyframe_interval=args.keyframe_interval,
+                metrics_port=args.metrics_port, metrics_log=args.metrics_log,
+                zero_copy=not args.always_convert,
+                scale_mode=args.scale_mode, convert_threads=args.convert_threads,
+                cursor_rate=args.cursor_rate, cursor_shapes=not args.video_cursor,
+                simulcast=args.simulcast, xid=args.window, region=args.region,
+                outputs=outputs, display_backend=args.display_backend,
+                virtual_display=args.virtual_display, virtual_max_size=args.virtual_max_size,
+                standby_pipelines=args.standby_pipelines, room=args.room, lan=args.lan,
+                ice_interfaces=args.ice_interfaces.split(',') if args.ice_interfaces else None,
+                rtx=not args.no_rtx, fec=args.fec, screen_content=args.screen_content)
@@ -0,0 +1,566 @@
+import logging
+import os
+import threading
+import time
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstVideo', '1.0')
+from gi.repository import Gst, GstVideo
+
+from capture_region import even_region, x_window_geometry
+from damage import DamageGate, DamageTracker
+from stream_config import SIMULCAST_SCALES
+
+logger = logging.getLogger(__name__)
+
+
+class PipelineBuildError(Exception):
+    pass
+
+
+def make_element(factory, name, **props):
+    elem = Gst.ElementFactory.make(factory, name)
+    if elem is None:
+        raise PipelineBuildError(f"GStreamer element '{factory}' is not available")
+    for key, value in props.items():
+        elem.set_property(key.replace('_', '-'), value)
+    return elem
+
+
+def request_pad(element, template):
+    # request_pad_simple() replaced get_request_pad() in GStreamer 1.20
+    if hasattr(element, 'request_pad_simple'):
+        return element.request_pad_simple(template)
+    return element.get_request_pad(template)
+
+
+def link_many(*elements):
+    for upstream, downstream in zip(elements, elements[1:]):
+        if not upstream.link(downstream):
+            raise PipelineBuildError(f"Failed to link {upstream.get_name()} to {downstream.get_name()}")
+
+
+# ximagesrc output on the usual 24/32-bit TrueColor X visuals
+CAPTURE_FORMAT = "BGRx"
+
+
+def x_capture_format(display_name=None):
+    try:
+        from Xlib import display as xdisplay
+        disp = xdisplay.Display(display_name)
+        depth = disp.screen().root_depth
+        disp.close()
+    except Exception:
+        return None
+    return CAPTURE_FORMAT if depth in (24, 32) else None
+
+
+def x_screen_size(display_name=None):
+    try:
+        from Xlib import display as xdisplay
+        disp = xdisplay.Display(display_name)
+        screen = disp.screen()
+        size = screen.width_in_pixels, screen.height_in_pixels
+        disp.close()
+    except Exception:
+        return None
+    return size
+
+
+def accepts_format(factory_name, fmt):
+    """Whether an element's sink template takes system-memory frames in `fmt`."""
+    factory = Gst.ElementFactory.find(factory_name)
+    if factory is None:
+        return False
+    caps = Gst.Caps.from_string(f"video/x-raw,format={fmt}")
+    for template in factory.get_static_pad_templates():
+        if template.direction == Gst.PadDirection.SINK and template.get_caps().can_intersect(caps):
+            return True
+    return False
+
+
+class EncodeLayer:
+    """One encoding of the capture at a fraction of its resolution and bitrate.
+
+    With `crop` (x, y, width, height) it encodes only that part of the
+    screen, which is how each monitor gets its own stream.
+    """
+
+    def __init__(self, index, scale, crop=None, name=None):
+        self.index = index
+        self.scale = scale
+        self.crop = crop
+        self.name = name or f"layer{index}"
+        self.videocrop = None
+        self.scalecaps = None
+        self.converted = None
+        self.encoder = None
+        self.payloader = None # Only without simulcast; see CapturePipeline
+        self.tee = None
+        self.last_keyframe_request = 0.0
+        # Seqnum of the force-key-unit event request_keyframe() last sent,
+        # already rate limited when it crosses the encoder src pad probe
+        self.host_keyframe_seqnum = None
+
+    def __repr__(self):
+        return f"EncodeLayer({self.index}, scale={self.scale}, crop={self.crop})"
+
+    def describe(self):
+        x, y, width, height = self.crop or (0, 0, None, None)
+        return {'index': self.index, 'name': self.name, 'x': x, 'y': y, 'width': width, 'height': height}
+
+
+class CapturePipeline:
+    """Capture -> encode -> RTP payload chain that ends in a tee.
+
+    The pipeline outlives client connections: each peer attaches its own
+    webrtcbin to a tee branch (see session.StreamSession), so a reconnect
+    never has to rebuild the capture source or re-initialise the encoder.
+
+    With several `layers` (simulcast) the capture is split into one scaled
+    encode per layer, each ending in a tee of the encoded stream. Peers then
+    payload for themselves, so moving a peer between layers keeps its RTP
+    sequence numbers and SSRC continuous.
+
+    With `outputs` (display_manager.Output) the whole X screen is captured
+    once and cropped into one encode -> payload -> tee per monitor; a peer
+    attaches a track per monitor it wants.
+    """
+
+    def __init__(self, test_source=False, damage=False, keepalive=1.0, bitrate=30000, framerate=30,
+                 keyframe_interval=300, keyframe_min_interval=0.25, test_pattern="ball",
+                 test_resolution=(1920, 1080), zero_copy=True, convert_threads=None, scale=False,
+                 show_pointer=True, layers=(1.0,), xid=None, region=None, outputs=None, display_name=None):
+        self.test_source = test_source
+        self.test_pattern = test_pattern
+        self.test_resolution = test_resolution
+        self.zero_copy = zero_copy
+        # Threads for the software videoconvert/videoscale stages; None uses every core
+        self.convert_threads = convert_threads or os.cpu_count() or 1
+        # Scale in the pipeline (native capture, downscaled to output_size)
+        # instead of resizing the X framebuffer
+        self.scale = scale
+        # Off when the cursor shape is streamed separately (cursor.CursorShapeTracker)
+        # and drawn by the client, so it is not baked into the video as well
+        self.show_pointer = show_pointer
+        # X display to capture; None is $DISPLAY
+        self.display_name = display_name
+        # Capture one X window (xid) and/or a rectangle (x, y, width, height),
+        # relative to that window or else to the root window
+        self.xid = xid
+        self.region = region
+        self.output_size = None
+        if outputs:
+            self.layers = [EncodeLayer(i, 1.0, crop=even_region(*output.geometry), name=output.name)
+                           for i, output in enumerate(outputs)]
+        else:
+            # Resolution (and bitrate) fractions, best first
+            self.layers = [EncodeLayer(i, scale) for i, scale in enumerate(layers)]
+        self.simulcast = len(self.layers) > 1 and not outputs
+        # Long GOP by default: keyframes are forced when a peer joins or the
+        # receiver reports loss (PLI/FIR), with the periodic one only as a
+        # safety net.
+        self.keyframe_interval = keyframe_interval
+        self.keyframe_min_interval = keyframe_min_interval
+        self.keyframe_lock = threading.Lock()
+        self.keyframes_requested = 0
+        self.keyframes_forced = 0
+        self.bitrate = bitrate # kbps, of the full-resolution layer
+        self.framerate = framerate
+        self.damage = damage and not test_source
+        self.keepalive = keepalive
+        self.damage_tracker = None
+        self.damage_gate = None
+        self.pipeline = None
+        self.source = None
+        self.encoder_spec = None
+        self.capsfilter = None
+
+    # The full-resolution (or first monitor's) layer, which is all there is
+    # without simulcast or several outputs
+    @property
+    def encoder(self):
+        return self.layers[0].encoder
+
+    @property
+    def converted(self):
+        return self.layers[0].converted
+
+    @property
+    def payloader(self):
+        return self.layers[0].payloader
+
+    @property
+    def tee(self):
+        return self.layers[0].tee
+
+    @property
+    def output(self):
+        # Element feeding the full-resolution tee
+        return self.payloader or self.encoder
+
+    def build(self, encoder):
+        """Build the pipeline around `encoder`, an encoders.EncoderSpec."""
+        self.encoder_spec = encoder
+        self.pipeline = Gst.Pipeline.new("pipeline")
+
+        elements = []
+        if self.test_source:
+            source = make_element("videotestsrc", "videotestsrc0", is_live=True)
+            source.set_property("pattern", self.test_pattern)
+            # Produce what ximagesrc produces so the rest of the chain is the same
+            width, height = self.test_resolution
+            srccaps = make_element("capsfilter", "srccaps0")
+            srccaps.set_property("caps", Gst.Caps.from_string(
+                f"video/x-raw,format={CAPTURE_FORMAT},width={width},height={height}"))
+            elements.extend([source, srccaps])
+        else:
+            source = make_element("ximagesrc", "ximagesrc0")
+            # Full-screen grabs unless damage mode is on, where ximagesrc only
+            # copies the damaged regions into its last frame.
+            source.set_property("use-damage", self.damage)
+            source.set_property("show-pointer", self.show_pointer)
+            if self.display_name:
+                source.set_property("display-name", self.display_name)
+            if self.xid:
+                source.set_property("xid", self.xid)
+            elements.append(source)
+        self.source = source
+        self.apply_region()
+
+        # Add videorate to enforce stable framerate. Damage mode wants the
+        # opposite: a variable rate that drops to keepalives on a static screen.
+        if not self.damage:
+            elements.append(make_element("videorate", "videorate0"))
+
+        # Add capsfilter to enforce the framerate
+        capsfilter = make_element("capsfilter", "capsfilter0")
+        capsfilter.set_property("caps", Gst.Caps.from_string(f"video/x-raw,framerate={self.framerate}/1"))
+        self.capsfilter = capsfilter
+        elements.append(capsfilter)
+
+        if len(self.layers) == 1:
+            elements.extend(self.build_layer(encoder, self.layers[0]))
+            for elem in elements:
+                self.pipeline.add(elem)
+            link_many(*elements)
+        else:
+            # Capture (and damage-gate) once, encode once per layer
+            rawtee = make_element("tee", "rawtee")
+            elements.append(rawtee)
+            for elem in elements:
+                self.pipeline.add(elem)
+            link_many(*elements)
+            for layer in self.layers:
+                # Leaky, so a slow layer drops its own frames instead of stalling the others
+                branch = [make_element("queue", f"layerqueue{layer.index}", max_size_buffers=1, leaky=2)]
+                branch.extend(self.build_layer(encoder, layer))
+                for elem in branch:
+                    self.pipeline.add(elem)
+                link_many(*branch)
+                request_pad(rawtee, 'src_%u').link(branch[0].get_static_pad('sink'))
+
+        if self.damage:
+            self.setup_damage_gate()
+
+        # PLI/FIR from any peer arrive here as upstream force-key-unit events
+        for layer in self.layers:
+            layer.encoder.get_static_pad('src').add_probe(
+                Gst.PadProbeType.EVENT_UPSTREAM, self.on_upstream_event, layer)
+
+        return self.pipeline
+
+    def build_layer(self, encoder, layer):
+        """Scale/convert -> encode [-> RTP payload] -> tee elements for one layer."""
+        index = layer.index
+        elements = []
+
+        if layer.crop:
+            layer.videocrop = make_element("videocrop", f"videocrop{index}")
+            self.update_crop(layer)
+            elements.append(layer.videocrop)
+
+        # Hardware encoders bring their own postproc/upload elements for
+        # hardware accelerated color conversion, which take the captured
+        # frames as they are.
+        gpu_convert = self.make_gpu_converters(encoder, index)
+        consumer = gpu_convert[0].get_factory().get_name() if gpu_convert else encoder.factory
+        scaled = self.scale or layer.scale < 1
+
+        # Downscale before conversion so the converter sees fewer pixels,
+        # unless the GPU converter can scale by itself
+        if scaled and not (gpu_convert and encoder.gpu_scale):
+            videoscale = make_element("videoscale", f"videoscale{index}")
+            # Stretch exactly like xrandr --scale-from, so client-side cursor
+            # mapping stays the same in both modes
+            videoscale.set_property("add-borders", False)
+            self.set_threads(videoscale)
+            elements.append(videoscale)
+
+        # Convert on the CPU only when whatever comes next cannot take the
+        # capture format directly; otherwise every full-screen frame would be
+        # converted twice (videoconvert to NV12, then again on the GPU).
+        fmt = self.capture_format()
+        if not self.zero_copy or fmt is None or not accepts_format(consumer, fmt):
+            videoconvert = make_element("videoconvert", f"videoconvert{index}")
+            self.set_threads(videoconvert)
+            elements.append(videoconvert)
+        elif index == 0:
+            logger.info(f"{consumer} accepts {fmt} directly, skipping videoconvert")
+        elements.extend(gpu_convert)
+
+        if scaled:
+            # ANY features so it also applies after GPU converters (VASurface/CUDA memory)
+            layer.scalecaps = make_element("capsfilter", f"scalecaps{index}")
+            layer.scalecaps.set_property("caps", self.output_caps(layer))
+            elements.append(layer.scalecaps)
+
+        # Configure queue to be leaky to prevent freezing/buffering
+        queue = make_element("queue", f"queue{index}", max_size_buffers=1)
+        queue.set_property("leaky", 2) # 2 = downstream (drop new buffers if full)
+
+        layer.encoder = encoder.make(f"{encoder.factory}{index}")
+        encoder.set_bitrate(layer.encoder, self.layer_bitrate(layer)) # 30 Mbps by default for high quality
+        encoder.set_keyframe_interval(layer.encoder, self.keyframe_interval)
+
+        # Last element before the encoder queue, where frames are in encoder format
+        layer.converted = elements[-1] if elements else self.capsfilter
+        elements.extend([queue, layer.encoder])
+
+        # Keep encoding while no peer is attached so a new session starts instantly
+        if self.simulcast:
+            layer.tee = make_element("tee", f"layertee{index}", allow_not_linked=True)
+        else:
+            layer.payloader = encoder.make_payloader(f"{encoder.payloader}{index}")
+            layer.tee = make_element("tee", f"rtptee{index or ''}", allow_not_linked=True)
+            elements.append(layer.payloader)
+        elements.append(layer.tee)
+        return elements
+
+    def set_threads(self, element):
+        # n-threads arrived in GStreamer 1.20
+        if element.find_property("n-threads"):
+            element.set_property("n-threads", self.convert_threads)
+
+    def layer_bitrate(self, layer):
+        return self.bitrate * layer.scale
+
+    def layer_size(self, layer):
+        if layer.scale == 1:
+            return self.output_size
+        width, height = self.output_size or self.capture_size() or (None, None)
+        if width is None:
+            return None
+        # Even sizes keep 4:2:0 encoders happy
+        return max(2, int(width * layer.scale) // 2 * 2), max(2, int(height * layer.scale) // 2 * 2)
+
+    def output_caps(self, layer=None):
+        size = self.layer_size(layer or self.layers[0])
+        if size is None:
+            return Gst.Caps.from_string("video/x-raw(ANY)")
+        width, height = size
+        return Gst.Caps.from_string(f"video/x-raw(ANY),width={width},height={height}")
+
+    def update_crop(self, layer):
+        size = self.capture_size()
+        if size is None:
+            return
+        x, y, width, height = layer.crop
+        layer.videocrop.set_property("left", x)
+        layer.videocrop.set_property("top", y)
+        layer.videocrop.set_property("right", max(0, size[0] - x - width))
+        layer.videocrop.set_property("bottom", max(0, size[1] - y - height))
+
+    def update_layer_caps(self):
+        for layer in self.layers:
+            if layer.videocrop:
+                self.update_crop(layer)
+            if layer.scalecaps:
+                # Renegotiates in place, no capture restart needed
+                layer.scalecaps.set_property("caps", self.output_caps(layer))
+
+    def set_output_size(self, width, height):
+        """Scale the stream to width x height (None, None for native size)."""
+        self.output_size = None if width is None else (width, height)
+        self.update_layer_caps()
+
+    def make_gpu_converters(self, encoder, index=0):
+        elements = []
+        for factory in encoder.gpu_convert:
+            elem = Gst.ElementFactory.make(factory, f"{factory}{index}")
+            if elem is None:
+                logger.warning(f"{factory} not found, using software conversion only")
+                return []
+            elements.append(elem)
+        return elements
+
+    def capture_format(self):
+        """Raw format the capture source produces, or None if unknown."""
+        if self.test_source:
+            return CAPTURE_FORMAT
+        return x_capture_format(self.display_name)
+
+    def capture_size(self):
+        """(width, height) the capture source produces, or None if unknown."""
+        if self.test_source:
+            return self.test_resolution
+        region = self.capture_rect()
+        if region:
+            return region[2:]
+        return x_screen_size(self.display_name)
+
+    def capture_rect(self):
+        """Captured (x, y, width, height) relative to the window or root, or None for everything."""
+        if self.region:
+            return even_region(*self.region)
+        if self.xid:
+            geometry = x_window_geometry(self.xid, self.display_name)
+            if geometry:
+                return even_region(0, 0, *geometry[2:])
+        return None
+
+    def apply_region(self):
+        if self.test_source or self.source is None:
+            return
+        rect = self.capture_rect()
+        if rect is None:
+            return
+        x, y, width, height = rect
+        # ximagesrc's end coordinates are inclusive
+        self.source.set_property("startx", x)
+        self.source.set_property("starty", y)
+        self.source.set_property("endx", x + width - 1)
+        self.source.set_property("endy", y + height - 1)
+
+    def restart_source(self):
+        """Re-open the capture source at the current region/window size.
+
+        Only the source is cycled, so attached peers stay connected while the
+        new size renegotiates down to the encoder.
+        """
+        if self.source is None:
+            return False
+        self.source.set_state(Gst.State.NULL)
+        self.apply_region()
+        self.update_layer_caps()
+        self.source.sync_state_with_parent()
+        for layer in self.layers:
+            self.refresh(layer.index)
+        return False
+
+    def allow_keyframe(self, layer):
+        # Several viewers reporting the same loss should cost one keyframe
+        with self.keyframe_lock:
+            self.keyframes_requested += 1
+            now = time.monotonic()
+            if now - layer.last_keyframe_request < self.keyframe_min_interval:
+                return False
+            layer.last_keyframe_request = now
+            self.keyframes_forced += 1
+        if self.damage_gate:
+            # The keyframe needs a frame to be encoded even on an idle screen
+            self.damage_gate.wake()
+        return True
+
+    def on_upstream_event(self, pad, info, layer):
+        event = info.get_event()
+        if not GstVideo.video_event_is_force_key_unit(event):
+            return Gst.PadProbeReturn.OK
+        if event.get_seqnum() == layer.host_keyframe_seqnum:
+            return Gst.PadProbeReturn.OK
+        if self.allow_keyframe(layer):
+            logger.debug(f"Forwarding keyframe request from peer to layer {layer.index}")
+            return Gst.PadProbeReturn.OK
+        return Gst.PadProbeReturn.DROP
+
+    def request_keyframe(self, index=0):
+        layer = self.layers[index]
+        if layer.encoder is None or not self.allow_keyframe(layer):
+            return
+        event = GstVideo.video_event_new_upstream_force_key_unit(Gst.CLOCK_TIME_NONE, True, 0)
+        layer.host_keyframe_seqnum = event.get_seqnum()
+        # Pushed from the pad right after the encoder, so it travels up into it
+        layer.encoder.get_static_pad('src').get_peer().push_event(event)
+
+    def setup_damage_gate(self):
+        if not DamageTracker.available():
+            logger.warning("python-xlib not installed, capturing at full frame rate")
+            return
+        if self.damage_tracker is None:
+            tracker = DamageTracker(self.display_name)
+            try:
+                tracker.start()
+            except Exception as e:
+                logger.warning(f"Damage tracking unavailable ({e}), capturing at full frame rate")
+                return
+            self.damage_tracker = tracker
+            self.damage_gate = DamageGate(tracker, keepalive=self.keepalive)
+        # Drop unchanged frames before conversion and encode
+        self.source.get_static_pad('src').add_probe(Gst.PadProbeType.BUFFER, self.damage_gate.probe, None)
+
+    def set_bitrate(self, kbps):
+        self.bitrate = kbps
+        for layer in self.layers:
+            if layer.encoder:
+                self.encoder_spec.set_bitrate(layer.encoder, self.layer_bitrate(layer))
+
+    def set_framerate(self, fps):
+        self.framerate = fps
+        if self.capsfilter:
+            self.capsfilter.set_property("caps", Gst.Caps.from_string(f"video/x-raw,framerate={fps}/1"))
+
+    def refresh(self, index=0):
+        # A new viewer needs a keyframe, and pictures even on an idle screen
+        if self.damage_gate:
+            self.damage_gate.wake()
+        self.request_keyframe(index)
+
+    def start(self):
+        # The framebuffer may have been resized since the last start
+        self.apply_region()
+        self.update_layer_caps()
+        self.pipeline.set_state(Gst.State.PLAYING)
+
+    def pause(self):
+        # Stop capturing but keep the elements, negotiated caps and encoder
+        # state, so start() resumes at once
+        if self.pipeline:
+            self.pipeline.set_state(Gst.State.PAUSED)
+
+    def prewarm(self, timeout):
+        """Run until the encoder has produced a frame, then pause; returns whether it did."""
+        encoded = threading.Event()
+
+        def on_encoded(pad, info, user_data):
+            encoded.set()
+            return Gst.PadProbeReturn.REMOVE
+
+        self.encoder.get_static_pad('src').add_probe(Gst.PadProbeType.BUFFER, on_encoded, None)
+        self.start()
+        done = encoded.wait(timeout)
+        self.pause()
+        return done
+
+    def is_playing(self):
+        if self.pipeline is None:
+            return False
+        _, state, pending = self.pipeline.get_state(0)
+        return state == Gst.State.PLAYING and pending == Gst.State.VOID_PENDING
+
+    def stop(self):
+        if self.pipeline:
+            self.pipeline.set_state(Gst.State.NULL)
+
+    def close(self):
+        self.stop()
+        if self.damage_tracker:
+            self.damage_tracker.stop()
+            self.damage_tracker = None
+            self.damage_gate = None
+
+    def payload_caps(self):
+        if self.simulcast:
+            # Every peer payloads for itself; what it will produce is known up front
+            return self.encoder_spec.rtp_caps()
+        return self.payloader.get_static_pad('src').get_current_caps()
@@ -0,0 +1,79 @@
+import collections
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class PipelineCache:
+    """Prewarmed capture pipelines, parked in PAUSED until a client needs one.
+
+    Building a pipeline and bringing up its encoder (a hardware one
+    especially) is the slow part of a connect, so it is done once per
+    (width, height, framerate, encoder) key: `acquire(key)` builds,
+    runs until the first encoded frame and pauses a CapturePipeline, or
+    returns the one already parked for that key. Starting it is then a
+    PAUSED -> PLAYING transition with caps negotiated and the encoder
+    initialized.
+
+    `build()` returns a built CapturePipeline for the current screen;
+    `discard(capture)` tears down one evicted so that at most `size`
+    (at least 1) are parked besides the one acquired. The capture passed
+    as `in_use`, still streaming until the caller switches over, is never
+    evicted.
+    """
+
+    def __init__(self, build, discard=None, size=2, timeout=5.0):
+        if size < 1:
+            raise ValueError(f"Standby pipeline count must be at least 1, not {size}")
+        self.build = build
+        self.discard = discard or (lambda capture: capture.close())
+        self.size = size
+        self.timeout = timeout
+        self.entries = collections.OrderedDict()
+        # acquire() runs in executor threads, possibly two at once
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def acquire(self, key, in_use=None):
+        with self.lock:
+            capture = self.entries.get(key)
+            if capture is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return capture
+            self.misses += 1
+        logger.info(f"Prewarming pipeline for {key}")
+        capture = self.build()
+        self.prewarm(capture)
+        with self.lock:
+            self.entries[key] = capture
+            evicted = self.evict(keep=(capture, in_use))
+        for old_key, old in evicted:
+            logger.info(f"Dropping standby pipeline for {old_key}")
+            self.discard(old)
+        return capture
+
+    def evict(self, keep):
+        """Oldest entries beyond `size`, leaving out those in `keep`; removes them."""
+        parked = [key for key, capture in self.entries.items() if capture is not keep[0]]
+        evicted = []
+        for key in parked:
+            if len(parked) - len(evicted) <= self.size:
+                break
+            if any(self.entries[key] is capture for capture in keep):
+                continue
+            evicted.append((key, self.entries.pop(key)))
+        return evicted
+
+    def prewarm(self, capture):
+        """Run `capture` until it has encoded a frame, then park it in PAUSED."""
+        if not capture.prewarm(self.timeout):
+            logger.warning("Standby pipeline encoded nothing while prewarming, parking it anyway")
+
+    def close(self):
+        with self.lock:
+            entries, self.entries = list(self.entries.values()), collections.OrderedDict()
+        for capture in entries:
+            self.discard(capture)
@@ -0,0 +1,119 @@
+"""Bitrate and FEC control laws, free of GStreamer.
+
+adaptive_bitrate feeds them webrtcbin's stats; the benchmarks drive them
+from a simulated link.
+"""
+import math
+
+
+class LinkStats:
+    """The parts of a webrtcbin get-stats reply the controller looks at.
+
+    Counters (packets, NACK, PLI, FIR) are cumulative like in the WebRTC
+    stats spec; None means the field was not reported.
+    """
+
+    def __init__(self, rtt=None, fraction_lost=None, packets_sent=0, packets_lost=0,
+                 nack_count=0, pli_count=0, fir_count=0, available_bitrate=None):
+        self.rtt = rtt
+        self.fraction_lost = fraction_lost
+        self.packets_sent = packets_sent
+        self.packets_lost = packets_lost
+        self.nack_count = nack_count
+        self.pli_count = pli_count
+        self.fir_count = fir_count
+        self.available_bitrate = available_bitrate # kbps
+
+    def __repr__(self):
+        return (f"LinkStats(rtt={self.rtt}, fraction_lost={self.fraction_lost}, "
+                f"nack={self.nack_count}, pli={self.pli_count})")
+
+
+class BitrateController:
+    """Loss- and delay-based AIMD bitrate control for one peer.
+
+    Modelled on the loss-based half of Google Congestion Control: grow by
+    `increase` while the link is clean, hold in the 2-10% loss band, and cut
+    in proportion to loss above it or when RTT climbs well above the lowest
+    RTT seen (queues building up in the access point). Pure Python, so it can
+    be driven by a scripted stats feed offline.
+    """
+
+    def __init__(self, min_bitrate=2000, max_bitrate=30000, start_bitrate=None,
+                 increase=1.08, low_loss=0.02, high_loss=0.10, rtt_factor=2.0):
+        self.min_bitrate = min_bitrate
+        self.max_bitrate = max_bitrate
+        self.bitrate = start_bitrate or max_bitrate
+        self.increase = increase
+        self.low_loss = low_loss
+        self.high_loss = high_loss
+        self.rtt_factor = rtt_factor
+        self.min_rtt = None
+        self.previous = None
+        self.last_loss = 0.0
+
+    def loss(self, stats):
+        # Prefer the receiver's own fraction-lost; fall back to NACKs per packet
+        previous = self.previous
+        if stats.fraction_lost is not None:
+            return stats.fraction_lost
+        if previous is None:
+            return 0.0
+        sent = stats.packets_sent - previous.packets_sent
+        if sent <= 0:
+            return 0.0
+        lost = max(stats.packets_lost - previous.packets_lost,
+                   stats.nack_count - previous.nack_count)
+        return min(1.0, max(0.0, lost / sent))
+
+    def update(self, stats):
+        loss = self.loss(stats)
+        self.last_loss = loss
+        congested = False
+        if stats.rtt:
+            self.min_rtt = stats.rtt if self.min_rtt is None else min(self.min_rtt, stats.rtt)
+            # Ignore sub-10ms jitter on a quiet LAN
+            congested = stats.rtt > max(self.min_rtt * self.rtt_factor, self.min_rtt + 0.010)
+
+        if loss > self.high_loss:
+            self.bitrate *= 1 - 0.5 * loss
+        elif congested:
+            self.bitrate *= 0.85
+        elif loss < self.low_loss:
+            self.bitrate *= self.increase
+
+        if stats.available_bitrate:
+            self.bitrate = min(self.bitrate, stats.available_bitrate * 0.9)
+
+        self.bitrate = max(self.min_bitrate, min(self.max_bitrate, self.bitrate))
+        self.previous = stats
+        return self.bitrate
+
+
+class FecController:
+    """ULPFEC overhead for one peer, following its measured loss.
+
+    Asks for `factor` times the loss rate in FEC packets, so isolated
+    losses are almost always covered. Wi-Fi loses packets in bursts, so
+    the overhead goes up as soon as loss does and comes down by at most
+    `decay` percentage points per update once the link is clean again.
+    """
+
+    START_PERCENTAGE = 10
+
+    def __init__(self, start_percentage=START_PERCENTAGE, min_percentage=0, max_percentage=50,
+                 factor=2.0, decay=2):
+        self.min_percentage = min_percentage
+        self.max_percentage = max_percentage
+        self.factor = factor
+        self.decay = decay
+        self.percentage = start_percentage
+
+    def update(self, loss):
+        target = math.ceil(loss * 100 * self.factor)
+        target = max(self.min_percentage, min(self.max_percentage, target))
+        if target >= self.percentage:
+            self.percentage = target
+        else:
+            self.percentage = max(target, self.percentage - self.decay)
+        return self.percentage
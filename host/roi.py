@@ -0,0 +1,139 @@
+import logging
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstVideo', '1.0')
+from gi.repository import Gst, GstVideo
+
+logger = logging.getLogger(__name__)
+
+
+def clip(x, y, width, height, frame_width, frame_height):
+    """(x, y, width, height) cut to the frame, or None if nothing is left."""
+    left, top = max(0, x), max(0, y)
+    right, bottom = min(frame_width, x + width), min(frame_height, y + height)
+    if right <= left or bottom <= top:
+        return None
+    return left, top, right - left, bottom - top
+
+
+class RoiTagger:
+    """Screen-content encoding: more bits where the user is looking.
+
+    Before every frame reaches the encoder, a region around the pointer and
+    the focused window are attached as GstVideoRegionOfInterestMeta with a
+    negative QP delta, so text there stays sharp while a rate-controlled
+    encoder takes the bits from the rest of the screen.
+
+    `spec` is the encoders.EncoderSpec (its `roi` names the parameter the
+    encoder reads). `regions()` returns the captured (x, y, width, height)
+    in screen coordinates, one per capture layer with a monitor each, else
+    just one, as for cursor.CursorSender. `pointer()` returns the pointer's
+    screen position and `focus()` the focused window's screen rectangle;
+    either may return None.
+    """
+
+    def __init__(self, spec, regions, pointer=None, focus=None, pointer_size=256,
+                 pointer_delta=-10, focus_delta=-5):
+        self.structure, self.field = spec.roi
+        self.regions = regions
+        self.pointer = pointer or (lambda: None)
+        self.focus = focus or (lambda: None)
+        self.pointer_size = pointer_size
+        self.pointer_delta = pointer_delta
+        self.focus_delta = focus_delta
+        self.frames = 0
+
+    @staticmethod
+    def supported(spec):
+        return spec.roi is not None
+
+    def attach(self, capture):
+        for layer in capture.layers:
+            self.tag(layer.encoder, layer.index)
+
+    def tag(self, encoder, index=0):
+        """Tag the frames going into `encoder`, which encodes capture region `index`.
+
+        Links a RoiTag element in ahead of the encoder, so call it before
+        the pipeline runs.
+        """
+        sink = encoder.get_static_pad('sink')
+        upstream = sink.get_peer()
+        upstream.unlink(sink)
+        tag = RoiTag(self, index)
+        encoder.get_parent().add(tag)
+        upstream.link(tag.sinkpad)
+        tag.srcpad.link(sink)
+        tag.sync_state_with_parent()
+
+    def rois(self, index, frame_width, frame_height):
+        """(x, y, width, height, qp delta) in frame coordinates, most important last."""
+        regions = self.regions()
+        region = regions[index] if index < len(regions) else regions[0]
+        left, top, width, height = region
+        # Frames may be scaled (simulcast layers, pipeline scaling)
+        scale_x, scale_y = frame_width / width, frame_height / height
+
+        def to_frame(x, y, w, h):
+            return clip(round((x - left) * scale_x), round((y - top) * scale_y),
+                        round(w * scale_x), round(h * scale_y), frame_width, frame_height)
+
+        rois = []
+        focus = self.focus()
+        if focus:
+            rect = to_frame(*focus)
+            # A maximized focused window is the whole frame: no point
+            if rect and rect != (0, 0, frame_width, frame_height):
+                rois.append(rect + (self.focus_delta,))
+        pointer = self.pointer()
+        if pointer:
+            half = self.pointer_size // 2
+            rect = to_frame(pointer[0] - half, pointer[1] - half, self.pointer_size, self.pointer_size)
+            if rect:
+                rois.append(rect + (self.pointer_delta,))
+        return rois
+
+    def tagged(self, buffer, caps, index):
+        """`buffer` with the ROI metas of its frame added, if any."""
+        if caps is None:
+            return buffer
+        structure = caps.get_structure(0)
+        ok_w, frame_width = structure.get_int('width')
+        ok_h, frame_height = structure.get_int('height')
+        rois = self.rois(index, frame_width, frame_height) if ok_w and ok_h else []
+        if not rois:
+            return buffer
+        # The Python wrapper holds a reference of its own, so the buffer is
+        # never writable here; the copy shares the frame memory
+        buffer = buffer.copy()
+        for x, y, width, height, delta in rois:
+            meta = GstVideo.buffer_add_video_region_of_interest_meta(buffer, "screen-content", x, y, width, height)
+            meta.add_param(Gst.Structure.new_from_string(f"{self.structure}, {self.field}=(int){delta}"))
+        self.frames += 1
+        return buffer
+
+
+class RoiTag(Gst.Element):
+    """Passes frames through to the encoder with their RoiTagger metas added.
+
+    An element of its own rather than a pad probe, so the encoder's flow
+    return (FLUSHING, EOS, NOT_NEGOTIATED) travels back upstream and caps,
+    allocation and scheduling queries go straight through.
+    """
+
+    __gtype_name__ = 'HostRoiTag'
+
+    def __init__(self, tagger, index):
+        super().__init__()
+        self.tagger = tagger
+        self.index = index
+        self.sinkpad = Gst.Pad.new('sink', Gst.PadDirection.SINK)
+        self.srcpad = Gst.Pad.new('src', Gst.PadDirection.SRC)
+        for pad in (self.sinkpad, self.srcpad):
+            pad.set_flags(Gst.PadFlags.PROXY_CAPS | Gst.PadFlags.PROXY_ALLOCATION | Gst.PadFlags.PROXY_SCHEDULING)
+            self.add_pad(pad)
+        self.sinkpad.set_chain_function_full(self.chain, None)
+
+    def chain(self, pad, parent, buffer):
+        return self.srcpad.push(self.tagger.tagged(buffer, pad.get_current_caps(), self.index))
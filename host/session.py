@@ -0,0 +1,435 @@
+import fcntl
+import ipaddress
+import logging
+import socket
+import struct
+import threading
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstWebRTC', '1.0')
+gi.require_version('GstSdp', '1.0')
+from gi.repository import Gst, GstWebRTC, GstSdp, GLib
+
+from connection_setup import promise_reply
+from pipeline import link_many, make_element, request_pad
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STUN_SERVER = "stun://stun.l.google.com:19302"
+
+SIOCGIFADDR = 0x8915
+
+
+def interface_addresses(names):
+    """IP addresses of the network interfaces `names`; addresses given as such are kept."""
+    addresses = []
+    for name in names:
+        try:
+            addresses.append(str(ipaddress.ip_address(name)))
+            continue
+        except ValueError:
+            pass
+        found = _ipv4_addresses(name) + _ipv6_addresses(name)
+        if not found:
+            logger.warning(f"No IP address on interface {name}")
+        addresses.extend(found)
+    return addresses
+
+
+def _ipv4_addresses(name):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        try:
+            request = struct.pack('256s', name.encode()[:15])
+            return [socket.inet_ntoa(fcntl.ioctl(sock.fileno(), SIOCGIFADDR, request)[20:24])]
+        except OSError:
+            return []
+
+
+def _ipv6_addresses(name):
+    try:
+        with open('/proc/net/if_inet6') as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return []
+    # address, index, prefix length, scope, flags, interface name
+    return [str(ipaddress.IPv6Address(bytes.fromhex(fields[0])))
+            for fields in (line.split() for line in lines) if fields[-1] == name]
+
+
+def set_loss_recovery(transceiver, rtx=False, fec_percentage=None):
+    """Negotiate NACK/RTX and, with a percentage, ULPFEC in RED on a transceiver.
+
+    Has to happen before the offer or answer is created. GStreamer older
+    than 1.20 lacks the properties and keeps recovering by keyframe.
+    """
+    if rtx and transceiver.find_property('do-nack'):
+        transceiver.set_property('do-nack', True)
+    if fec_percentage is not None and transceiver.find_property('fec-type'):
+        transceiver.set_property('fec-type', GstWebRTC.WebRTCFECType.ULP_RED)
+        transceiver.set_property('fec-percentage', fec_percentage)
+
+
+def candidate_address(candidate):
+    """Connection address of an ICE candidate or SDP 'a=candidate:' line."""
+    fields = candidate.split()
+    return fields[4] if len(fields) > 4 else None
+
+
+class Branch:
+    """One video track of a session: tee pad -> queue [-> payloader] -> webrtcbin."""
+
+    def __init__(self, layer, queue, payloader=None):
+        self.layer = layer
+        self.queue = queue
+        self.payloader = payloader
+        self.tee_pad = None
+
+    def link(self, tee):
+        self.tee_pad = request_pad(tee, 'src_%u')
+        self.tee_pad.link(self.queue.get_static_pad('sink'))
+
+    def unlink(self):
+        # Only once the tee pad is idle, so no buffer is in flight
+        self.tee_pad.unlink(self.queue.get_static_pad('sink'))
+
+    def release(self):
+        if self.tee_pad:
+            self.tee_pad.get_parent_element().release_request_pad(self.tee_pad)
+            self.tee_pad = None
+
+
+class StreamSession:
+    """One client peer connection attached to the shared capture tee.
+
+    `send` is called with signaling messages (dicts) from GStreamer threads and
+    must be thread-safe. `on_closed` is called with the session once ICE fails
+    or disconnects. With a simulcast capture the session has its own RTP
+    payloader and can move between layers with `set_layer()`; with one layer
+    per monitor it can take several of them as separate tracks.
+
+    With `trickle=False` the offer is held back until ICE gathering is done
+    (or `gather_timeout` runs out) and goes out with every candidate in its
+    SDP, so no 'ice-candidate' messages follow. `interfaces` (names or
+    addresses) limits the candidates to those interfaces.
+
+    `rtx` has lost packets retransmitted on NACK, and `fec` (a percentage,
+    changed later with `set_fec_percentage()`) adds ULPFEC, so most Wi-Fi
+    losses are repaired without a keyframe.
+    """
+
+    def __init__(self, session_id, send, on_closed=None, stun_server=DEFAULT_STUN_SERVER,
+                 trickle=True, interfaces=None, gather_timeout=2.0, rtx=False, fec=None):
+        self.session_id = session_id
+        self.send = send
+        self.on_closed = on_closed
+        self.stun_server = stun_server
+        self.trickle = trickle
+        self.interfaces = interfaces
+        self.addresses = None
+        self.gather_timeout = gather_timeout
+        self.offer_lock = threading.Lock()
+        self.offer_pending = False
+        self.rtx = rtx
+        self.fec_percentage = fec
+        self.transceivers = []
+        self.webrtcbin = None
+        self.branches = []
+        self.pending_branches = 0
+        self.data_channel = None
+        self.capture = None
+        self.switching = False
+        self.closed = False
+
+    @property
+    def layer(self):
+        return self.branches[0].layer if self.branches else 0
+
+    @property
+    def layers(self):
+        return [branch.layer for branch in self.branches]
+
+    @property
+    def repairs_loss(self):
+        return self.rtx or self.fec_percentage is not None
+
+    def attach(self, capture, layers=(0,)):
+        """Attach one track per capture layer index in `layers`."""
+        self.capture = capture
+        pipeline = capture.pipeline
+
+        self.webrtcbin = make_element("webrtcbin", f"webrtcbin_{self.session_id}")
+        self.webrtcbin.set_property("bundle-policy", "max-bundle")
+        if self.stun_server:
+            self.webrtcbin.set_property("stun-server", self.stun_server)
+        if self.interfaces:
+            self.addresses = set(interface_addresses(self.interfaces))
+            self.restrict_gathering()
+        pipeline.add(self.webrtcbin)
+
+        self.webrtcbin.connect('on-ice-candidate', self.on_ice_candidate)
+        self.webrtcbin.connect('notify::ice-gathering-state', self.on_ice_gathering_state_notify)
+        self.webrtcbin.connect('on-negotiation-needed', self.on_negotiation_needed)
+        self.webrtcbin.connect('on-data-channel', self.on_data_channel)
+        self.webrtcbin.connect('notify::ice-connection-state', self.on_ice_connection_state_notify)
+
+        # The tee only pushes caps with the next buffer; hand them to the
+        # transceiver up front so create-offer does not have to wait for them.
+        caps = capture.payload_caps()
+
+        for track, layer in enumerate(layers):
+            suffix = f"{self.session_id}_{track}" if track else f"{self.session_id}"
+            # Leaky per-peer queue so a slow peer can never stall the encoder
+            queue = make_element("queue", f"queue_{suffix}", max_size_buffers=2)
+            queue.set_property("leaky", 2)
+            payloader = None
+            if capture.simulcast:
+                # Layers are tees of the encoded stream; payloading here keeps this
+                # peer's RTP stream continuous across layer switches
+                payloader = capture.encoder_spec.make_payloader(f"pay_{suffix}")
+            branch = Branch(layer, queue, payloader)
+            self.branches.append(branch)
+
+            elements = [elem for elem in (queue, payloader) if elem]
+            for elem in elements:
+                pipeline.add(elem)
+            # Each link requests a new sink pad, i.e. a new transceiver/m-line
+            link_many(*elements, self.webrtcbin)
+
+            transceiver = self.webrtcbin.emit('get-transceiver', track)
+            if transceiver:
+                if caps:
+                    transceiver.set_property('codec-preferences', caps)
+                set_loss_recovery(transceiver, self.rtx, self.fec_percentage)
+                self.transceivers.append(transceiver)
+
+        self.webrtcbin.sync_state_with_parent()
+        for branch in self.branches:
+            for elem in (branch.payloader, branch.queue):
+                if elem:
+                    elem.sync_state_with_parent()
+            branch.link(capture.layers[branch.layer].tee)
+            capture.refresh(branch.layer)
+
+        self.data_channel = self.webrtcbin.emit('create-data-channel', 'cursor', None)
+        logger.info(f"Session {self.session_id} attached ({len(self.branches)} track(s))")
+
+    def detach(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.switching:
+            # _finish_switch completes the detach once the old branch is released
+            return
+
+        def remove_branch(pad, info, branch):
+            branch.unlink()
+            GLib.idle_add(self._release_branch, branch)
+            return Gst.PadProbeReturn.REMOVE
+
+        linked = [branch for branch in self.branches if branch.tee_pad]
+        self.pending_branches = len(linked)
+        if not linked:
+            self._finish_detach()
+        for branch in linked:
+            branch.tee_pad.add_probe(Gst.PadProbeType.IDLE, remove_branch, branch)
+
+    def _release_branch(self, branch):
+        branch.release()
+        self.pending_branches -= 1
+        if self.pending_branches == 0:
+            self._finish_detach()
+        return False
+
+    def _finish_detach(self):
+        pipeline = self.capture.pipeline
+        elements = [self.webrtcbin]
+        for branch in self.branches:
+            elements.extend([branch.payloader, branch.queue])
+        for elem in elements:
+            if elem:
+                elem.set_state(Gst.State.NULL)
+                pipeline.remove(elem)
+        self.data_channel = None
+        logger.info(f"Session {self.session_id} detached")
+        return False
+
+    def set_layer(self, index):
+        """Move to simulcast layer `index` (0 is full resolution)."""
+        branch = self.branches[0] if self.branches else None
+        if branch is None or index == branch.layer or self.closed or self.switching or branch.tee_pad is None:
+            return
+        self.switching = True
+
+        def relink(pad, info):
+            # Same idle handoff as detach(): nothing is in flight on the old branch
+            branch.unlink()
+            GLib.idle_add(self._finish_switch, branch, index)
+            return Gst.PadProbeReturn.REMOVE
+
+        branch.tee_pad.add_probe(Gst.PadProbeType.IDLE, relink)
+
+    def _finish_switch(self, branch, index):
+        branch.release()
+        self.switching = False
+        if self.closed:
+            return self._finish_detach()
+        branch.link(self.capture.layers[index].tee)
+        logger.info(f"Session {self.session_id} moved from layer {branch.layer} to {index}")
+        branch.layer = index
+        # The new layer's stream is only decodable from its next keyframe
+        self.capture.refresh(index)
+        return False
+
+    def set_fec_percentage(self, percentage):
+        """Change the FEC overhead of a session negotiated with `fec`."""
+        if self.fec_percentage is None or percentage == self.fec_percentage:
+            return
+        logger.info(f"Session {self.session_id}: FEC {self.fec_percentage}% -> {percentage}%")
+        self.fec_percentage = percentage
+        for transceiver in self.transceivers:
+            if transceiver.find_property('fec-percentage'):
+                transceiver.set_property('fec-percentage', percentage)
+
+    def create_offer(self):
+        promise = Gst.Promise.new_with_change_func(self.on_offer_created, None, None)
+        self.webrtcbin.emit('create-offer', None, promise)
+
+    async def negotiate(self, loop):
+        """create_offer() for asyncio callers: the offer is handled on `loop`."""
+        reply = await promise_reply(loop, lambda promise: self.webrtcbin.emit('create-offer', None, promise))
+        self.offer_created(reply)
+
+    def on_offer_created(self, promise, *args):
+        # The change func only runs once the promise has its reply
+        self.offer_created(promise.get_reply())
+
+    def offer_created(self, reply):
+        if not reply:
+            logger.error("Failed to create offer")
+            return
+        offer = reply.get_value('offer')
+        if not self.trickle:
+            with self.offer_lock:
+                self.offer_pending = True
+            GLib.timeout_add(int(self.gather_timeout * 1000), self.send_gathered_offer)
+        promise = Gst.Promise.new_with_change_func(self.on_local_description_set, None, None)
+        self.webrtcbin.emit('set-local-description', offer, promise)
+        if not self.trickle:
+            return
+
+        sdp = offer.sdp.as_text()
+        logger.info("Sending offer")
+        self.send({'type': 'offer', 'sdp': sdp})
+
+    def handle_offer(self, sdp):
+        res, sdp_msg = GstSdp.SDPMessage.new_from_text(sdp)
+        offer = GstWebRTC.WebRTCSessionDescription.new(GstWebRTC.WebRTCSDPType.OFFER, sdp_msg)
+        self.webrtcbin.emit('set-remote-description', offer, None)
+
+    def handle_answer(self, sdp):
+        res, sdp_msg = GstSdp.SDPMessage.new_from_text(sdp)
+        answer = GstWebRTC.WebRTCSessionDescription.new(GstWebRTC.WebRTCSDPType.ANSWER, sdp_msg)
+        promise = Gst.Promise.new_with_change_func(self.on_remote_description_set, None, None)
+        self.webrtcbin.emit('set-remote-description', answer, promise)
+
+    def on_local_description_set(self, promise, *args):
+        reply = promise.get_reply()
+        if reply:
+            logger.info("Local description set")
+        else:
+            logger.error("Failed to set local description")
+
+    def on_remote_description_set(self, promise, *args):
+        reply = promise.get_reply()
+        if reply:
+            logger.info("Remote description set")
+        else:
+            logger.error("Failed to set remote description")
+
+    def handle_ice_candidate(self, candidate, sdp_mid, sdp_mline_index):
+        # Try with 3 args first, if fails, try with 2 (older GStreamer)
+        try:
+            self.webrtcbin.emit('add-ice-candidate', sdp_mline_index, sdp_mid, candidate)
+        except TypeError:
+            self.webrtcbin.emit('add-ice-candidate', sdp_mline_index, candidate)
+
+    def send_gathered_offer(self):
+        """Send the held back offer with the candidates gathered so far."""
+        with self.offer_lock:
+            if not self.offer_pending:
+                return False
+            self.offer_pending = False
+        if self.webrtcbin.get_property('ice-gathering-state') != GstWebRTC.WebRTCICEGatheringState.COMPLETE:
+            logger.warning("ICE gathering not complete, sending the offer with the candidates so far")
+        sdp = self.webrtcbin.get_property('local-description').sdp.as_text()
+        if self.addresses is not None:
+            sdp = '\r\n'.join(line for line in sdp.split('\r\n')
+                              if not line.startswith('a=candidate:') or candidate_address(line) in self.addresses)
+        logger.info("Sending offer with all ICE candidates")
+        self.send({'type': 'offer', 'sdp': sdp})
+        return False
+
+    def restrict_gathering(self):
+        """Have libnice only gather on `addresses`; candidates are filtered either way."""
+        ice = self.webrtcbin.get_property('ice-agent') if self.webrtcbin.find_property('ice-agent') else None
+        agent = ice.get_property('agent') if ice and ice.find_property('agent') else None
+        if agent is None:
+            return False
+        try:
+            gi.require_version('Nice', '0.1')
+            from gi.repository import Nice
+        except (ValueError, ImportError):
+            return False
+        for address in self.addresses:
+            nice_address = Nice.Address.new()
+            nice_address.set_from_string(address)
+            agent.add_local_address(nice_address)
+        return True
+
+    def on_ice_gathering_state_notify(self, webrtcbin, pspec):
+        state = webrtcbin.get_property('ice-gathering-state')
+        logger.info(f"ICE gathering state changed to: {state}")
+        if state == GstWebRTC.WebRTCICEGatheringState.COMPLETE and not self.trickle:
+            GLib.idle_add(self.send_gathered_offer)
+
+    def on_ice_candidate(self, _, mline_index, candidate):
+        if self.addresses is not None and candidate_address(candidate) not in self.addresses:
+            logger.info(f"Skipping ICE candidate on {candidate_address(candidate)}")
+            return
+        if not self.trickle:
+            # Goes out inside the offer
+            return
+        logger.info("Sending ICE candidate")
+        self.send({
+            'type': 'ice-candidate',
+            'candidate': candidate,
+            'sdpMid': "video0", # Assuming video0 for now
+            'sdpMLineIndex': mline_index
+        })
+
+    def on_ice_connection_state_notify(self, webrtcbin, pspec):
+        state = webrtcbin.get_property("ice-connection-state")
+        logger.info(f"ICE connection state changed to: {state}")
+        if state in [GstWebRTC.WebRTCICEConnectionState.FAILED,
+                     GstWebRTC.WebRTCICEConnectionState.CLOSED,
+                     GstWebRTC.WebRTCICEConnectionState.DISCONNECTED]:
+            if self.on_closed and not self.closed:
+                self.on_closed(self)
+
+    def on_negotiation_needed(self, element):
+        logger.info("Negotiation needed")
+
+    def on_data_channel(self, webrtc, channel):
+        logger.info(f"Data channel created: {channel.get_property('label')}")
+        self.data_channel = channel
+
+    def data_channel_open(self):
+        return (self.data_channel is not None and
+                self.data_channel.get_property('ready-state') == GstWebRTC.WebRTCDataChannelState.OPEN)
+
+    def send_data(self, data):
+        if self.data_channel_open():
+            self.data_channel.emit('send-data', GLib.Bytes.new(data))
+            return True
+        return False
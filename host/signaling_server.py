@@ -3,22 +3,154 @@ import asyncio
 import json
 import logging
 import socket
-from aiohttp import web
+
+from options import add_signaling_arguments, signaling_options
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+class Connection:
+    """One websocket with a bounded queue of outgoing messages.
+
+    `send()` only enqueues and a writer task drains the queue, so relaying
+    to a slow peer never stalls the connection the message came from. When
+    the queue is full the message is dropped or the connection closed,
+    depending on `overflow`. ICE candidates are held for `batch_window`
+    seconds and go out together as one 'ice-candidates' message; any other
+    message for the same session flushes them first, so candidates never
+    arrive after the offer or answer that followed them.
+    """
+
+    def __init__(self, ws, max_queue=256, overflow='close', batch_window=0.01):
+        self.ws = ws
+        self.queue = asyncio.Queue(max_queue)
+        self.overflow = overflow
+        self.batch_window = batch_window
+        self.candidates = {} # session ID -> (candidates waiting to be batched, flush timer)
+        self.dropped = 0
+        self.writer = asyncio.create_task(self._write())
+
+    def send(self, message):
+        if message.get('type') == 'host_disconnected':
+            # Candidates of a connection that is gone are of no use
+            for session_id in list(self.candidates):
+                self.discard_candidates(session_id)
+        elif message.get('type') == 'client_disconnected':
+            self.discard_candidates(message.get('session'))
+        elif message.get('session') in self.candidates:
+            self._flush_candidates(message.get('session'))
+        return self._enqueue(message)
+
+    def _enqueue(self, message):
+        if self.ws.closed:
+            return False
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            if self.overflow == 'drop':
+                self.dropped += 1
+                logger.warning(f"Send queue full, dropped {message.get('type')} ({self.dropped} so far)")
+            else:
+                logger.warning("Send queue full, closing the slow connection")
+                asyncio.create_task(self.ws.close())
+            return False
+        return True
+
+    def send_candidate(self, message):
+        if not self.batch_window:
+            return self.send(message)
+        session_id = message.get('session')
+        if session_id not in self.candidates:
+            timer = asyncio.get_running_loop().call_later(self.batch_window, self._flush_candidates, session_id)
+            self.candidates[session_id] = ([], timer)
+        self.candidates[session_id][0].append(
+            {key: message.get(key) for key in ('candidate', 'sdpMid', 'sdpMLineIndex')})
+        return True
+
+    def discard_candidates(self, session_id):
+        batch, timer = self.candidates.pop(session_id, ([], None))
+        if timer:
+            timer.cancel()
+        return batch
+
+    def _flush_candidates(self, session_id):
+        batch = self.discard_candidates(session_id)
+        if not batch:
+            return
+        if len(batch) == 1:
+            # A lone candidate keeps the single-candidate form
+            message = {'type': 'ice-candidate', **batch[0]}
+        else:
+            message = {'type': 'ice-candidates', 'candidates': batch}
+        if session_id is not None:
+            message['session'] = session_id
+        self._enqueue(message)
+
+    async def _write(self):
+        while True:
+            message = await self.queue.get()
+            try:
+                await self.ws.send_str(json.dumps(message))
+            except Exception as e:
+                logger.info(f"Stopped sending on a closed connection: {e}")
+                return
+
+    async def close(self):
+        for session_id in list(self.candidates):
+            self.discard_candidates(session_id)
+        self.writer.cancel()
+        await self.ws.close()
+
+
+class Room:
+    """One host and the clients watching it."""
+
+    def __init__(self, name):
+        self.name = name
+        self.host = None
+        self.clients = {} # session ID -> client Connection
+        self.announcements = {} # session ID -> client_connected for the host
+
+    def empty(self):
+        return self.host is None and not self.clients
+
+
 class SignalingServer:
-    def __init__(self):
-        self.host_ws = None
-        self.client_ws = None
+    """Routes signaling between hosts and clients, in rooms.
+
+    Each room (named in the 'register' message, 'default' if absent) holds
+    one host and any number of clients. Each client gets a session ID when
+    it registers. Messages from a client are forwarded to its room's host
+    tagged with its `session`, and the host tags its replies with the
+    `session` they are meant for.
+
+    Websocket pings every `heartbeat` seconds close connections that
+    stopped answering, so a vanished headset or host is noticed.
+    """
+
+    def __init__(self, max_queue=256, overflow='close', heartbeat=10.0, batch_window=0.01):
+        self.rooms = {}
+        self.next_session = 1
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.heartbeat = heartbeat
+        self.batch_window = batch_window
+
+    def room(self, name):
+        if name not in self.rooms:
+            self.rooms[name] = Room(name)
+        return self.rooms[name]
 
     async def handle_websocket(self, request):
-        ws = web.WebSocketResponse()
+        from aiohttp import web
+        ws = web.WebSocketResponse(heartbeat=self.heartbeat)
         await ws.prepare(request)
+        conn = Connection(ws, max_queue=self.max_queue, overflow=self.overflow, batch_window=self.batch_window)
 
         peer_type = "unknown"
+        session_id = None
+        room = None
         
         try:
             async for msg in ws:
@@ -26,35 +158,55 @@ class SignalingServer:
                     data = json.loads(msg.data)
                     msg_type = data.get('type')
                     
-                    if msg_type == 'register':
+                    if msg_type == 'register' and room is None:
                         role = data.get('role')
+                        room = self.room(str(data.get('room', 'default')))
+                        reply = {'type': 'registered', 'role': role, 'room': room.name}
                         if role == 'host':
-                            self.host_ws = ws
+                            if room.host:
+                                logger.warning(f"Room {room.name}: new host replaces the old one")
+                            room.host = conn
                             peer_type = "host"
-                            logger.info("Host registered")
+                            logger.info(f"Room {room.name}: host registered")
+                            # Clients that came first are still waiting for an offer
+                            for announcement in room.announcements.values():
+                                conn.send(announcement)
                         elif role == 'client':
-                            self.client_ws = ws
+                            session_id = self.next_session
+                            self.next_session += 1
+                            room.clients[session_id] = conn
                             peer_type = "client"
-                            logger.info("Client registered")
+                            reply['session'] = session_id
+                            logger.info(f"Room {room.name}: client registered as session {session_id} "
+                                        f"({len(room.clients)} connected)")
+                            room.announcements[session_id] = {
+                                'type': 'client_connected',
+                                'session': session_id,
+                                'width': data.get('width', 1920),
+                                'height': data.get('height', 1080),
+                                # Monitors the client wants, when the host streams several
+                                'outputs': data.get('outputs')
+                            }
                             # Notify host that a client connected
-                            if self.host_ws:
-                                width = data.get('width', 1920)
-                                height = data.get('height', 1080)
-                                await self.host_ws.send_json({
-                                    'type': 'client_connected',
-                                    'width': width,
-                                    'height': height
-                                })
+                            if room.host:
+                                room.host.send(room.announcements[session_id])
                         
-                        await ws.send_json({'type': 'registered', 'role': role})
+                        conn.send(reply)
 
-                    elif msg_type in ['offer', 'answer', 'ice-candidate']:
-                        target_ws = self.client_ws if peer_type == 'host' else self.host_ws
-                        if target_ws:
-                            logger.info(f"Forwarding {msg_type} from {peer_type}")
-                            await target_ws.send_str(msg.data)
+                    elif msg_type in ['offer', 'answer', 'ice-candidate', 'ice-candidates'] and room:
+                        if peer_type == 'host':
+                            target = room.clients.get(data.get('session'))
                         else:
+                            target = room.host
+                            data['session'] = session_id
+                        if target is None:
                             logger.warning(f"Cannot forward {msg_type}: Target peer not connected")
+                        elif msg_type == 'ice-candidate':
+                            target.send_candidate(data)
+                        else:
+                            logger.info(f"Room {room.name}: forwarding {msg_type} from {peer_type} "
+                                        f"(session {data.get('session')})")
+                            target.send(data)
                     
                     else:
                         logger.warning(f"Unknown message type: {msg_type}")
@@ -63,23 +215,22 @@ class SignalingServer:
                     logger.error(f'Websocket connection closed with exception {ws.exception()}')
 
         finally:
-            if peer_type == 'host':
-                self.host_ws = None
-                logger.info("Host disconnected")
-                if self.client_ws:
-                    try:
-                        await self.client_ws.send_json({'type': 'host_disconnected'})
-                    except Exception as e:
-                        logger.error(f"Failed to notify client of host disconnection: {e}")
+            if peer_type == 'host' and room.host is conn:
+                room.host = None
+                logger.info(f"Room {room.name}: host disconnected")
+                for client in room.clients.values():
+                    client.send({'type': 'host_disconnected'})
 
             elif peer_type == 'client':
-                self.client_ws = None
-                logger.info("Client disconnected")
-                if self.host_ws:
-                    try:
-                        await self.host_ws.send_json({'type': 'client_disconnected'})
-                    except Exception as e:
-                        logger.error(f"Failed to notify host of client disconnection: {e}")
+                room.clients.pop(session_id, None)
+                room.announcements.pop(session_id, None)
+                logger.info(f"Room {room.name}: client session {session_id} disconnected")
+                if room.host:
+                    room.host.send({'type': 'client_disconnected', 'session': session_id})
+
+            if room and room.empty():
+                del self.rooms[room.name]
+            await conn.close()
             
         return ws
 
@@ -95,18 +246,20 @@ def get_local_ip():
         s.close()
     return IP
 
-async def main():
-    parser = argparse.ArgumentParser(description="WebRTC Signaling Server")
-    parser.add_argument('--port', type=int, default=8080, help="Port to listen on")
-    args = parser.parse_args()
+async def start_server(port, host='0.0.0.0', **options):
+    """Serve /ws on `port` from the running event loop; returns the AppRunner to clean up.
 
-    server = SignalingServer()
+    `options` are SignalingServer settings. aiohttp is only imported
+    here, so `--help` and argument errors do not wait for it.
+    """
+    from aiohttp import web
+    server = SignalingServer(**options)
     app = web.Application()
     app.router.add_get('/ws', server.handle_websocket)
 
     runner = web.AppRunner(app)
     await runner.setup()
-    site = web.TCPSite(runner, '0.0.0.0', args.port)
+    site = web.TCPSite(runner, host, port)
     await site.start()
     
     local_ip = get_local_ip()
@@ -114,10 +267,21 @@ async def main():
     print(f"Connect to: {local_ip}")
     print(f"{'='*40}\n")
     
-    logger.info(f"Signaling server started on 0.0.0.0:{args.port}")
-    
-    # Keep the server running
-    await asyncio.Event().wait()
+    logger.info(f"Signaling server started on {host}:{port}")
+    return runner
+
+async def main():
+    parser = argparse.ArgumentParser(description="WebRTC Signaling Server")
+    parser.add_argument('--port', type=int, default=8080, help="Port to listen on")
+    add_signaling_arguments(parser)
+    args = parser.parse_args()
+
+    runner = await start_server(args.port, **signaling_options(args))
+    try:
+        # Keep the server running
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
 
 if __name__ == '__main__':
     try:
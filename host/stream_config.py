@@ -0,0 +1,11 @@
+"""Values shared by the GStreamer modules and the GStreamer-free option parser.
+
+encoders and pipeline import these, so options.py can offer the same
+choices without loading GStreamer.
+"""
+
+# Names of encoders.ENCODERS, fastest first
+ENCODER_NAMES = ('vaapi', 'nvenc', 'x264', 'openh264', 'vp8')
+
+# Simulcast layers as fractions of the captured resolution (and of the bitrate)
+SIMULCAST_SCALES = (1.0, 0.5, 0.25)
@@ -1,53 +1,147 @@
 import argparse
 import asyncio
+import functools
 import json
 import logging
+import os
+import signal
 import sys
 import time
-import threading
-import struct
-import os
 
-from pynput import mouse
+from options import add_streamer_arguments, streamer_options
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="WebRTC Host Streamer")
+    add_streamer_arguments(parser)
+    args = parser.parse_args()
+    return args, streamer_options(parser, args)
+
+
+if __name__ == '__main__':
+    # Before GStreamer, aiohttp and the host modules load, so --help and
+    # argument errors come back at once
+    ARGS, OPTIONS = parse_arguments()
 
 import gi
 gi.require_version('Gst', '1.0')
-gi.require_version('GstWebRTC', '1.0')
-gi.require_version('GstSdp', '1.0')
 try:
     gi.require_version('Gdk', '3.0')
 except ValueError:
     pass # Might be already loaded or not needed if Gtk is used
-from gi.repository import Gst, GstWebRTC, GstSdp, GLib, Gdk
+# Gdk and pynput are imported where used: both connect to $DISPLAY when
+# loaded, which a virtual display only sets in start(), and cost startup time
+from gi.repository import Gst, GLib
 
 from aiohttp import ClientSession
-from display_manager import DisplayManager
+from display_manager import DisplayManager, list_outputs
+from encoders import select_encoder
+from glib_loop import GLibThread, call_soon, integrated, loop_thread, use_glib_loop
+from adaptive_bitrate import AdaptiveBitrate
+from rate_control import FecController
+from capture_region import FocusTracker, WindowTracker, even_region
+from connection_setup import ConnectionSetup, SignalWaiter
+from cursor import CursorSender, CursorShapeTracker
+from metrics import LatencyTracer, MetricsExporter
+from pipeline import SIMULCAST_SCALES, CapturePipeline, PipelineBuildError, x_screen_size
+from pipeline_cache import PipelineCache
+from roi import RoiTagger
+from session import StreamSession
+from virtual_display import VirtualDisplay
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 class WebRTCStreamer:
-    def __init__(self, signaling_url):
+    def __init__(self, signaling_url, encoder='auto', damage=False,
+                 min_bitrate=2000, max_bitrate=30000, adaptive=True, adapt_framerate=False,
+                 keyframe_interval=300, metrics_port=None, metrics_log=None, zero_copy=True,
+                 scale_mode='xrandr', convert_threads=None, cursor_rate=30, cursor_shapes=True,
+                 simulcast=1, xid=None, region=None, outputs=None, display_backend='auto',
+                 virtual_display=None, virtual_max_size=(3840, 2160), standby_pipelines=2, room='default',
+                 lan=False, ice_interfaces=None, rtx=True, fec=None, screen_content=False):
         self.signaling_url = signaling_url
+        self.room = room
+        # Loss repair instead of keyframes; 'adaptive' FEC starts here and follows the loss
+        self.session_options = dict(rtx=rtx, fec=FecController.START_PERCENTAGE if fec == 'adaptive' else fec)
+        if lan:
+            # LAN fast path: no STUN round trips, every candidate in the offer
+            self.session_options.update(stun_server=None, trickle=False)
+        if ice_interfaces:
+            self.session_options['interfaces'] = ice_interfaces
+        self.encoder_name = encoder
+        self.scale_mode = scale_mode
+        # Monitors encoded as separate tracks; None streams the whole screen as one
+        self.outputs = self.select_outputs(outputs) if outputs else None
+        # A private X server ('new' spawns Xvfb, ':N' attaches) resized to each
+        # client instead of rescaling the physical monitor
+        self.virtual_display = None
+        if virtual_display:
+            self.virtual_display = VirtualDisplay(None if virtual_display == 'new' else virtual_display,
+                                                  max_size=virtual_max_size)
+        self.framerate = 30
+        # Every standby pipeline is built with these
+        self.capture_options = dict(damage=damage, bitrate=max_bitrate, framerate=self.framerate,
+                                    keyframe_interval=keyframe_interval,
+                                    zero_copy=zero_copy, convert_threads=convert_threads,
+                                    scale=scale_mode == 'pipeline', layers=SIMULCAST_SCALES[:simulcast],
+                                    xid=xid, region=region, outputs=self.outputs)
+        self.capture = CapturePipeline(**self.capture_options)
+        self.encoder_spec = None
+        self.standby_pipelines = standby_pipelines
+        self.pipelines = None
+        self.region = region
+        self.window_tracker = None
+        # Region-of-interest encoding around the pointer and focused window
+        self.screen_content = screen_content
+        self.focus_tracker = None
+        self.roi_tagger = None
+        if xid:
+            self.window_tracker = WindowTracker(xid, on_resize=self.on_window_resize)
+        self.latency_tracer = LatencyTracer()
+        self.metrics = None
+        if metrics_port or metrics_log:
+            self.metrics = MetricsExporter(self.latency_tracer, port=metrics_port, log_path=metrics_log)
+        self.adaptive_bitrate = None
+        if adaptive:
+            self.adaptive_bitrate = AdaptiveBitrate(self.capture, self.live_sessions,
+                                                    min_bitrate=min_bitrate, max_bitrate=max_bitrate,
+                                                    adapt_framerate=adapt_framerate, adapt_fec=fec == 'adaptive')
         self.pipeline = None
-        self.webrtcbin = None
+        # One StreamSession per viewer, keyed by signaling session ID; all of
+        # them hang off the same capture tee, so adding one never re-encodes.
+        self.peers = {}
+        self.current_mode = None
+        self.setup_tasks = {}
+        self.capture_ready = None # Resolved once the first viewer's mode switch picked a capture
+        self.setup_timeout = 5.0
         self.session = None
         self.ws = None
         self.loop = asyncio.get_event_loop()
-        self.glib_loop = GLib.MainLoop()
+        # Only when the asyncio loop does not run GLib itself
+        self.glib_thread = None
         self.frame_count = 0
         self.last_time = time.time()
-        self.data_channel = None
         self.mouse_listener = None
-        self.cursor_packet_count = 0
-        self.display_manager = DisplayManager()
-        self.running = True
-        
-        # Get screen resolution for normalization
-        self.update_screen_resolution()
+        self.cursor_shapes = CursorShapeTracker() if cursor_shapes else None
+        self.cursor_sender = CursorSender(self.live_sessions, self.capture_regions, rate=cursor_rate,
+                                          shapes=self.cursor_shapes)
+        self.display_backend = display_backend
+        self.display_manager = None
+        # Set by bus errors, a lost signaling connection or SIGTERM
+        self.stopped = asyncio.Event()
+        self.exit_code = 0
+        # Screen resolution for normalization, read in start()
+        self.screen_width = None
+        self.screen_height = None
 
     def update_screen_resolution(self):
+        if self.virtual_display:
+            self.screen_width, self.screen_height = x_screen_size(self.virtual_display.name)
+            logger.info(f"Screen resolution: {self.screen_width}x{self.screen_height}")
+            return
+        from gi.repository import Gdk
         display = Gdk.Display.get_default()
         monitor = display.get_primary_monitor()
         geometry = monitor.get_geometry()
@@ -55,14 +149,12 @@ class WebRTCStreamer:
         self.screen_height = geometry.height
         logger.info(f"Screen resolution: {self.screen_width}x{self.screen_height}")
 
-    def start_glib_loop(self):
-        self.glib_loop.run()
-
     async def connect_signaling(self):
         self.session = ClientSession()
         try:
-            self.ws = await self.session.ws_connect(self.signaling_url)
-            await self.ws.send_json({'type': 'register', 'role': 'host'})
+            # Pings notice a signaling server that went away without closing
+            self.ws = await self.session.ws_connect(self.signaling_url, heartbeat=10.0)
+            await self.ws.send_json({'type': 'register', 'role': 'host', 'room': self.room})
             logger.info("Connected to signaling server")
             asyncio.create_task(self.handle_messages())
         except Exception as e:
@@ -75,258 +167,325 @@ class WebRTCStreamer:
                 data = json.loads(msg.data)
                 msg_type = data.get('type')
                 
+                session_id = data.get('session')
+                peer = self.peers.get(session_id)
+                
                 if msg_type == 'offer':
-                    logger.info("Received offer")
-                    self.handle_offer(data['sdp'])
+                    logger.info(f"Received offer (session {session_id})")
+                    if peer:
+                        peer.handle_offer(data['sdp'])
                 elif msg_type == 'answer':
-                    logger.info("Received answer")
-                    self.handle_answer(data['sdp'])
+                    logger.info(f"Received answer (session {session_id})")
+                    if peer:
+                        peer.handle_answer(data['sdp'])
                 elif msg_type == 'ice-candidate':
-                    logger.info("Received ICE candidate")
-                    self.handle_ice_candidate(data['candidate'], data['sdpMid'], data['sdpMLineIndex'])
+                    logger.info(f"Received ICE candidate (session {session_id})")
+                    if peer:
+                        peer.handle_ice_candidate(data['candidate'], data['sdpMid'], data['sdpMLineIndex'])
+                elif msg_type == 'ice-candidates':
+                    logger.info(f"Received {len(data['candidates'])} ICE candidates (session {session_id})")
+                    if peer:
+                        for candidate in data['candidates']:
+                            peer.handle_ice_candidate(candidate['candidate'], candidate['sdpMid'],
+                                                      candidate['sdpMLineIndex'])
                 elif msg_type == 'registered':
-                    logger.info("Registered as host.")
+                    logger.info(f"Registered as host in room {data.get('room', self.room)}.")
                 elif msg_type == 'client_connected':
                     width = data.get('width', 1920)
                     height = data.get('height', 1080)
-                    logger.info(f"Client connected. Switching resolution to {width}x{height} and creating offer...")
-                    
-                    # Switch resolution
-                    if self.display_manager.create_and_set_mode(width, height):
-                        # Give X11 a moment to settle?
-                        time.sleep(2) # Increased sleep time
-                        self.update_screen_resolution()
-                    
-                    # We might need to restart the pipeline or at least ximagesrc to pick up the new resolution?
-                    # ximagesrc usually adapts, but let's see.
-                    # If the pipeline was already running (it is, in PLAYING state), changing resolution might cause error.
-                    # We should probably pause/stop pipeline, change resolution, then restart/resume.
-                    
-                    self.pipeline.set_state(Gst.State.NULL)
-                    time.sleep(0.5)
-                    self.pipeline.set_state(Gst.State.PLAYING)
-                    
-                    # Re-create data channel since we restarted pipeline? 
-                    # Actually webrtcbin is reset too.
-                    # We need to wait for it to be ready again?
-                    # But we are about to create an offer.
-                    
-                    # Wait a bit for pipeline to start up
-                    time.sleep(1)
-                    
-                    # Re-create data channel
-                    self.webrtcbin.emit('create-data-channel', 'cursor', None)
-
-                    promise = Gst.Promise.new_with_change_func(self.on_offer_created, None, None)
-                    self.webrtcbin.emit('create-offer', None, promise)
+                    layers = self.layers_for(data.get('outputs'))
+                    logger.info(f"Client {session_id} connected at {width}x{height}, creating offer...")
+
+                    # Should not happen with unique IDs, but never leak a branch
+                    self.cancel_setup(session_id)
+                    if peer:
+                        self.detach_peer(peer)
+
+                    # Only the first viewer picks the resolution; switching it
+                    # later would restart the capture under everyone else.
+                    # Viewers connecting meanwhile wait for the capture it
+                    # settles on instead of starting the one it replaces.
+                    switch_mode = None if self.peers or self.setup_tasks else self.switch_mode
+                    if switch_mode:
+                        self.capture_ready = self.loop.create_future()
+                    # Run as a task so answers and ICE candidates keep being
+                    # handled while the display switches.
+                    setup = ConnectionSetup(self.loop, lambda: self.capture,
+                                            functools.partial(self.attach_peer, session_id, layers),
+                                            switch_mode=switch_mode, timeout=self.setup_timeout,
+                                            acquire=self.acquire_capture, capture_ready=self.capture_ready)
+                    task = asyncio.create_task(setup.run(width, height))
+                    task.add_done_callback(lambda t, session_id=session_id: self.setup_done(session_id, t))
+                    if switch_mode:
+                        # Also when the setup is cancelled before it even starts
+                        task.add_done_callback(lambda t, ready=self.capture_ready: ready.done() or ready.set_result(None))
+                    self.setup_tasks[session_id] = task
 
                 elif msg_type == 'client_disconnected':
-                    logger.info("Client disconnected (signaling).")
-                    self.handle_client_disconnect()
-
-    def on_offer_created(self, promise, *args):
-        promise.wait()
-        reply = promise.get_reply()
-        if not reply:
-            logger.error("Failed to create offer")
-            return
-        offer = reply.get_value('offer')
-        promise = Gst.Promise.new_with_change_func(self.on_local_description_set, None, None)
-        self.webrtcbin.emit('set-local-description', offer, promise)
-        
-        sdp = offer.sdp.as_text()
-        logger.info("Sending offer")
-        asyncio.run_coroutine_threadsafe(
-            self.ws.send_json({'type': 'offer', 'sdp': sdp}),
-            self.loop
-        )
-
-    def handle_offer(self, sdp):
-        res, sdp_msg = GstSdp.SDPMessage.new_from_text(sdp)
-        offer = GstWebRTC.WebRTCSessionDescription.new(GstWebRTC.WebRTCSDPType.OFFER, sdp_msg)
-        self.webrtcbin.emit('set-remote-description', offer, None)
-
-    def handle_answer(self, sdp):
-        res, sdp_msg = GstSdp.SDPMessage.new_from_text(sdp)
-        answer = GstWebRTC.WebRTCSessionDescription.new(GstWebRTC.WebRTCSDPType.ANSWER, sdp_msg)
-        promise = Gst.Promise.new_with_change_func(self.on_remote_description_set, None, None)
-        self.webrtcbin.emit('set-remote-description', answer, promise)
-
-    def on_local_description_set(self, promise, *args):
-        promise.wait()
-        reply = promise.get_reply()
-        if reply:
-            logger.info("Local description set")
-        else:
-            logger.error("Failed to set local description")
+                    logger.info(f"Client {session_id} disconnected (signaling).")
+                    self.cancel_setup(session_id)
+                    if peer:
+                        self.detach_peer(peer)
+
+        logger.error("Signaling connection closed")
+        self.request_stop(1)
+
+    async def switch_mode(self, width, height):
+        """Switch the X framebuffer to width x height.
+
+        Returns True once the screen has actually changed size, i.e. when the
+        capture has to be restarted.
+        """
+        if (width, height) == self.current_mode:
+            return False
+
+        if self.window_tracker or self.region or self.outputs:
+            # A window, region or monitor streams at its own size; the client letterboxes it
+            return False
+
+        if self.virtual_display:
+            # Nobody looks at this screen locally, so resize it outright
+            switched = await self.loop.run_in_executor(None, self.virtual_display.resize, width, height)
+            if switched:
+                self.update_screen_resolution()
+            if (self.screen_width, self.screen_height) == (width, height):
+                self.current_mode = (width, height)
+            return switched
+
+        if self.scale_mode == 'pipeline':
+            # Keep the desktop at its native size and downscale the stream;
+            # never upscale past what the screen actually has.
+            self.current_mode = (width, height)
+            if width >= self.screen_width and height >= self.screen_height:
+                self.capture.set_output_size(None, None)
+            else:
+                self.capture.set_output_size(width, height)
+            return False
+
+        from gi.repository import Gdk
+        screen = Gdk.Screen.get_default()
+        if (screen.get_width(), screen.get_height()) == (width, height):
+            self.current_mode = (width, height)
+            return False
+
+        size_changed = SignalWaiter(self.loop, screen, 'size-changed')
+        switched = await self.loop.run_in_executor(
+            None, self.display_manager.create_and_set_mode, width, height)
+        if not switched:
+            size_changed.cancel()
+            return False
+
+        if not await size_changed.wait(self.setup_timeout):
+            logger.warning("No screen size change notification, continuing")
+        self.current_mode = (width, height)
+        self.update_screen_resolution()
+        return True
 
-    def on_remote_description_set(self, promise, *args):
-        promise.wait()
-        reply = promise.get_reply()
-        if reply:
-            logger.info("Remote description set")
+    def cancel_setup(self, session_id=None):
+        """Cancel the pending setup for `session_id`, or every one with None."""
+        session_ids = list(self.setup_tasks) if session_id is None else [session_id]
+        for session_id in session_ids:
+            task = self.setup_tasks.pop(session_id, None)
+            if task and not task.done():
+                task.cancel()
+
+    def setup_done(self, session_id, task):
+        if self.setup_tasks.get(session_id) is task:
+            del self.setup_tasks[session_id]
+        self.park_if_idle()
+
+    def park_if_idle(self):
+        # Nobody is watching: stop capturing and encoding until the next
+        # connect, which then only has to resume the pipeline
+        if not self.peers and not self.setup_tasks and self.capture.is_playing():
+            logger.info("No viewers, parking the capture pipeline")
+            self.capture.pause()
+
+    def send_signaling(self, message):
+        # Offers are sent from the event loop, ICE candidates from GStreamer threads
+        if loop_thread(self.loop):
+            self.loop.create_task(self.ws.send_json(message))
         else:
-            logger.error("Failed to set remote description")
-
-    def handle_ice_candidate(self, candidate, sdp_mid, sdp_mline_index):
-        # Try with 3 args first, if fails, try with 2 (older GStreamer)
-        try:
-            self.webrtcbin.emit('add-ice-candidate', sdp_mline_index, sdp_mid, candidate)
-        except TypeError:
-            self.webrtcbin.emit('add-ice-candidate', sdp_mline_index, candidate)
-
-    def on_ice_candidate(self, _, mline_index, candidate):
-        logger.info("Sending ICE candidate")
-        asyncio.run_coroutine_threadsafe(
-            self.ws.send_json({
-                'type': 'ice-candidate',
-                'candidate': candidate,
-                'sdpMid': "video0", # Assuming video0 for now
-                'sdpMLineIndex': mline_index
-            }),
-            self.loop
-        )
-
-    def on_ice_connection_state_notify(self, webrtcbin, pspec):
-        state = webrtcbin.get_property("ice-connection-state")
-        logger.info(f"ICE connection state changed to: {state}")
-        if state in [GstWebRTC.WebRTCICEConnectionState.FAILED, 
-                     GstWebRTC.WebRTCICEConnectionState.CLOSED,
-                     GstWebRTC.WebRTCICEConnectionState.DISCONNECTED]:
-             self.handle_client_disconnect()
-
-    def handle_client_disconnect(self):
-        logger.info("Client disconnected. Stopping streamer to trigger restart.")
-        self.running = False
-
-    def on_negotiation_needed(self, element):
-        logger.info("Negotiation needed")
-
-    def on_data_channel(self, webrtc, channel):
-        logger.info(f"Data channel created: {channel.get_property('label')}")
-        self.data_channel = channel
-        self.start_mouse_capture()
+            asyncio.run_coroutine_threadsafe(self.ws.send_json(message), self.loop)
+
+    def attach_peer(self, session_id, layers=(0,)):
+        def send(message):
+            message = {**message, 'session': session_id}
+            if message['type'] == 'offer' and self.outputs:
+                # Which monitor each video m-line carries, in order
+                message['outputs'] = [self.capture.layers[index].describe() for index in layers]
+            self.send_signaling(message)
+
+        peer = StreamSession(session_id, send, on_closed=self.handle_client_disconnect, **self.session_options)
+        self.peers[session_id] = peer
+        peer.attach(self.capture, layers)
+        logger.info(f"{len(self.peers)} viewer(s) attached")
+        return peer.negotiate(self.loop)
+
+    def live_sessions(self):
+        return list(self.peers.values())
+
+    def detach_peer(self, peer=None):
+        """Detach `peer`, or every peer with None."""
+        peers = self.live_sessions() if peer is None else [peer]
+        for peer in peers:
+            peer.detach()
+            if self.peers.get(peer.session_id) is peer:
+                del self.peers[peer.session_id]
+        self.park_if_idle()
+        return False
+
+    def handle_client_disconnect(self, peer):
+        logger.info(f"Client {peer.session_id} disconnected. Detaching peer.")
+        # Called from the webrtcbin ICE thread, which must not change its own state
+        self.loop.call_soon_threadsafe(self.detach_peer, peer)
 
     def start_mouse_capture(self):
         if self.mouse_listener:
             return
         
+        from pynput import mouse
         logger.info("Starting mouse capture")
-        self.mouse_listener = mouse.Listener(on_move=self.on_mouse_move)
+        self.mouse_listener = mouse.Listener(on_move=self.cursor_sender.on_move,
+                                             on_click=self.cursor_sender.on_click)
         self.mouse_listener.start()
+        self.cursor_sender.start()
 
-    def on_mouse_move(self, x, y):
-        if self.data_channel and self.data_channel.get_property('ready-state') == GstWebRTC.WebRTCDataChannelState.OPEN:
-            # Normalize coordinates
-            norm_x = x / self.screen_width
-            norm_y = y / self.screen_height
-            
-            # Send norm_x, norm_y as 4-byte floats (big endian)
-            data = struct.pack('>ff', float(norm_x), float(norm_y))
-            
-            # GStreamer Data Channel send_string or send_data?
-            # In python gi, it's often send_string for text, but for binary...
-            # We need to create a GBytes
-            gbytes = GLib.Bytes.new(data)
-            self.data_channel.emit('send-data', gbytes)
-            
-            self.cursor_packet_count += 1
-            if self.cursor_packet_count % 60 == 0:
-                # print(f"Sent cursor data: {x}, {y} ({norm_x:.2f}, {norm_y:.2f})")
-                pass
-
-    def build_pipeline(self):
-        self.pipeline = Gst.Pipeline.new("pipeline")
-
+    def start_cursor_shapes(self):
+        if not self.cursor_shapes:
+            return
         try:
-            ximagesrc = Gst.ElementFactory.make("ximagesrc", "ximagesrc0")
-            ximagesrc.set_property("use-damage", False) # Required for capturing the full screen
-
-            videoconvert = Gst.ElementFactory.make("videoconvert", "videoconvert0")
-            
-            # Add videorate to enforce stable framerate
-            videorate = Gst.ElementFactory.make("videorate", "videorate0")
-            
-            # Add capsfilter to ensure compatible format for VAAPI (NV12 is standard) and enforce 30fps
-            capsfilter = Gst.ElementFactory.make("capsfilter", "capsfilter0")
-            caps = Gst.Caps.from_string("video/x-raw,framerate=30/1") 
-            capsfilter.set_property("caps", caps)
-            
-            # Add vaapipostproc for hardware accelerated color conversion/scaling if possible
-            # This helps offload CPU from videoconvert
-            try:
-                vaapipostproc = Gst.ElementFactory.make("vaapipostproc", "vaapipostproc0")
-            except:
-                vaapipostproc = None
-                logger.warning("vaapipostproc not found, using software conversion only")
-
-            # Configure queue to be leaky to prevent freezing/buffering
-            queue = Gst.ElementFactory.make("queue", "queue0")
-            queue.set_property("max-size-buffers", 1)
-            queue.set_property("leaky", 2) # 2 = downstream (drop new buffers if full)
-
-            # Configure encoder for better quality
-            vaapih264enc = Gst.ElementFactory.make("vaapih264enc", "vaapih264enc0")
-            vaapih264enc.set_property("bitrate", 30000) # 30 Mbps for high quality
-            # vaapih264enc.set_property("rate-control", 2) # CBR
-            vaapih264enc.set_property("keyframe-period", 10) # Keyframe every 10 frames
-            
-            rtph264pay = Gst.ElementFactory.make("rtph264pay", "rtph264pay0")
-            rtph264pay.set_property("config-interval", 1) # Send SPS/PPS every keyframe
-            
-            self.webrtcbin = Gst.ElementFactory.make("webrtcbin", "sendrecv")
-            self.webrtcbin.set_property("bundle-policy", "max-bundle")
-            self.webrtcbin.set_property("stun-server", "stun://stun.l.google.com:19302")
-            
-            elements = [ximagesrc, videoconvert, videorate, capsfilter]
-            if vaapipostproc:
-                elements.append(vaapipostproc)
-            elements.extend([queue, vaapih264enc, rtph264pay, self.webrtcbin])
-
-            for elem in elements:
-                self.pipeline.add(elem)
-
-            if not ximagesrc.link(videoconvert):
-                logger.error("Failed to link ximagesrc to videoconvert")
-                return
-            if not videoconvert.link(videorate):
-                logger.error("Failed to link videoconvert to videorate")
-                return
-            if not videorate.link(capsfilter):
-                logger.error("Failed to link videorate to capsfilter")
-                return
-            
-            last_elem = capsfilter
-            if vaapipostproc:
-                if not capsfilter.link(vaapipostproc):
-                    logger.error("Failed to link capsfilter to vaapipostproc")
-                    return
-                last_elem = vaapipostproc
-            
-            if not last_elem.link(queue):
-                logger.error("Failed to link to queue")
-                return
-            if not queue.link(vaapih264enc):
-                logger.error("Failed to link queue to vaapih264enc")
-                return
-            if not vaapih264enc.link(rtph264pay):
-                logger.error("Failed to link vaapih264enc to rtph264pay")
-                return
-            rtph264pay.link(self.webrtcbin)
-
-        except (Exception, GLib.GError) as e:
+            self.cursor_shapes.start()
+        except Exception as e:
+            # Fall back to drawing the pointer into the video
+            logger.warning(f"Cursor shape streaming unavailable: {e}")
+            self.cursor_shapes = None
+            self.cursor_sender.shapes = None
+            return
+        # The client draws the streamed shape, so keep it out of the video
+        self.capture.show_pointer = False
+        self.capture_options['show_pointer'] = False
+
+    def screen_size(self):
+        return self.screen_width, self.screen_height
+
+    def capture_region(self):
+        """Captured (x, y, width, height) in screen coordinates."""
+        if self.window_tracker:
+            left, top, width, height = self.window_tracker.geometry()
+            if self.region:
+                x, y, width, height = even_region(*self.region)
+                return left + x, top + y, width, height
+            return even_region(left, top, width, height)
+        if self.region:
+            return even_region(*self.region)
+        return 0, 0, self.screen_width, self.screen_height
+
+    def capture_regions(self):
+        if self.outputs:
+            return [layer.crop for layer in self.capture.layers]
+        return [self.capture_region()]
+
+    @staticmethod
+    def select_outputs(spec):
+        """Outputs named in `spec` ('all' or a list of RandR output names)."""
+        available = list_outputs()
+        if spec == 'all':
+            selected = available
+        else:
+            by_name = {output.name: output for output in available}
+            missing = [name for name in spec if name not in by_name]
+            if missing:
+                raise ValueError(f"Unknown output(s) {', '.join(missing)}; "
+                                 f"connected: {', '.join(by_name)}")
+            selected = [by_name[name] for name in spec]
+        logger.info(f"Streaming outputs: {selected}")
+        return selected
+
+    def layers_for(self, names):
+        """Capture layers for the outputs a client asked for (default: the first one)."""
+        if not self.outputs or not names:
+            return [0]
+        if names == 'all':
+            return [layer.index for layer in self.capture.layers]
+        layers = [layer.index for layer in self.capture.layers if layer.name in names]
+        return layers or [0]
+
+    def on_window_resize(self, width, height):
+        # Called from the window tracker thread
+        GLib.idle_add(self.capture.restart_source)
+
+    async def build_pipeline(self):
+        try:
+            # Probing encoders runs test pipelines; keep signaling flowing meanwhile
+            self.encoder_spec = await self.loop.run_in_executor(None, select_encoder, self.encoder_name)
+        except PipelineBuildError as e:
+            logger.error(f"Failed to build pipeline: {e}")
+            sys.exit(1)
+        if self.screen_content:
+            self.start_screen_content()
+        self.pipelines = PipelineCache(self.build_capture, self.discard_capture, size=self.standby_pipelines,
+                                       timeout=self.setup_timeout)
+        # Prewarming waits for the first encoded frame, off the loop thread
+        await self.acquire_capture()
+
+    def build_capture(self):
+        """Build a capture pipeline for the current screen, for the standby cache."""
+        capture = self.capture if self.capture.pipeline is None else CapturePipeline(**self.capture_options)
+        try:
+            capture.build(self.encoder_spec)
+        except (PipelineBuildError, GLib.GError) as e:
             logger.error(f"Failed to build pipeline: {e}")
             sys.exit(1)
 
-        self.webrtcbin.connect('on-ice-candidate', self.on_ice_candidate)
-        self.webrtcbin.connect('on-negotiation-needed', self.on_negotiation_needed)
-        self.webrtcbin.connect('on-data-channel', self.on_data_channel)
-        self.webrtcbin.connect('notify::ice-connection-state', self.on_ice_connection_state_notify)
-        
-        # Moved create-data-channel to start() to ensure element is ready
-        
-        rtppay_src_pad = rtph264pay.get_static_pad('src')
+        bus = capture.pipeline.get_bus()
+        bus.add_signal_watch()
+        bus.connect('message', self.bus_call, None)
+        rtppay_src_pad = capture.output.get_static_pad('src')
         rtppay_src_pad.add_probe(Gst.PadProbeType.BUFFER, self.fps_probe, None)
+        self.latency_tracer.attach(capture)
+        if self.roi_tagger:
+            self.roi_tagger.attach(capture)
+        return capture
+
+    def start_screen_content(self):
+        if not RoiTagger.supported(self.encoder_spec):
+            logger.warning(f"Encoder {self.encoder_spec.name} ignores region-of-interest metadata, "
+                           "encoding the whole screen at one quality")
+            return
+        self.focus_tracker = FocusTracker()
+        try:
+            self.focus_tracker.start()
+        except Exception as e:
+            logger.warning(f"Cannot follow the focused window, only the pointer gets extra quality: {e}")
+            self.focus_tracker = None
+        self.roi_tagger = RoiTagger(self.encoder_spec, self.capture_regions, pointer=self.cursor_sender.pointer,
+                                    focus=self.focus_tracker.geometry if self.focus_tracker else None)
+        logger.info("Screen-content encoding: extra quality around the pointer and in the focused window")
+
+    def discard_capture(self, capture):
+        capture.close()
+        capture.pipeline.get_bus().remove_signal_watch()
+
+    def standby_key(self):
+        return self.screen_width, self.screen_height, self.framerate, self.encoder_spec.name
+
+    def use_capture(self, capture):
+        """Make `capture` the one new viewers attach to, parking the previous one."""
+        previous = self.capture
+        if previous is not capture and previous.pipeline:
+            previous.pause()
+        self.capture = capture
+        self.pipeline = capture.pipeline
+        self.latency_tracer.use(capture)
+        if self.adaptive_bitrate:
+            self.adaptive_bitrate.capture = capture
+
+    async def acquire_capture(self):
+        # Called by ConnectionSetup once the screen has its new size
+        capture = await self.loop.run_in_executor(None, self.pipelines.acquire, self.standby_key(), self.capture)
+        self.use_capture(capture)
+        return capture
 
     def fps_probe(self, pad, info, user_data):
         self.frame_count += 1
@@ -342,65 +501,113 @@ class WebRTCStreamer:
         if msg.type == Gst.MessageType.ERROR:
             err, debug = msg.parse_error()
             logger.error(f"Pipeline error: {err}, {debug}")
-            sys.exit(1)
+            self.request_stop(1)
         elif msg.type == Gst.MessageType.WARNING:
             err, debug = msg.parse_warning()
             logger.warning(f"Pipeline warning: {err}, {debug}")
         elif msg.type == Gst.MessageType.EOS:
             logger.info("End of stream")
-            sys.exit(0)
+            self.request_stop(0)
         return True
 
-    def start(self):
+    def request_stop(self, exit_code=0):
+        """Make run() return `exit_code`; callable from any thread."""
+        call_soon(self.loop, self._stop_requested, exit_code)
+
+    def _stop_requested(self, exit_code):
+        if not self.stopped.is_set():
+            self.exit_code = exit_code
+            self.stopped.set()
+
+    async def start(self):
         Gst.init(None)
-        self.build_pipeline()
-        
-        bus = self.pipeline.get_bus()
-        bus.add_signal_watch()
-        bus.connect('message', self.bus_call, None)
-        
-        self.pipeline.set_state(Gst.State.PLAYING)
-        logger.info("Pipeline started")
-        
-        # Create data channel after pipeline is playing to avoid assertion errors
-        # self.webrtcbin.emit('create-data-channel', 'cursor', None) 
-        # Defer data channel creation until we actually connect? 
-        # Or just create it here and hope it persists through restart? 
-        # If we restart pipeline in client_connected, this one is lost anyway.
-        # So let's just leave it here for initial state, but handle re-creation later.
-        self.webrtcbin.emit('create-data-channel', 'cursor', None)
-        
-        # Start GLib loop in a separate thread
-        t = threading.Thread(target=self.start_glib_loop)
-        t.daemon = True
-        t.start()
+        if self.virtual_display:
+            try:
+                name = self.virtual_display.start()
+            except RuntimeError as e:
+                logger.error(f"Cannot start virtual display: {e}")
+                sys.exit(1)
+            # pynput, xrandr and the X trackers all open the default display
+            os.environ['DISPLAY'] = name
+            self.capture.display_name = name
+            self.capture_options['display_name'] = name
+        else:
+            self.display_manager = DisplayManager(self.display_backend)
+        self.update_screen_resolution()
+        if self.window_tracker:
+            try:
+                self.window_tracker.start()
+            except RuntimeError as e:
+                logger.error(f"Cannot capture window: {e}")
+                sys.exit(1)
+        self.start_cursor_shapes()
+        # Built and prewarmed now, started when the first client connects
+        await self.build_pipeline()
+        logger.info("Pipeline ready")
+
+        if self.adaptive_bitrate:
+            self.adaptive_bitrate.start()
+
+        # The cursor listener outlives sessions; moves are dropped while no
+        # data channel is open.
+        self.start_mouse_capture()
 
-    async def run(self):
-        self.start()
-        await self.connect_signaling()
-        
-        # Keep running
-        while self.running:
-            await asyncio.sleep(0.1)
+        if not integrated(self.loop):
+            self.glib_thread = GLibThread()
+            self.glib_thread.start()
 
-async def main():
-    parser = argparse.ArgumentParser(description="WebRTC Host Streamer")
-    parser.add_argument('--signaling', default='http://127.0.0.1:8080/ws', help="Signaling server URL")
-    args = parser.parse_args()
+    def stop(self):
+        self.cancel_setup()
+        if self.adaptive_bitrate:
+            self.adaptive_bitrate.stop()
+        self.detach_peer()
+        if self.mouse_listener:
+            self.mouse_listener.stop()
+        self.cursor_sender.stop()
+        if self.cursor_shapes:
+            self.cursor_shapes.stop()
+        if self.window_tracker:
+            self.window_tracker.stop()
+        if self.focus_tracker:
+            self.focus_tracker.stop()
+        if self.pipelines:
+            self.pipelines.close()
+        if self.virtual_display:
+            self.virtual_display.stop()
+        if self.glib_thread:
+            self.glib_thread.stop()
+
+    async def shutdown(self):
+        if self.metrics:
+            await self.metrics.stop()
+        self.stop()
+        if self.display_manager:
+            self.display_manager.restore()
 
-    streamer = WebRTCStreamer(args.signaling)
+    async def run(self):
+        """Stream until asked to stop; returns the exit code."""
+        await self.start()
+        if self.metrics:
+            await self.metrics.start()
+        await self.connect_signaling()
+        try:
+            self.loop.add_signal_handler(signal.SIGTERM, self.request_stop, 0)
+        except (NotImplementedError, RuntimeError):
+            pass
+        await self.stopped.wait()
+        return self.exit_code
+
+async def main(signaling_url, options):
+    streamer = WebRTCStreamer(signaling_url, **options)
     try:
-        await streamer.run()
+        return await streamer.run()
     finally:
-        streamer.display_manager.restore()
+        await streamer.shutdown()
 
 if __name__ == '__main__':
+    # GStreamer, Gdk and the signaling websocket on one thread
+    use_glib_loop()
     try:
-        asyncio.run(main())
-        # If we get here, main() finished normally (disconnect)
-        # Restart the process
-        logger.info("Restarting streamer process...")
-        time.sleep(1) # Brief pause
-        os.execv(sys.executable, [sys.executable] + sys.argv)
+        sys.exit(asyncio.run(main(ARGS.signaling, OPTIONS)))
     except KeyboardInterrupt:
-        pass
\ No newline at end of file
+        pass
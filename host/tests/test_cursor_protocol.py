@@ -0,0 +1,22 @@
+from cursor_protocol import (FLAG_LEFT, FLAG_MIDDLE, MSG_POSITION, POSITION, PROTOCOL_VERSION, QUANT_MAX,
+                             TRACK_NONE, pack_position)
+
+
+def test_position_round_trip():
+    packet = pack_position(513, 123456, 0.25, 0.75, FLAG_LEFT | FLAG_MIDDLE, 2)
+    assert len(packet) == POSITION.size == 14
+    version, kind, flags, seq, timestamp, x, y, track = POSITION.unpack(packet)
+    assert (version, kind, flags, seq, timestamp, track) == (PROTOCOL_VERSION, MSG_POSITION, 0x05, 513, 123456, 2)
+    assert abs(x / QUANT_MAX - 0.25) <= 0.5 / QUANT_MAX
+    assert abs(y / QUANT_MAX - 0.75) <= 0.5 / QUANT_MAX
+
+
+def test_position_is_big_endian():
+    packet = pack_position(0x0102, 0x03040506, 0.0, 1.0, 0, TRACK_NONE)
+    assert packet == bytes([PROTOCOL_VERSION, MSG_POSITION, 0, 0x01, 0x02, 0x03, 0x04, 0x05, 0x06,
+                            0x00, 0x00, 0xFF, 0xFF, 0xFF])
+
+
+def test_position_wraps_counters_and_clamps_coordinates():
+    _, _, _, seq, timestamp, x, y, _ = POSITION.unpack(pack_position(0x10001, 2 ** 32 + 7, -0.5, 1.5))
+    assert (seq, timestamp, x, y) == (1, 7, 0, QUANT_MAX)
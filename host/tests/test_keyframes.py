@@ -0,0 +1,60 @@
+"""Host keyframe requests against a real pipeline; skipped without GStreamer."""
+import time
+
+import pytest
+
+gi = pytest.importorskip('gi')
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+from encoders import select_encoder
+from pipeline import CapturePipeline, PipelineBuildError
+
+from benchmarks.loopback import connect_loopback, run_glib_loop
+
+
+@pytest.fixture
+def streaming():
+    """A test-source capture streaming to a loopback peer: (capture, peer)."""
+    Gst.init(None)
+    try:
+        spec = select_encoder()
+    except PipelineBuildError as e:
+        pytest.skip(str(e))
+    loop = run_glib_loop()
+    capture = CapturePipeline(test_source=True, test_resolution=(320, 240), keyframe_interval=100000)
+    capture.build(spec)
+    capture.start()
+    session, peer, elapsed = connect_loopback(capture, 0, 10)
+    try:
+        assert elapsed is not None, "loopback peer never received a frame"
+        yield capture, peer
+    finally:
+        session.detach()
+        peer.stop()
+        capture.close()
+        loop.quit()
+
+
+def test_request_keyframe_reaches_encoder(streaming):
+    capture, peer = streaming
+    # Past the rate limit of the keyframe the connect itself asked for
+    time.sleep(capture.keyframe_min_interval * 2)
+    forced = capture.keyframes_forced
+    requested_at = time.perf_counter()
+    capture.request_keyframe()
+    assert capture.keyframes_forced == forced + 1
+
+    deadline = requested_at + 5
+    while time.perf_counter() < deadline and not any(t >= requested_at for t in peer.keyframe_times):
+        time.sleep(0.01)
+    assert any(t >= requested_at for t in peer.keyframe_times), "no keyframe after request_keyframe()"
+
+
+def test_repeated_requests_are_rate_limited(streaming):
+    capture, peer = streaming
+    time.sleep(capture.keyframe_min_interval * 2)
+    forced = capture.keyframes_forced
+    capture.request_keyframe()
+    capture.request_keyframe()
+    assert capture.keyframes_forced == forced + 1
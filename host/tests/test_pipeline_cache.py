@@ -0,0 +1,72 @@
+import pytest
+
+from pipeline_cache import PipelineCache
+
+
+class FakeCapture:
+    def __init__(self, name):
+        self.name = name
+        self.prewarmed = False
+
+    def prewarm(self, timeout):
+        self.prewarmed = True
+        return True
+
+    def __repr__(self):
+        return f"FakeCapture({self.name})"
+
+
+def make_cache(size):
+    built = iter(range(100))
+    discarded = []
+    cache = PipelineCache(lambda: FakeCapture(next(built)), discarded.append, size=size)
+    return cache, discarded
+
+
+def test_hit_returns_parked_pipeline():
+    cache, discarded = make_cache(2)
+    first = cache.acquire('a')
+    assert first.prewarmed
+    assert cache.acquire('a') is first
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert discarded == []
+
+
+def test_evicts_least_recently_used():
+    cache, discarded = make_cache(2)
+    a = cache.acquire('a')
+    b = cache.acquire('b')
+    c = cache.acquire('c')
+    assert discarded == []
+    # 'a' is refreshed, so 'b' is the oldest when 'd' comes in
+    cache.acquire('a')
+    cache.acquire('d')
+    assert discarded == [b]
+    assert list(cache.entries) == ['c', 'a', 'd']
+    assert c in cache.entries.values() and a in cache.entries.values()
+
+
+def test_pipeline_in_use_is_never_evicted():
+    cache, discarded = make_cache(1)
+    streaming = cache.acquire('a')
+    # Switching modes twice while 'a' still streams: 'b' goes, 'a' stays
+    cache.acquire('b', in_use=streaming)
+    cache.acquire('c', in_use=streaming)
+    assert streaming not in discarded
+    assert [capture.name for capture in discarded] == [1]
+    assert list(cache.entries) == ['a', 'c']
+
+
+def test_acquired_pipeline_is_never_evicted():
+    cache, discarded = make_cache(1)
+    a = cache.acquire('a')
+    b = cache.acquire('b', in_use=a)
+    assert discarded == []
+    c = cache.acquire('c', in_use=b)
+    assert discarded == [a]
+    assert list(cache.entries.values()) == [b, c]
+
+
+def test_size_must_be_positive():
+    with pytest.raises(ValueError):
+        PipelineCache(lambda: None, size=0)
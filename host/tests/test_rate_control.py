@@ -0,0 +1,69 @@
+import pytest
+
+from rate_control import BitrateController, FecController, LinkStats
+
+
+def controller(**kwargs):
+    kwargs.setdefault('start_bitrate', 10000)
+    return BitrateController(min_bitrate=2000, max_bitrate=30000, **kwargs)
+
+
+def test_clean_link_grows_multiplicatively():
+    rc = controller()
+    assert rc.update(LinkStats(rtt=0.005, fraction_lost=0.0)) == pytest.approx(10800)
+    assert rc.update(LinkStats(rtt=0.005, fraction_lost=0.0)) == pytest.approx(11664)
+
+
+def test_moderate_loss_holds():
+    rc = controller()
+    assert rc.update(LinkStats(rtt=0.005, fraction_lost=0.05)) == pytest.approx(10000)
+
+
+def test_heavy_loss_cuts_in_proportion():
+    rc = controller()
+    assert rc.update(LinkStats(rtt=0.005, fraction_lost=0.20)) == pytest.approx(9000)
+
+
+def test_rising_rtt_cuts():
+    rc = controller()
+    rc.update(LinkStats(rtt=0.005, fraction_lost=0.05))
+    # 14ms is within 10ms of the lowest RTT, so still not congested
+    assert rc.update(LinkStats(rtt=0.014, fraction_lost=0.05)) == pytest.approx(10000)
+    assert rc.update(LinkStats(rtt=0.030, fraction_lost=0.0)) == pytest.approx(8500)
+
+
+def test_loss_from_nacks_without_fraction_lost():
+    rc = controller()
+    assert rc.update(LinkStats(packets_sent=1000, nack_count=0)) == pytest.approx(10800)
+    assert rc.update(LinkStats(packets_sent=2000, nack_count=150)) == pytest.approx(9990)
+    assert rc.last_loss == pytest.approx(0.15)
+
+
+def test_capped_below_available_bitrate():
+    rc = controller()
+    assert rc.update(LinkStats(fraction_lost=0.0, available_bitrate=5000)) == pytest.approx(4500)
+
+
+def test_clamped_to_floor_and_ceiling():
+    rc = controller()
+    for _ in range(20):
+        rc.update(LinkStats(fraction_lost=0.9))
+    assert rc.bitrate == 2000
+    for _ in range(50):
+        rc.update(LinkStats(fraction_lost=0.0))
+    assert rc.bitrate == 30000
+
+
+def test_fec_ramps_up_at_once():
+    fec = FecController()
+    assert fec.percentage == FecController.START_PERCENTAGE
+    assert fec.update(0.12) == 24
+    assert fec.update(0.4) == 50
+
+
+def test_fec_decays_gradually():
+    fec = FecController(start_percentage=24)
+    assert [fec.update(0.0) for _ in range(4)] == [22, 20, 18, 16]
+    # Decay stops at the target for the current loss
+    fec = FecController(start_percentage=24)
+    assert [fec.update(0.1) for _ in range(3)] == [22, 20, 20]
@@ -0,0 +1,36 @@
+from cursor_protocol import SHAPE_IMAGE, SHAPE_REF, CursorShape, ShapeCache
+
+
+def test_use_does_not_insert():
+    cache = ShapeCache(size=2)
+    assert not cache.use(b'a')
+    assert list(cache.entries) == []
+
+
+def test_add_evicts_least_recently_used():
+    cache = ShapeCache(size=3)
+    for key in (b'a', b'b', b'c'):
+        cache.add(key)
+    cache.add(b'd')
+    assert list(cache.entries) == [b'b', b'c', b'd']
+    assert not cache.use(b'a')
+
+
+def test_use_refreshes_recency():
+    cache = ShapeCache(size=3)
+    for key in (b'a', b'b', b'c'):
+        cache.add(key)
+    assert cache.use(b'a')
+    cache.add(b'd')
+    assert list(cache.entries) == [b'c', b'a', b'd']
+    cache.add(b'b')
+    assert list(cache.entries) == [b'a', b'd', b'b']
+
+
+def test_shape_messages_address_by_content():
+    pixels = bytes(range(16))
+    shape = CursorShape(2, 2, 1, 0, pixels)
+    assert CursorShape(2, 2, 1, 0, pixels).hash == shape.hash
+    assert CursorShape(2, 2, 0, 0, pixels).hash != shape.hash
+    assert SHAPE_IMAGE.unpack(shape.image_message()[:SHAPE_IMAGE.size])[2:] == (shape.hash, 2, 2, 1, 0)
+    assert SHAPE_REF.unpack(shape.ref_message())[2] == shape.hash
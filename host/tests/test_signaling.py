@@ -0,0 +1,62 @@
+import asyncio
+import json
+
+from signaling_server import Connection
+
+
+class FakeSocket:
+    closed = False
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_str(self, text):
+        self.sent.append(json.loads(text))
+
+    async def close(self):
+        self.closed = True
+
+
+def candidate(session, n):
+    return {'type': 'ice-candidate', 'session': session, 'candidate': f"c{n}", 'sdpMid': 'video0', 'sdpMLineIndex': 0}
+
+
+def relay(messages, batch_window=0.05, settle=0.1):
+    """What a Connection writes for `messages`, sent back to back."""
+    async def run():
+        ws = FakeSocket()
+        conn = Connection(ws, batch_window=batch_window)
+        for message in messages:
+            if message['type'] == 'ice-candidate':
+                conn.send_candidate(message)
+            else:
+                conn.send(message)
+        await asyncio.sleep(settle)
+        await conn.close()
+        return ws.sent
+    return asyncio.run(run())
+
+
+def test_candidates_are_batched():
+    sent = relay([candidate(1, n) for n in range(3)])
+    assert [m['type'] for m in sent] == ['ice-candidates']
+    assert [c['candidate'] for c in sent[0]['candidates']] == ['c0', 'c1', 'c2']
+
+
+def test_offer_flushes_earlier_candidates_first():
+    sent = relay([{'type': 'offer', 'session': 1, 'sdp': 'a'}, candidate(1, 0), candidate(1, 1),
+                  {'type': 'offer', 'session': 1, 'sdp': 'b'}, candidate(1, 2)])
+    assert [m['type'] for m in sent] == ['offer', 'ice-candidates', 'offer', 'ice-candidate']
+    assert sent[3]['candidate'] == 'c2'
+
+
+def test_other_sessions_keep_batching():
+    sent = relay([candidate(1, 0), {'type': 'offer', 'session': 2, 'sdp': 'a'}, candidate(1, 1)])
+    assert [m['type'] for m in sent] == ['offer', 'ice-candidates']
+
+
+def test_disconnect_drops_pending_candidates():
+    sent = relay([candidate(1, 0), {'type': 'client_disconnected', 'session': 1}])
+    assert [m['type'] for m in sent] == ['client_disconnected']
+    sent = relay([candidate(1, 0), candidate(2, 0), {'type': 'host_disconnected'}])
+    assert [m['type'] for m in sent] == ['host_disconnected']
@@ -0,0 +1,36 @@
+"""--help of the entry scripts stays fast: no GStreamer or aiohttp before arguments are parsed."""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import pytest
+
+HOST_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPTS = ('launcher.py', 'signaling_server.py', 'streamer.py')
+# Wall time of `--help`, interpreter start included
+HELP_BUDGET = 0.5
+HEAVY_MODULES = ('gi', 'aiohttp', 'pynput')
+
+
+def imported_modules(script):
+    result = subprocess.run([sys.executable, '-X', 'importtime', script, '--help'], cwd=HOST_DIR,
+                            capture_output=True, text=True, check=True)
+    return {line.split('|')[-1].strip().split('.')[0] for line in result.stderr.splitlines()
+            if line.startswith('import time:')}
+
+
+@pytest.mark.parametrize('script', SCRIPTS)
+def test_help_loads_no_heavy_modules(script):
+    assert not imported_modules(script) & set(HEAVY_MODULES)
+
+
+@pytest.mark.parametrize('script', SCRIPTS)
+def test_help_within_budget(script):
+    samples = []
+    for _ in range(3):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, script, '--help'], cwd=HOST_DIR, stdout=subprocess.DEVNULL, check=True)
+        samples.append(time.perf_counter() - t0)
+    assert statistics.median(samples) < HELP_BUDGET, f"{script} --help took {statistics.median(samples):.3f}s"
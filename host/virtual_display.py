@@ -0,0 +1,98 @@
+import logging
+import os
+import re
+import select
+import subprocess
+
+from display_manager import RandrBackend
+
+logger = logging.getLogger(__name__)
+
+
+def parse_size(text):
+    """Parse 'WIDTHxHEIGHT' into (width, height)."""
+    match = re.fullmatch(r"(\d+)x(\d+)", text.strip())
+    if not match:
+        raise ValueError(f"Expected WIDTHxHEIGHT, got '{text}'")
+    return int(match.group(1)), int(match.group(2))
+
+
+class VirtualDisplay:
+    """A private X display streamed instead of the physical screen.
+
+    Either spawns an Xvfb (`display_name=None`) or attaches to a running
+    server such as Xorg with xf86-video-dummy (`display_name=':N'`). A
+    spawned Xvfb gets a `max_size` framebuffer so RandR can later shrink or
+    grow the screen to any client resolution up to it; nothing is scaled and
+    the local monitor is never touched.
+    """
+
+    def __init__(self, display_name=None, size=(1920, 1080), max_size=(3840, 2160), depth=24,
+                 server='Xvfb', timeout=5.0):
+        self.name = display_name
+        self.size = size
+        self.max_size = max_size
+        self.depth = depth
+        self.server = server
+        self.timeout = timeout
+        self.process = None
+        self.randr = None
+
+    def start(self):
+        spawned = self.name is None
+        if spawned:
+            self.name = self.spawn()
+        try:
+            self.randr = RandrBackend(self.name)
+        except Exception as e:
+            self.stop()
+            raise RuntimeError(f"Cannot drive virtual display {self.name}: {e}")
+        if spawned:
+            # Until the first client asks for its own size
+            self.resize(min(self.size[0], self.max_size[0]), min(self.size[1], self.max_size[1]))
+        logger.info(f"Streaming virtual display {self.name}")
+        return self.name
+
+    def spawn(self):
+        read_fd, write_fd = os.pipe()
+        width, height = self.max_size
+        # -displayfd picks a free display number and writes it once the server accepts clients
+        command = [self.server, '-displayfd', str(write_fd), '-screen', '0', f"{width}x{height}x{self.depth}",
+                   '-nolisten', 'tcp', '+extension', 'RANDR', '+extension', 'DAMAGE', '+extension', 'XFIXES']
+        try:
+            self.process = subprocess.Popen(command, pass_fds=(write_fd,), stdin=subprocess.DEVNULL,
+                                            stdout=subprocess.DEVNULL)
+        except OSError as e:
+            raise RuntimeError(f"Cannot start {self.server}: {e}")
+        finally:
+            os.close(write_fd)
+        try:
+            number = b""
+            while not number.endswith(b"\n"):
+                ready, _, _ = select.select([read_fd], [], [], self.timeout)
+                chunk = os.read(read_fd, 16) if ready else b""
+                if not chunk:
+                    self.stop()
+                    raise RuntimeError(f"{self.server} did not start")
+                number += chunk
+        finally:
+            os.close(read_fd)
+        logger.info(f"Started {self.server} on :{number.decode().strip()} ({width}x{height} maximum)")
+        return f":{number.decode().strip()}"
+
+    def resize(self, width, height):
+        """Resize the screen to width x height; True once it has changed."""
+        return self.randr.set_screen_size(width, height)
+
+    def stop(self):
+        if self.randr:
+            self.randr.close()
+            self.randr = None
+        if self.process:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=self.timeout)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+            self.process = None